@@ -11,6 +11,22 @@ import os
 
 from django.core.asgi import get_asgi_application
 
+from core.asgi import RequestBodyLimitMiddleware
+from core.tracing import configure_tracing
+
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
 
+configure_tracing("backend")
+
 application = get_asgi_application()
+
+from django.conf import settings  # noqa: E402
+
+if settings.DEBUG:
+    # Serve the admin static files in development, like runserver does
+    from django.contrib.staticfiles.handlers import ASGIStaticFilesHandler
+
+    application = ASGIStaticFilesHandler(application)
+
+# Django receives the whole body before the view runs, bound it beforehand
+application = RequestBodyLimitMiddleware(application, settings.REQUEST_BODY_MAX_BYTES)
@@ -3,7 +3,11 @@ from __future__ import absolute_import
 import os
 
 from celery import Celery
+from celery.signals import worker_process_init, worker_process_shutdown
 from django.conf import settings
+from prometheus_client import multiprocess
+
+from core.tracing import configure_tracing
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "app.settings")
 
@@ -13,3 +17,14 @@ app.config_from_object("django.conf:settings", namespace="CELERY")
 
 app.autodiscover_tasks(lambda: settings.INSTALLED_APPS)
 
+
+@worker_process_init.connect
+def init_worker_process(**kwargs):
+    # Span exporters run a thread, which does not survive forking the pool
+    configure_tracing("thumbnail-worker")
+
+
+@worker_process_shutdown.connect
+def shutdown_worker_process(pid, **kwargs):
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(pid)
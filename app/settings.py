@@ -133,7 +133,74 @@ USE_TZ = True
 STATIC_URL = "static/"
 
 MEDIA_URL = "/media/"
-MEDIA_ROOT = os.path.join(BASE_DIR, "media")
+MEDIA_ROOT = os.environ.get("MEDIA_ROOT", os.path.join(BASE_DIR, "media"))
+
+# Images and thumbnails are only read and written through the default
+# storage: "local" keeps them in MEDIA_ROOT, "s3" in an S3 compatible bucket
+# (MinIO in docker-compose), so web and worker nodes share no volume.
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "local")
+STORAGES = {
+    "default": {"BACKEND": "core.storage.MediaStorage"},
+    "staticfiles": {
+        "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage",
+    },
+}
+
+# Longest time in seconds browsers and CDNs may cache media files.
+MEDIA_CACHE_MAX_AGE = 365 * 24 * 60 * 60
+
+S3_STORAGE_OPTIONS = {
+    "bucket_name": os.environ.get("AWS_STORAGE_BUCKET_NAME", "images"),
+    "endpoint_url": os.environ.get("AWS_S3_ENDPOINT_URL"),
+    "access_key": os.environ.get("AWS_ACCESS_KEY_ID"),
+    "secret_key": os.environ.get("AWS_SECRET_ACCESS_KEY"),
+    "region_name": os.environ.get("AWS_S3_REGION_NAME"),
+    # Names are derived from the content, so existing files are
+    # replaced rather than renamed. Files over 8 MB are sent by boto3
+    # as parallel multipart uploads.
+    "file_overwrite": True,
+    # File URLs are not signed, so they stay the same between responses and
+    # are cached for good. AWS_S3_CUSTOM_DOMAIN is the host and path browsers
+    # reach the bucket at, when it is not the endpoint of the backend.
+    "querystring_auth": False,
+    "custom_domain": os.environ.get("AWS_S3_CUSTOM_DOMAIN") or None,
+    "url_protocol": os.environ.get("AWS_S3_URL_PROTOCOL", "https:"),
+    "object_parameters": {
+        "CacheControl": f"public, max-age={MEDIA_CACHE_MAX_AGE}, immutable",
+    },
+}
+if STORAGE_BACKEND == "s3":
+    STORAGES["default"] = {
+        "BACKEND": "storages.backends.s3.S3Storage",
+        "OPTIONS": S3_STORAGE_OPTIONS,
+    }
+
+# Uploads are hashed while they are received to deduplicate their content,
+# and images are checked against the limits below from their header.
+FILE_UPLOAD_HANDLERS = [
+    "userImages.upload_handlers.ImageMemoryFileUploadHandler",
+    "userImages.upload_handlers.ImageTemporaryFileUploadHandler",
+]
+# Large uploads are streamed next to the stored images, so saving them is a
+# rename on the same filesystem rather than a copy.
+FILE_UPLOAD_TEMP_DIR = os.path.join(MEDIA_ROOT, "tmp")
+
+# Largest uploaded image, in bytes and in pixels.
+IMAGE_UPLOAD_MAX_BYTES = int(os.environ.get("IMAGE_UPLOAD_MAX_BYTES", "67108864"))
+IMAGE_UPLOAD_MAX_PIXELS = int(os.environ.get("IMAGE_UPLOAD_MAX_PIXELS", "100000000"))
+# Largest request body under ASGI, rejected at the ASGI layer since Django
+# receives the whole body before the upload handlers see it.
+REQUEST_BODY_MAX_BYTES = int(
+    os.environ.get("REQUEST_BODY_MAX_BYTES", str(256 * 1024 * 1024))
+)
+# Bytes of an upload read at most to find its image header.
+IMAGE_HEADER_MAX_BYTES = 256 * 1024
+
+# Hand file delivery of expiring links to the front proxy: "nginx" sends
+# X-Accel-Redirect to SENDFILE_URL + file name, "apache" sends X-Sendfile with
+# the file path. Empty streams the file from Django.
+SENDFILE_BACKEND = os.environ.get("SENDFILE_BACKEND", "")
+SENDFILE_URL = os.environ.get("SENDFILE_URL", "/protected-media/")
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
@@ -143,9 +210,149 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 AUTH_USER_MODEL = "core.User"
 
-REDIS_HOST = 'redis'
+REDIS_HOST = "redis"
 REDIS_PORT = 6379
 REDIS_DB = 2
 
+# Cache of tier entitlements and upload rate limits, shared by all processes
+# with Redis. Without CACHE_REDIS_URL every process has its own memory cache.
+CACHE_REDIS_URL = os.environ.get("CACHE_REDIS_URL", "")
+CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+}
+if CACHE_REDIS_URL:
+    CACHES["default"] = {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": CACHE_REDIS_URL,
+    }
+
+# Seconds custom tier entitlements are cached, in the shared cache and in the
+# memory of each process. Changes to a custom tier reach other processes
+# after at most ENTITLEMENTS_LOCAL_TIMEOUT.
+ENTITLEMENTS_CACHE_TIMEOUT = 60 * 60
+ENTITLEMENTS_LOCAL_TIMEOUT = 10
+
+# Upload token buckets per tier: (burst of images, images per minute).
+UPLOAD_RATE_LIMITS = {
+    "Basic": (20, 10),
+    "Premium": (100, 60),
+    "Enterprise": (500, 600),
+    "Custom": (500, 600),
+}
+
 CELERY_BROKER_URL = "redis://redis:6379/0"
-CELERY_RESULT_BACKEND = "redis://redis:6379/0"
\ No newline at end of file
+CELERY_RESULT_BACKEND = "redis://redis:6379/0"
+
+# Thumbnail tasks are long and CPU bound: reserve one task at a time per
+# worker process and only acknowledge it once it has finished, so a lost
+# worker puts the task back in the queue.
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+CELERY_TASK_ACKS_LATE = True
+CELERY_TASK_REJECT_ON_WORKER_LOST = True
+CELERY_BROKER_TRANSPORT_OPTIONS = {
+    "priority_steps": list(range(10)),
+    "sep": ":",
+    "queue_order_strategy": "priority",
+}
+
+# Queue and priority of thumbnail jobs per tier. With the Redis transport
+# 0 is the highest priority.
+THUMBNAIL_ROUTES = {
+    "Basic": {"queue": "thumbnails.basic", "priority": 6},
+    "Premium": {"queue": "thumbnails.premium", "priority": 3},
+    "Enterprise": {"queue": "thumbnails.enterprise", "priority": 0},
+    "Custom": {"queue": "thumbnails.custom", "priority": 0},
+}
+CELERY_TASK_DEFAULT_QUEUE = "thumbnails.basic"
+# A thumbnail job already queued or running is not queued again until it
+# finishes or this many seconds pass. Claims are kept in the default cache,
+# shared by the web processes and workers when it is Redis.
+THUMBNAIL_JOB_DEDUP_SECONDS = 600
+# Retries of thumbnail jobs failing on an unreachable storage or database,
+# after random delays of up to 2, 4, 8... seconds, at most the maximum.
+THUMBNAIL_TASK_MAX_RETRIES = 5
+THUMBNAIL_TASK_RETRY_BACKOFF = 2
+THUMBNAIL_TASK_RETRY_BACKOFF_MAX = 300
+# Priority of the jobs queued by the rethumbnail_images backfill, after
+# every tier's uploads.
+THUMBNAIL_BACKFILL_PRIORITY = 9
+
+# Worker pools started by the run_thumbnail_workers command: queue name to
+# (max, min) autoscaled concurrency.
+THUMBNAIL_WORKER_POOLS = {
+    "thumbnails.enterprise": (4, 1),
+    "thumbnails.custom": (2, 1),
+    "thumbnails.premium": (2, 1),
+    "thumbnails.basic": (1, 1),
+}
+# Other queues consumed by a pool. Earlier versions sent thumbnail jobs to
+# Celery's default "celery" queue, the basic pool drains it.
+THUMBNAIL_WORKER_EXTRA_QUEUES = {"thumbnails.basic": ["celery"]}
+
+# Where thumbnails are rendered: "celery", "process" (local process pool)
+# or "sync" (in the request thread).
+THUMBNAIL_BACKEND = os.environ.get("THUMBNAIL_BACKEND", "celery")
+# Number of processes of the "process" backend, defaults to available cores.
+THUMBNAIL_PROCESS_POOL_SIZE = int(os.environ.get("THUMBNAIL_PROCESS_POOL_SIZE", "0"))
+
+# Library rendering thumbnails: "pillow" or "vips" (libvips through pyvips,
+# streaming and shrinking large sources while they are decoded).
+THUMBNAIL_ENGINE = os.environ.get("THUMBNAIL_ENGINE", "pillow")
+
+# Encoder of the thumbnails rendered at upload time, per tier. "format" is
+# the Pillow format name, the other keys are passed to Image.save.
+THUMBNAIL_ENCODERS = {
+    "Basic": {"format": "JPEG", "quality": 75, "optimize": True, "progressive": True},
+    "Premium": {"format": "JPEG", "quality": 85, "optimize": True, "progressive": True},
+    "Enterprise": {
+        "format": "JPEG",
+        "quality": 90,
+        "optimize": True,
+        "progressive": True,
+    },
+    "Custom": {"format": "JPEG", "quality": 90, "optimize": True, "progressive": True},
+}
+# Formats offered to clients listing them in their Accept header, smallest
+# first. Formats this Pillow build cannot write are skipped, and the tier's
+# encoder above is the fallback.
+THUMBNAIL_NEGOTIATED_ENCODERS = [
+    {"format": "AVIF", "quality": 60, "speed": 6},
+    {"format": "WEBP", "quality": 80, "method": 4},
+]
+
+# Default and maximum number of images per page of the image list.
+IMAGE_PAGE_SIZE = 50
+IMAGE_MAX_PAGE_SIZE = 500
+
+# Most images of a gallery page packed in one sprite, and the widest sprite
+# in pixels, thumbnails wrapping to a new row beyond it.
+SPRITE_MAX_IMAGES = 100
+SPRITE_MAX_WIDTH = 2048
+
+# Render the tier thumbnails at upload time. When disabled they are only
+# rendered on request through /api/images/<id>/thumb/<height>/.
+THUMBNAIL_EAGER_RENDITIONS = True
+
+# On demand renditions are cached in memory and on disk, each tier bounded
+# to a number of bytes.
+RENDITION_CACHE_DIR = os.path.join(BASE_DIR, "rendition-cache")
+RENDITION_CACHE_MEMORY_BYTES = 64 * 1024 * 1024
+RENDITION_CACHE_DISK_BYTES = 1024 * 1024 * 1024
+
+# Bearer token required to scrape /metrics, open when empty. The thumbnail
+# workers serve their metrics on METRICS_WORKER_PORT, 0 to disable it.
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+METRICS_WORKER_PORT = int(os.environ.get("METRICS_WORKER_PORT", "0"))
+
+# Longest wait, in seconds, a client may ask /api/images/<id>/renditions/ to
+# hold the response while thumbnails are pending, and how often it checks.
+RENDITION_MAX_WAIT = 30
+RENDITION_POLL_INTERVAL = 0.5
+
+# Maximum number of images accepted by one bulk upload request.
+BULK_UPLOAD_MAX_FILES = int(os.environ.get("BULK_UPLOAD_MAX_FILES", "500"))
+# Largest total uncompressed size of the images of a bulk upload archive.
+BULK_UPLOAD_MAX_ARCHIVE_BYTES = int(
+    os.environ.get("BULK_UPLOAD_MAX_ARCHIVE_BYTES", str(1024 * 1024 * 1024))
+)
+DATA_UPLOAD_MAX_NUMBER_FILES = BULK_UPLOAD_MAX_FILES + 1
@@ -14,10 +14,11 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+import re
+
 from django.conf import settings
-from django.conf.urls.static import static
 from django.contrib import admin
-from django.urls import include, path
+from django.urls import include, path, re_path
 from rest_framework import routers
 
 from userImages import views
@@ -27,13 +28,26 @@ router.register(r"images", views.ImageUploadView, basename="image")
 
 urlpatterns = [
     path("admin/", admin.site.urls),
+    # Long-polled asynchronously, ahead of the image routes
+    path(
+        "api/images/<str:pk>/renditions/",
+        views.RenditionStatusView.as_view(),
+        name="image-renditions",
+    ),
     path("api/", include(router.urls)),
     path(
         "api/expiring-image/<str:signed_data>/",
         views.ExpiringImageView.as_view(),
         name="expiring-image",
     ),
+    path("metrics", views.metrics_view, name="metrics"),
 ]
 
 if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    urlpatterns += [
+        re_path(
+            r"^%s(?P<path>.*)$" % re.escape(settings.MEDIA_URL.lstrip("/")),
+            views.serve_media,
+            name="media",
+        ),
+    ]
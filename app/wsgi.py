@@ -11,6 +11,10 @@ import os
 
 from django.core.wsgi import get_wsgi_application
 
+from core.tracing import configure_tracing
+
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
 
+configure_tracing("backend")
+
 application = get_wsgi_application()
@@ -6,3 +6,4 @@ from . import models
 admin.site.register(models.Image)
 admin.site.register(models.User)
 admin.site.register(models.CustomTier)
+admin.site.register(models.Rendition)
@@ -0,0 +1,69 @@
+"""
+ASGI middleware limiting the size of request bodies.
+
+Django's ASGI handler receives the whole request body into a temporary file
+before the view or any upload handler runs, so the upload handlers cannot
+reject an oversized upload while it streams in as they do under WSGI. The
+middleware bounds the body at the ASGI layer instead.
+"""
+import json
+
+
+class RequestBodyTooLarge(Exception):
+    """The request body is over the limit."""
+
+
+class RequestBodyLimitMiddleware:
+    """
+    Answer HTTP requests whose body is over ``max_bytes`` with a 413.
+
+    Requests announcing a larger Content-Length are rejected before any of
+    the body is received. Other bodies are counted while they are received,
+    and the request is rejected as soon as the limit is passed.
+    """
+
+    def __init__(self, app, max_bytes):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        content_length = dict(scope["headers"]).get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > self.max_bytes:
+            return await self.reject(send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise RequestBodyTooLarge
+            return message
+
+        try:
+            await self.app(scope, limited_receive, send)
+        except RequestBodyTooLarge:
+            # Raised while Django reads the body, before it starts a response
+            await self.reject(send)
+
+    async def reject(self, send):
+        body = json.dumps(
+            {"detail": f"Request body is larger than {self.max_bytes} bytes."}
+        ).encode()
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 413,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"connection", b"close"),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,170 @@
+"""
+Execution backends for thumbnail rendering.
+
+The backend is chosen with the ``THUMBNAIL_BACKEND`` setting:
+
+* ``celery`` queues the work on the Celery broker (default).
+* ``process`` renders in a local process pool, no broker or worker needed.
+* ``sync`` renders in the calling thread, useful for tests.
+
+Uploads submit their jobs with ``submit_on_commit``, once their rows are
+committed.
+"""
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from celery import group
+from django import db
+from django.conf import settings
+from django.db import transaction
+
+from .encoders import thumbnail_encoder
+from .tasks import (
+    claim_job,
+    create_thumbnails,
+    job_id,
+    record_renditions,
+    release_job,
+    render_thumbnails,
+)
+
+
+class BaseBackend:
+    """Render the renditions of an image with the encoder of its tier."""
+
+    def submit(self, image_path, renditions, tier=None):
+        raise NotImplementedError
+
+    def submit_many(self, jobs):
+        """Submit a list of ``(image_path, renditions, tier)`` jobs."""
+        for job in jobs:
+            self.submit(*job)
+
+    def submit_on_commit(self, jobs):
+        """
+        Submit the jobs once the current transaction commits.
+
+        Jobs never see the rows of an upload before they are committed, and
+        are dropped with them on rollback. Errors submitting them are logged
+        without failing the committed request.
+        """
+        if jobs:
+            transaction.on_commit(lambda: self.submit_many(jobs), robust=True)
+
+
+def thumbnail_route(tier):
+    """Return the Celery queue and priority of a tier's thumbnail jobs."""
+    routes = settings.THUMBNAIL_ROUTES
+    return routes.get(tier, routes["Basic"])
+
+
+class CeleryBackend(BaseBackend):
+    """
+    Queue thumbnail rendering as a Celery task.
+
+    Jobs go to the queue and priority of their tier, so bursts on one tier do
+    not delay the others. A ``priority`` given to the backend overrides the
+    tier's, for background work that must yield to uploads.
+    """
+
+    def __init__(self, priority=None):
+        self.priority = priority
+
+    def signature(self, image_path, renditions, tier=None):
+        encoder = thumbnail_encoder(tier)
+        route = thumbnail_route(tier)
+        if self.priority is not None:
+            route = {**route, "priority": self.priority}
+        return create_thumbnails.s(image_path, renditions, encoder).set(
+            task_id=job_id(image_path, renditions, encoder), **route
+        )
+
+    def submit(self, image_path, renditions, tier=None):
+        self.submit_many([(image_path, renditions, tier)])
+
+    def submit_many(self, jobs):
+        """
+        Queue all the jobs at once as a Celery group.
+
+        Jobs identical to one still queued or running are left out, so client
+        retries and backfills do not render the same thumbnails twice.
+        """
+        signatures = [self.signature(*job) for job in jobs]
+        signatures = [signature for signature in signatures if claim_job(signature.id)]
+        try:
+            if len(signatures) == 1:
+                signatures[0].apply_async()
+            elif signatures:
+                group(signatures).apply_async()
+        except Exception:
+            for signature in signatures:
+                release_job(signature.id)
+            raise
+
+
+class ProcessPoolBackend(BaseBackend):
+    """Render thumbnails in a process pool shared by the whole web process."""
+
+    executor = None
+
+    @classmethod
+    def get_executor(cls):
+        if cls.executor is None:
+            max_workers = settings.THUMBNAIL_PROCESS_POOL_SIZE or len(
+                os.sched_getaffinity(0)
+            )
+            # Spawned workers do not inherit the server's threads or database
+            # connections, so they set Django up on their own.
+            cls.executor = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=django.setup,
+            )
+        return cls.executor
+
+    def submit(self, image_path, renditions, tier=None):
+        future = self.get_executor().submit(
+            render_thumbnails, image_path, renditions, thumbnail_encoder(tier)
+        )
+        future.add_done_callback(self.record)
+
+    @staticmethod
+    def record(future):
+        """Record the outcome of a job in the web process, off the pool."""
+        try:
+            record_renditions(future.result())
+        finally:
+            # Callbacks run on the executor's thread, which has its own
+            # database connection
+            db.connection.close()
+
+
+class SyncBackend(BaseBackend):
+    """Render thumbnails immediately in the calling thread."""
+
+    def submit(self, image_path, renditions, tier=None):
+        record_renditions(
+            render_thumbnails(image_path, renditions, thumbnail_encoder(tier))
+        )
+
+
+BACKENDS = {
+    "celery": CeleryBackend,
+    "process": ProcessPoolBackend,
+    "sync": SyncBackend,
+}
+
+
+def get_thumbnail_backend(name=None):
+    """Return the thumbnail backend named, by default the one in settings."""
+    name = name or settings.THUMBNAIL_BACKEND
+    try:
+        backend_class = BACKENDS[name]
+    except KeyError:
+        raise ValueError(
+            f"Unknown THUMBNAIL_BACKEND {name!r}, "
+            f"expected one of {', '.join(BACKENDS)}."
+        )
+    return backend_class()
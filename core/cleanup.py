@@ -0,0 +1,82 @@
+"""
+Removal of stored files no database row refers to anymore.
+
+Originals and thumbnails are shared by every image with the same content, so
+a file is only deleted once no image or rendition names it.
+"""
+import logging
+
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models.signals import post_delete, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Image, Rendition
+
+logger = logging.getLogger(__name__)
+
+# Columns naming stored files. The legacy thumbnail columns of images repeat
+# the names of their renditions.
+REFERENCES = ((Image, "original"), (Image, "file"), (Rendition, "file"))
+
+
+def referenced_names(names):
+    """Return the names an image or a rendition refers to, out of ``names``."""
+    names = list(names)
+    referenced = set()
+    for model, field in REFERENCES:
+        referenced.update(
+            model.objects.filter(**{f"{field}__in": names}).values_list(
+                field, flat=True
+            )
+        )
+    return referenced
+
+
+def delete_unreferenced_files(names, since=None):
+    """
+    Delete the stored files of ``names`` that nothing refers to anymore.
+
+    Files modified after ``since`` are kept, an upload of the same content
+    stored them again meanwhile and its image may not be committed yet. The
+    media garbage collection deletes them if they stay unreferenced.
+    """
+    names = {name for name in names if name}
+    for name in names - referenced_names(names):
+        try:
+            if since is not None and default_storage.get_modified_time(name) > since:
+                continue
+            default_storage.delete(name)
+        except FileNotFoundError:
+            pass
+        except Exception:
+            logger.exception("Error deleting %s", name)
+
+
+def image_file_names(image):
+    """Return the names of the original and thumbnails of the image."""
+    names = {
+        image.original,
+        image.file.name,
+        image.thumbnail_200px.name,
+        image.thumbnail_400px.name,
+        image.custom_thumbnail.name,
+    }
+    names.update(image.renditions.values_list("file", flat=True))
+    return names
+
+
+@receiver(pre_delete, sender=Image)
+def collect_image_files(sender, instance, **kwargs):
+    # Renditions are deleted along with the image, read them while they exist
+    instance.stored_names = image_file_names(instance)
+    instance.deleted_at = timezone.now()
+
+
+@receiver(post_delete, sender=Image)
+def delete_image_files(sender, instance, **kwargs):
+    """Delete the files of a deleted image once no other image uses them."""
+    names = getattr(instance, "stored_names", set())
+    since = getattr(instance, "deleted_at", None)
+    transaction.on_commit(lambda: delete_unreferenced_files(names, since))
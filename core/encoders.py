@@ -0,0 +1,82 @@
+"""
+Thumbnail output formats and their encoder settings.
+
+Encoders are dictionaries with the Pillow ``format`` name and the keyword
+arguments passed to ``Image.save``, for example
+``{"format": "WEBP", "quality": 80, "method": 4}``.
+"""
+import hashlib
+import json
+from io import BytesIO
+
+from django.conf import settings
+from PIL import Image
+
+FORMATS = {
+    "JPEG": {"media_type": "image/jpeg", "extension": "jpg", "alpha": False},
+    "WEBP": {"media_type": "image/webp", "extension": "webp", "alpha": True},
+    "AVIF": {"media_type": "image/avif", "extension": "avif", "alpha": True},
+}
+
+DEFAULT_ENCODER = {"format": "JPEG", "quality": 85, "optimize": True}
+
+
+def is_available(format):
+    """Return whether Pillow can write the format in this installation."""
+    Image.init()
+    return format in FORMATS and format in Image.SAVE
+
+
+def thumbnail_encoder(tier):
+    """Return the encoder of the tier's eagerly rendered thumbnails."""
+    encoders = settings.THUMBNAIL_ENCODERS
+    return encoders.get(tier, encoders["Basic"])
+
+
+def extension(encoder):
+    return FORMATS[encoder["format"]]["extension"]
+
+
+def media_type(encoder):
+    return FORMATS[encoder["format"]]["media_type"]
+
+
+def cache_tag(encoder):
+    """
+    Return a short tag telling renditions of different encoders apart.
+
+    The resize engine is part of the tag, since engines render thumbnails
+    that differ slightly.
+    """
+    options = json.dumps(
+        {**encoder, "engine": settings.THUMBNAIL_ENGINE}, sort_keys=True
+    ).encode()
+    return hashlib.sha256(options).hexdigest()[:8]
+
+
+def has_alpha(img):
+    return img.mode in ("RGBA", "LA", "PA") or (
+        img.mode == "P" and "transparency" in img.info
+    )
+
+
+def convert_for(img, encoder):
+    """Convert the image to a mode the encoder's format can store."""
+    if FORMATS[encoder["format"]]["alpha"] and has_alpha(img):
+        return img if img.mode == "RGBA" else img.convert("RGBA")
+    if img.mode not in ("RGB", "L"):
+        return img.convert("RGB")
+    return img
+
+
+def save(img, fp, encoder):
+    """Write the image to a path or file object with the encoder settings."""
+    options = {key: value for key, value in encoder.items() if key != "format"}
+    img.save(fp, encoder["format"], **options)
+
+
+def encode(img, encoder):
+    """Return the image encoded with the encoder settings."""
+    content = BytesIO()
+    save(img, content, encoder)
+    return content.getvalue()
@@ -0,0 +1,251 @@
+"""
+Resize engines decoding, resizing and encoding thumbnails.
+
+The engine is chosen with the ``THUMBNAIL_ENGINE`` setting:
+
+* ``pillow`` decodes the source with Pillow, reduced at decode time for JPEG
+  and JPEG 2000 sources (default).
+* ``vips`` streams the source through libvips, which shrinks while loading,
+  so large sources are never held in memory at full size. It needs pyvips
+  and libvips installed.
+
+Engines read the encoder dictionaries of ``core.encoders`` and render
+thumbnails of the same heights, their widths rounded within a pixel, so they
+can be swapped without rendering existing thumbnails again. The engine is
+part of the thumbnail names, so ``rethumbnail_images`` renders existing
+thumbnails with the new engine under new names.
+"""
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from PIL import Image
+
+from . import encoders
+
+try:
+    import pyvips
+except (ImportError, OSError):
+    # OSError when pyvips is installed without libvips
+    pyvips = None
+
+# Decode at no less than this multiple of the largest requested size, so the
+# final LANCZOS pass still has enough pixels to produce a sharp thumbnail.
+DRAFT_REDUCING_GAP = 2.0
+
+
+def _reduce_decode(img, height):
+    """
+    Ask the decoder for a reduced-resolution decode close to the target height.
+
+    JPEG sources use libjpeg DCT scaling through ``Image.draft`` and JPEG 2000
+    sources discard resolution levels. Other formats are decoded at full size.
+    Must be called before the image data is loaded.
+    """
+    scale = height * DRAFT_REDUCING_GAP / float(img.size[1])
+    if scale >= 1:
+        return
+    if img.format == "JPEG":
+        img.draft(None, (int(img.size[0] * scale), int(img.size[1] * scale)))
+    elif img.format == "JPEG2000":
+        reduce = 0
+        while 2 ** (reduce + 1) * scale <= 1:
+            reduce += 1
+        img.reduce = reduce
+
+
+def _resize_to_height(img, height):
+    """Shrink the image in place so it is no taller than the given height."""
+    width_percent = height / float(img.size[1])
+    new_width = int((float(img.size[0]) * float(width_percent)))
+
+    # Resize the image to the new dimensions
+    img.thumbnail((new_width, height), Image.Resampling.LANCZOS)
+
+
+class BaseEngine:
+    """
+    Render thumbnails of a source image in three stages.
+
+    ``open`` reads the header of a file object, ``load`` decodes the source
+    for thumbnails no taller than a height, then every thumbnail, largest
+    first, is ``resize``d from the previous one and ``encode``d.
+    """
+
+    name = None
+
+    def open(self, file):
+        """Return the source of the file object, reading only its header."""
+        raise NotImplementedError
+
+    def describe(self, source):
+        """Return the format name and the ``(width, height)`` of the source."""
+        raise NotImplementedError
+
+    def load(self, source, height, encoder):
+        """Return the decoded source, in a mode the encoder can store."""
+        raise NotImplementedError
+
+    def resize(self, img, height):
+        """Return the image shrunk to be no taller than the height."""
+        raise NotImplementedError
+
+    def encode(self, img, encoder):
+        """Return the image encoded with the encoder settings."""
+        raise NotImplementedError
+
+
+class PillowEngine(BaseEngine):
+    """Render thumbnails with Pillow."""
+
+    name = "pillow"
+
+    def open(self, file):
+        return Image.open(file)
+
+    def describe(self, source):
+        return source.format, source.size
+
+    def load(self, source, height, encoder):
+        _reduce_decode(source, height)
+        # Convert palette and other modes the output format cannot store
+        # before resizing. Transparency is only kept by formats with an alpha
+        # channel.
+        img = encoders.convert_for(source, encoder)
+        img.load()
+        return img
+
+    def resize(self, img, height):
+        _resize_to_height(img, height)
+        return img
+
+    def encode(self, img, encoder):
+        return encoders.encode(img, encoder)
+
+
+# Pillow names of the formats of libvips loaders, for the same metric labels.
+VIPS_LOADER_FORMATS = {
+    "jpeg": "JPEG",
+    "png": "PNG",
+    "webp": "WEBP",
+    "gif": "GIF",
+    "tiff": "TIFF",
+    "heif": "HEIF",
+    "jp2k": "JPEG2000",
+}
+
+# libvips save options of the Pillow ``Image.save`` options of encoders.
+VIPS_SAVE_OPTIONS = {
+    "JPEG": {
+        "quality": "Q",
+        "optimize": "optimize_coding",
+        "progressive": "interlace",
+    },
+    "WEBP": {"quality": "Q", "method": "effort", "lossless": "lossless"},
+    "AVIF": {"quality": "Q", "lossless": "lossless"},
+}
+
+# Width bound of libvips thumbnails, large enough for the height to decide.
+VIPS_MAX_WIDTH = 10_000_000
+
+
+class VipsSource:
+    """A file object streamed to libvips, with its header."""
+
+    def __init__(self, file):
+        self.stream = pyvips.SourceCustom()
+        self.stream.on_read(file.read)
+        self.stream.on_seek(lambda offset, whence: file.seek(offset, whence))
+        self.header = pyvips.Image.new_from_source(self.stream, "", access="sequential")
+
+
+class VipsEngine(BaseEngine):
+    """
+    Render thumbnails with libvips.
+
+    The source is streamed from storage and shrunk while it is decoded, JPEG
+    sources by DCT scaling and others line by line, so memory use follows
+    the thumbnail size rather than the source size.
+    """
+
+    name = "vips"
+
+    def __init__(self):
+        if pyvips is None:
+            raise ImproperlyConfigured(
+                "THUMBNAIL_ENGINE 'vips' requires pyvips and libvips."
+            )
+        # Every source is decoded once, cached operations only hold memory
+        pyvips.cache_set_max(0)
+
+    def open(self, file):
+        return VipsSource(file)
+
+    def describe(self, source):
+        loader = source.header.get("vips-loader").split("load")[0]
+        return (
+            VIPS_LOADER_FORMATS.get(loader, loader.upper()),
+            (source.header.width, source.header.height),
+        )
+
+    def load(self, source, height, encoder):
+        header = source.header
+        if header.hasalpha() and not encoders.FORMATS[encoder["format"]]["alpha"]:
+            # Drop the alpha channel before resizing, the way Pillow converts
+            # the mode, instead of resizing the colors weighted by it
+            img = header.extract_band(0, n=header.bands - 1).thumbnail_image(
+                VIPS_MAX_WIDTH, height=height, size="down", no_rotate=True
+            )
+        else:
+            img = pyvips.Image.thumbnail_source(
+                source.stream,
+                VIPS_MAX_WIDTH,
+                height=height,
+                size="down",
+                # Pillow does not apply the EXIF orientation either
+                no_rotate=True,
+            )
+        if img.format != "uchar":
+            img = img.colourspace("srgb" if img.bands >= 3 else "b-w")
+        # Smaller thumbnails are resized from this one, the sequential source
+        # cannot be read again
+        return img.copy_memory()
+
+    def resize(self, img, height):
+        if img.height <= height:
+            return img
+        return img.thumbnail_image(VIPS_MAX_WIDTH, height=height, size="down")
+
+    def encode(self, img, encoder):
+        format = encoder["format"]
+        options = {
+            VIPS_SAVE_OPTIONS[format][key]: value
+            for key, value in encoder.items()
+            if key in VIPS_SAVE_OPTIONS[format]
+        }
+        if format == "AVIF" and "speed" in encoder:
+            # Pillow's AVIF speed runs from 0, slowest, to 10, libvips effort
+            # from 9, slowest, to 0
+            options["effort"] = max(0, 9 - encoder["speed"])
+        if pyvips.at_least_libvips(8, 15):
+            options["keep"] = "none"
+        else:
+            options["strip"] = True
+        return img.write_to_buffer(f".{encoders.extension(encoder)}", **options)
+
+
+ENGINES = {
+    "pillow": PillowEngine,
+    "vips": VipsEngine,
+}
+
+
+def get_engine(name=None):
+    """Return the resize engine named, by default the one in settings."""
+    name = name or settings.THUMBNAIL_ENGINE
+    try:
+        engine_class = ENGINES[name]
+    except KeyError:
+        raise ValueError(
+            f"Unknown THUMBNAIL_ENGINE {name!r}, "
+            f"expected one of {', '.join(ENGINES)}."
+        )
+    return engine_class()
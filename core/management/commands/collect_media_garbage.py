@@ -0,0 +1,81 @@
+"""
+Django command to delete stored images no database row refers to.
+"""
+import posixpath
+from datetime import timedelta
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.cleanup import referenced_names
+
+
+def stored_names(storage, directory):
+    """Yield the names of the files under the directory, depth first."""
+    try:
+        directories, files = storage.listdir(directory)
+    except FileNotFoundError:
+        return
+    for name in files:
+        yield posixpath.join(directory, name)
+    for subdirectory in directories:
+        yield from stored_names(storage, posixpath.join(directory, subdirectory))
+
+
+class Command(BaseCommand):
+    """Django command to delete stored images no database row refers to."""
+
+    help = (
+        "Delete the files under images/ that no image or rendition refers to, "
+        "comparing the stored names with the database in batches."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--min-age",
+            type=int,
+            default=3600,
+            help=(
+                "Keep files modified less than this many seconds ago, whose "
+                "upload may not be committed yet."
+            ),
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Report the files that would be deleted without deleting them.",
+        )
+
+    def collect(self, names, cutoff, dry_run):
+        """Delete the unreferenced files of a batch of names."""
+        deleted = 0
+        for name in sorted(set(names) - referenced_names(names)):
+            if default_storage.get_modified_time(name) > cutoff:
+                continue
+            if dry_run:
+                self.stdout.write(name)
+            else:
+                default_storage.delete(name)
+            deleted += 1
+        return deleted
+
+    def handle(self, *args, **options):
+        """Entry point for command."""
+        cutoff = timezone.now() - timedelta(seconds=options["min_age"])
+        seen = deleted = 0
+        batch = []
+        for name in stored_names(default_storage, "images"):
+            batch.append(name)
+            if len(batch) == options["batch_size"]:
+                deleted += self.collect(batch, cutoff, options["dry_run"])
+                seen += len(batch)
+                batch = []
+        if batch:
+            deleted += self.collect(batch, cutoff, options["dry_run"])
+            seen += len(batch)
+        verb = "to delete" if options["dry_run"] else "deleted"
+        self.stdout.write(
+            self.style.SUCCESS(f"Done: {seen} files checked, {deleted} {verb}.")
+        )
@@ -0,0 +1,109 @@
+"""
+Django command to start a Celery worker pool per thumbnail queue.
+"""
+import glob
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from prometheus_client import CollectorRegistry, multiprocess, start_http_server
+
+
+class Command(BaseCommand):
+    """Django command to run thumbnail workers."""
+
+    help = (
+        "Start one autoscaled Celery worker per thumbnail queue, sized by "
+        "THUMBNAIL_WORKER_POOLS."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--queue",
+            action="append",
+            help="Only start the worker of this queue, may be repeated.",
+        )
+        parser.add_argument(
+            "--metrics-port",
+            type=int,
+            default=settings.METRICS_WORKER_PORT,
+            help="Serve the metrics of all worker processes on this port.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Print the worker commands instead of running them.",
+        )
+
+    def worker_commands(self, queues):
+        """Return the celery worker command line of every queue."""
+        commands = []
+        for queue, (max_concurrency, min_concurrency) in queues.items():
+            consumed = [queue, *settings.THUMBNAIL_WORKER_EXTRA_QUEUES.get(queue, [])]
+            commands.append(
+                [
+                    sys.executable,
+                    "-m",
+                    "celery",
+                    "-A",
+                    "app",
+                    "worker",
+                    "--loglevel=info",
+                    "-E",
+                    "-Q",
+                    ",".join(consumed),
+                    "-n",
+                    f"{queue}@%h",
+                    f"--autoscale={max_concurrency},{min_concurrency}",
+                ]
+            )
+        return commands
+
+    def serve_metrics(self, port):
+        """
+        Serve the metrics the worker processes write to the multiprocess dir.
+
+        The directory is passed on to the workers in the environment and
+        cleared first, so counters start over with the workers.
+        """
+        directory = os.environ.setdefault(
+            "PROMETHEUS_MULTIPROC_DIR", tempfile.mkdtemp(prefix="thumbnail-metrics-")
+        )
+        os.makedirs(directory, exist_ok=True)
+        for path in glob.glob(os.path.join(directory, "*.db")):
+            os.remove(path)
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry, path=directory)
+        start_http_server(port, registry=registry)
+
+    def handle(self, *args, **options):
+        """Entry point for command."""
+        queues = settings.THUMBNAIL_WORKER_POOLS
+        if options["queue"]:
+            unknown = set(options["queue"]) - set(queues)
+            if unknown:
+                raise CommandError(f"Unknown queues: {', '.join(sorted(unknown))}.")
+            queues = {queue: queues[queue] for queue in options["queue"]}
+        commands = self.worker_commands(queues)
+
+        if options["dry_run"]:
+            for command in commands:
+                self.stdout.write(" ".join(command))
+            return
+
+        if options["metrics_port"]:
+            self.serve_metrics(options["metrics_port"])
+        workers = [subprocess.Popen(command) for command in commands]
+
+        def stop(signum, frame):
+            for worker in workers:
+                worker.send_signal(signum)
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        for worker in workers:
+            worker.wait()
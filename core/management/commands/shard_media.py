@@ -0,0 +1,112 @@
+"""
+Django command to move stored images to the sharded directory layout.
+"""
+import posixpath
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.cleanup import delete_unreferenced_files
+from core.models import Image, Rendition
+from core.storage import copy_stored_file, sharded_name
+
+# Columns naming stored files, all updated when a file moves.
+FILE_COLUMNS = (
+    (Image, "original"),
+    (Image, "file"),
+    (Image, "thumbnail_200px"),
+    (Image, "thumbnail_400px"),
+    (Image, "custom_thumbnail"),
+    (Rendition, "file"),
+)
+
+
+def is_flat(name):
+    """Return whether the name is in the images directory itself."""
+    return bool(name) and posixpath.dirname(name) == "images"
+
+
+class Command(BaseCommand):
+    """Django command to move stored images to the sharded directory layout."""
+
+    help = (
+        "Move originals and thumbnails stored directly in images/ to their "
+        "shard directories. Can be interrupted and run again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=500)
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Report the files that would be moved without moving them.",
+        )
+
+    def flat_names(self, images):
+        names = set()
+        for image in images:
+            names.update(
+                name
+                for name in (
+                    image.original,
+                    image.file.name,
+                    image.thumbnail_200px.name,
+                    image.thumbnail_400px.name,
+                    image.custom_thumbnail.name,
+                )
+                if is_flat(name)
+            )
+        names.update(
+            name
+            for name in Rendition.objects.filter(image__in=images).values_list(
+                "file", flat=True
+            )
+            if is_flat(name)
+        )
+        return names
+
+    def move(self, names):
+        """
+        Move the files and the rows naming them.
+
+        Files are copied first and the old names only deleted once the rows
+        name the new ones, so an interrupted run leaves nothing dangling.
+        """
+        moved = {}
+        for name in sorted(names):
+            if not default_storage.exists(name):
+                self.stderr.write(f"{name} is missing, its rows are updated anyway.")
+            else:
+                copy_stored_file(default_storage, name, sharded_name(name))
+            moved[name] = sharded_name(name)
+
+        with transaction.atomic():
+            for name, new_name in moved.items():
+                for model, column in FILE_COLUMNS:
+                    model.objects.filter(**{column: name}).update(**{column: new_name})
+            transaction.on_commit(lambda: delete_unreferenced_files(moved))
+        return len(moved)
+
+    def handle(self, *args, **options):
+        """Entry point for command."""
+        images = Image.objects.order_by("id").iterator(chunk_size=options["chunk_size"])
+        chunk = []
+        moved = 0
+        for image in images:
+            chunk.append(image)
+            if len(chunk) == options["chunk_size"]:
+                moved += self.process_chunk(chunk, options)
+                chunk = []
+        if chunk:
+            moved += self.process_chunk(chunk, options)
+        verb = "to move" if options["dry_run"] else "moved"
+        self.stdout.write(self.style.SUCCESS(f"Done: {moved} files {verb}."))
+
+    def process_chunk(self, images, options):
+        names = self.flat_names(images)
+        if options["dry_run"]:
+            for name in sorted(names):
+                self.stdout.write(f"{name} -> {sharded_name(name)}")
+            return len(names)
+        return self.move(names)
@@ -0,0 +1,89 @@
+"""
+Prometheus metrics of the upload and thumbnail pipeline.
+
+Metrics are collected in the process doing the work. Processes forked or
+spawned by a server or a worker pool share them through the files of
+``PROMETHEUS_MULTIPROC_DIR`` when it is set, see the prometheus_client
+multiprocess mode.
+"""
+import contextlib
+import os
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+from .tracing import span
+
+# Upper bounds of the megapixel ranges source images are grouped by.
+MEGAPIXEL_RANGES = (1, 6, 24, 50)
+
+UPLOAD_SECONDS = Histogram(
+    "image_upload_seconds",
+    "Time to receive, validate and store an upload request.",
+    ["tier", "endpoint"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+UPLOAD_IMAGES = Counter("image_uploads", "Images uploaded.", ["tier"])
+UPLOAD_BYTES = Counter("image_upload_bytes", "Bytes of uploaded images.", ["tier"])
+
+THUMBNAIL_QUEUE_WAIT_SECONDS = Histogram(
+    "thumbnail_queue_wait_seconds",
+    "Time from planning a thumbnail at upload to the start of its job.",
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 15, 60, 300, 900),
+)
+THUMBNAIL_STAGE_SECONDS = Histogram(
+    "thumbnail_stage_seconds",
+    "Time spent decoding the source, resizing and encoding thumbnails.",
+    ["stage", "format", "megapixels"],
+)
+THUMBNAIL_RENDITIONS = Counter(
+    "thumbnail_renditions", "Thumbnails rendered by jobs, by outcome.", ["status"]
+)
+THUMBNAIL_BYTES = Counter("thumbnail_bytes", "Bytes of encoded thumbnails.", ["format"])
+
+RENDITION_CACHE_REQUESTS = Counter(
+    "rendition_cache_requests",
+    "On demand thumbnail lookups, by the cache tier that answered.",
+    ["result"],
+)
+
+
+def megapixel_range(size):
+    """Return the label of the megapixel range of an image size."""
+    megapixels = size[0] * size[1] / 1_000_000
+    lower = 0
+    for upper in MEGAPIXEL_RANGES:
+        if megapixels <= upper:
+            return f"{lower}-{upper}"
+        lower = upper
+    return f"{lower}+"
+
+
+@contextlib.contextmanager
+def thumbnail_stage(stage, source_format, size):
+    """Time and trace a stage of rendering thumbnails of a source image."""
+    megapixels = megapixel_range(size)
+    histogram = THUMBNAIL_STAGE_SECONDS.labels(
+        stage=stage, format=source_format or "unknown", megapixels=megapixels
+    )
+    with span(
+        f"thumbnail.{stage}", format=source_format or "unknown", megapixels=megapixels
+    ), histogram.time():
+        yield
+
+
+def exposition():
+    """Return the metrics in the Prometheus text format and its content type."""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
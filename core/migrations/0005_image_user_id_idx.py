@@ -0,0 +1,17 @@
+# Generated by Django 4.2.5 on 2026-10-17 10:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0004_image_custom_thumbnail_alter_image_thumbnail_200px_and_more"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="image",
+            index=models.Index(fields=["user", "id"], name="image_user_id_idx"),
+        ),
+    ]
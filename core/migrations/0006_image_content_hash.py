@@ -0,0 +1,23 @@
+# Generated by Django 4.2.5 on 2026-10-17 10:29
+
+import core.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0005_image_user_id_idx"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="image",
+            name="content_hash",
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.AlterField(
+            model_name="image",
+            name="file",
+            field=models.ImageField(upload_to=core.models.image_upload_to),
+        ),
+    ]
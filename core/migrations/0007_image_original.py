@@ -0,0 +1,64 @@
+# Generated by Django 4.2.5 on 2026-10-17 10:32
+
+import posixpath
+import re
+
+from django.core.files.storage import default_storage
+from django.db import migrations, models
+from django.db.models import F
+
+# Thumbnails were stored next to their original as
+# images/<original name>_thumbnail_<size>px.jpg
+LEGACY_THUMBNAIL_RE = re.compile(r"^(images/.+)_thumbnail_\d+px\.\w+$")
+
+
+def legacy_originals():
+    """Return the names of the files stored in images/ by their root."""
+    try:
+        _, files = default_storage.listdir("images")
+    except FileNotFoundError:
+        return {}
+    originals = {}
+    for name in files:
+        name = posixpath.join("images", name)
+        if not LEGACY_THUMBNAIL_RE.match(name):
+            originals.setdefault(posixpath.splitext(name)[0], []).append(name)
+    return originals
+
+
+def copy_file_to_original(apps, schema_editor):
+    Image = apps.get_model("core", "Image")
+    Image.objects.exclude(file="").update(original=F("file"))
+
+    # Tiers without a link to the original cleared the file column, find
+    # their original from the name of its thumbnails
+    images = Image.objects.filter(file="", original="")
+    if not images.exists():
+        return
+    originals = legacy_originals()
+    for image in images.iterator():
+        for thumbnail in (
+            image.thumbnail_200px,
+            image.thumbnail_400px,
+            image.custom_thumbnail,
+        ):
+            match = LEGACY_THUMBNAIL_RE.match(thumbnail.name or "")
+            candidates = originals.get(match.group(1), []) if match else []
+            if len(candidates) == 1:
+                Image.objects.filter(pk=image.pk).update(original=candidates[0])
+                break
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0006_image_content_hash"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="image",
+            name="original",
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.RunPython(copy_file_to_original, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,83 @@
+# Generated by Django 4.2.5 on 2026-10-17 10:33
+
+import re
+
+import core.models
+from django.db import migrations, models
+import django.db.models.deletion
+
+CUSTOM_THUMBNAIL_RE = re.compile(r"_thumbnail_(\d+)px\.\w+$")
+
+
+def copy_thumbnail_columns(apps, schema_editor):
+    Image = apps.get_model("core", "Image")
+    Rendition = apps.get_model("core", "Rendition")
+    renditions = []
+    for image in Image.objects.iterator():
+        thumbnails = {}
+        if image.thumbnail_200px:
+            thumbnails[200] = image.thumbnail_200px.name
+        if image.thumbnail_400px:
+            thumbnails[400] = image.thumbnail_400px.name
+        if image.custom_thumbnail:
+            match = CUSTOM_THUMBNAIL_RE.search(image.custom_thumbnail.name)
+            if match:
+                thumbnails[int(match.group(1))] = image.custom_thumbnail.name
+        renditions.extend(
+            Rendition(image=image, height=height, file=name)
+            for height, name in thumbnails.items()
+        )
+        if len(renditions) >= 1000:
+            Rendition.objects.bulk_create(renditions)
+            renditions = []
+    Rendition.objects.bulk_create(renditions)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0007_image_original"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="customtier",
+            name="thumbnail_sizes",
+            field=models.CharField(
+                max_length=255, validators=[core.models.parse_thumbnail_sizes]
+            ),
+        ),
+        migrations.CreateModel(
+            name="Rendition",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("height", models.PositiveIntegerField()),
+                ("file", models.ImageField(blank=True, null=True, upload_to="")),
+                (
+                    "image",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="renditions",
+                        to="core.image",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["height"],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="rendition",
+            constraint=models.UniqueConstraint(
+                fields=("image", "height"), name="rendition_image_height_unique"
+            ),
+        ),
+        migrations.RunPython(copy_thumbnail_columns, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 4.2.5 on 2026-10-17 10:48
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def set_existing_status(apps, schema_editor):
+    Rendition = apps.get_model("core", "Rendition")
+    # Renditions without a file were only ever rendered on request
+    Rendition.objects.filter(file__isnull=True).update(status="on_demand")
+    Rendition.objects.filter(file="").update(status="on_demand")
+    Rendition.objects.exclude(status="on_demand").update(status="ready")
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0009_image_width_height"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="rendition",
+            name="created_at",
+            field=models.DateTimeField(
+                auto_now_add=True, default=django.utils.timezone.now
+            ),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name="rendition",
+            name="error",
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name="rendition",
+            name="finished_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="rendition",
+            name="started_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="rendition",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("pending", "Pending"),
+                    ("ready", "Ready"),
+                    ("failed", "Failed"),
+                    ("on_demand", "On Demand"),
+                ],
+                default="pending",
+                max_length=10,
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="rendition",
+            index=models.Index(fields=["file"], name="rendition_file_idx"),
+        ),
+        migrations.RunPython(set_existing_status, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 4.2.5 on 2026-10-17 10:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0010_rendition_status"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="rendition",
+            index=models.Index(
+                condition=models.Q(("status", "pending")),
+                fields=["status"],
+                name="rendition_pending_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 4.2.5 on 2026-10-17 11:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0011_rendition_pending_idx"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="image",
+            index=models.Index(fields=["original"], name="image_original_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="image",
+            index=models.Index(fields=["file"], name="image_file_idx"),
+        ),
+    ]
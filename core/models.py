@@ -1,8 +1,11 @@
+import os
+
 from django.contrib.auth.models import (
     AbstractBaseUser,
     BaseUserManager,
     PermissionsMixin,
 )
+from django.core.exceptions import ValidationError
 from django.core.validators import (
     FileExtensionValidator,
     MaxValueValidator,
@@ -10,6 +13,8 @@ from django.core.validators import (
 )
 from django.db import models
 
+from .storage import file_content_hash, sharded_name
+
 # Create your models here.
 
 TIERS = (
@@ -64,9 +69,24 @@ class User(AbstractBaseUser, PermissionsMixin):
     USERNAME_FIELD = "email"
 
 
+def image_upload_to(instance, filename):
+    """Store originals under their content hash when it is known, sharded."""
+    if instance.content_hash:
+        extension = os.path.splitext(filename)[1].lower()
+        return sharded_name(f"images/{instance.content_hash}{extension}")
+    return sharded_name(f"images/{filename}")
+
+
 class Image(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    file = models.ImageField(upload_to="images/")
+    file = models.ImageField(upload_to=image_upload_to)
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)
+    # Storage name of the uploaded original, kept even when the tier hides
+    # the link to it in ``file``
+    original = models.CharField(max_length=255, blank=True)
+    # Dimensions of the original, read from its header on upload
+    width = models.PositiveIntegerField(blank=True, null=True)
+    height = models.PositiveIntegerField(blank=True, null=True)
     expiration_time = models.PositiveIntegerField(
         blank=True,
         null=True,
@@ -89,12 +109,88 @@ class Image(models.Model):
         validators=[FileExtensionValidator(allowed_extensions=["png", "jpg"])],
     )
 
+    class Meta:
+        indexes = [
+            # Keyset pagination of a user's images walks this index
+            models.Index(fields=["user", "id"], name="image_user_id_idx"),
+            # Files are only deleted once no image refers to them
+            models.Index(fields=["original"], name="image_original_idx"),
+            models.Index(fields=["file"], name="image_file_idx"),
+        ]
+
+    def save(self, *args, **kwargs):
+        # Originals saved without going through the upload views, such as
+        # admin uploads, are named by content hash too, and never replace
+        # the file of another image
+        if self.file and not self.file._committed and not self.content_hash:
+            self.content_hash = file_content_hash(self.file)
+        super().save(*args, **kwargs)
+
+
+class Rendition(models.Model):
+    """A thumbnail of an image at one height."""
+
+    class Status(models.TextChoices):
+        PENDING = "pending"
+        READY = "ready"
+        FAILED = "failed"
+        # Not rendered in advance, only when first requested
+        ON_DEMAND = "on_demand"
+
+    image = models.ForeignKey(
+        Image, on_delete=models.CASCADE, related_name="renditions"
+    )
+    height = models.PositiveIntegerField()
+    file = models.ImageField(blank=True, null=True)
+    status = models.CharField(
+        max_length=10, choices=Status.choices, default=Status.PENDING
+    )
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ["height"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["image", "height"], name="rendition_image_height_unique"
+            ),
+        ]
+        indexes = [
+            # Thumbnail jobs update the renditions of the files they render
+            models.Index(fields=["file"], name="rendition_file_idx"),
+            # Backfills count the pending renditions to wait for the workers
+            models.Index(
+                fields=["status"],
+                condition=models.Q(status="pending"),
+                name="rendition_pending_idx",
+            ),
+        ]
+
+
+def parse_thumbnail_sizes(value):
+    """Return the sorted heights of a comma separated list of sizes."""
+    try:
+        sizes = {int(size) for size in str(value).split(",") if size.strip()}
+    except ValueError:
+        raise ValidationError("Thumbnail sizes must be comma separated integers.")
+    if not sizes or min(sizes) <= 0:
+        raise ValidationError("Thumbnail sizes must be positive integers.")
+    return sorted(sizes)
+
 
 class CustomTier(models.Model):
     name = models.CharField(max_length=100)
-    thumbnail_sizes = models.CharField(max_length=255)
+    # Comma separated thumbnail heights, for example "100,300,600"
+    thumbnail_sizes = models.CharField(
+        max_length=255, validators=[parse_thumbnail_sizes]
+    )
     include_original_link = models.BooleanField(default=False)
     generate_expiring_links = models.BooleanField(default=False)
 
     def __str__(self):
         return self.name
+
+    def get_thumbnail_sizes(self):
+        return parse_thumbnail_sizes(self.thumbnail_sizes)
@@ -0,0 +1,149 @@
+"""
+Size bounded two tier cache of rendered thumbnails.
+
+Recently used renditions are kept in memory, everything else on disk. Both
+tiers evict least recently used entries once over their byte budget, and
+concurrent requests for the same key in a process wait for a single render.
+"""
+import functools
+import os
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from . import metrics
+
+
+class RenditionCache:
+    def __init__(self, directory, memory_max_bytes, disk_max_bytes):
+        self.directory = directory
+        self.memory_max_bytes = memory_max_bytes
+        self.disk_max_bytes = disk_max_bytes
+        self.memory = OrderedDict()
+        self.memory_bytes = 0
+        self.disk_bytes = None
+        self.lock = threading.Lock()
+        self.in_flight = {}
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get_or_render(self, key, render):
+        """
+        Return the cached content of ``key``, calling ``render`` on a miss.
+
+        While a render is running, other threads asking for the same key wait
+        for it instead of rendering the same content again.
+        """
+        while True:
+            with self.lock:
+                content = self.memory_get(key)
+                if content is not None:
+                    metrics.RENDITION_CACHE_REQUESTS.labels("memory").inc()
+                    return content
+                event = self.in_flight.get(key)
+                if event is None:
+                    event = self.in_flight[key] = threading.Event()
+                    break
+            event.wait()
+
+        try:
+            content = self.disk_get(key)
+            if content is None:
+                metrics.RENDITION_CACHE_REQUESTS.labels("miss").inc()
+                content = render()
+                self.disk_set(key, content)
+            else:
+                metrics.RENDITION_CACHE_REQUESTS.labels("disk").inc()
+            with self.lock:
+                self.memory_set(key, content)
+            return content
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+            event.set()
+
+    def memory_get(self, key):
+        content = self.memory.get(key)
+        if content is not None:
+            self.memory.move_to_end(key)
+        return content
+
+    def memory_set(self, key, content):
+        if len(content) > self.memory_max_bytes:
+            return
+        self.memory[key] = content
+        self.memory_bytes += len(content)
+        while self.memory_bytes > self.memory_max_bytes:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_bytes -= len(evicted)
+
+    def disk_get(self, key):
+        path = self.path(key)
+        try:
+            with open(path, "rb") as file:
+                content = file.read()
+        except FileNotFoundError:
+            return None
+        # The modification time orders entries for eviction
+        os.utime(path)
+        return content
+
+    def disk_set(self, key, content):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary_path, "wb") as file:
+            file.write(content)
+        os.replace(temporary_path, path)
+
+        with self.lock:
+            if self.disk_bytes is None:
+                self.disk_bytes = sum(size for _, size, _ in self.disk_entries())
+            else:
+                self.disk_bytes += len(content)
+            if self.disk_bytes > self.disk_max_bytes:
+                self.prune_disk()
+
+    def disk_entries(self):
+        """Yield ``(path, size, mtime)`` of every entry on disk."""
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, stat.st_size, stat.st_mtime
+
+    def prune_disk(self):
+        """Remove least recently used entries until 90% of the budget is left."""
+        entries = sorted(self.disk_entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        target = self.disk_max_bytes * 0.9
+        for path, size, _ in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self.disk_bytes = total
+
+
+@functools.lru_cache(maxsize=None)
+def _rendition_cache(directory, memory_max_bytes, disk_max_bytes):
+    return RenditionCache(directory, memory_max_bytes, disk_max_bytes)
+
+
+def get_rendition_cache():
+    """Return the process wide rendition cache configured in settings."""
+    return _rendition_cache(
+        settings.RENDITION_CACHE_DIR,
+        settings.RENDITION_CACHE_MEMORY_BYTES,
+        settings.RENDITION_CACHE_DISK_BYTES,
+    )
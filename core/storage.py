@@ -0,0 +1,113 @@
+"""
+Storage of uploaded images and thumbnails.
+"""
+import hashlib
+import os
+import posixpath
+import re
+import shutil
+import tempfile
+
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+
+CONTENT_HASH_RE = re.compile(r"^[0-9a-f]{64}")
+# Thumbnails are named after their original, whose name is unique.
+THUMBNAIL_NAME_RE = re.compile(r"_thumbnail_\d+px(_[0-9a-f]{8})?\.\w+$")
+
+
+def sharded_name(name):
+    """
+    Return the name moved to the shard directory of its file name.
+
+    Files named by content hash, and their thumbnails, are sharded by the
+    first four hex digits of the hash, ``images/ab/cd/abcd...png``, other
+    names by the hash of the file name. That keeps directories and object
+    prefixes small and spreads them evenly.
+    """
+    directory, basename = posixpath.split(name)
+    match = CONTENT_HASH_RE.match(basename)
+    key = match.group() if match else hashlib.sha256(basename.encode()).hexdigest()
+    return posixpath.join(directory, key[:2], key[2:4], basename)
+
+
+def file_content_hash(file):
+    """
+    Return the SHA-256 hex digest of an uploaded file.
+
+    Uses the digest computed by the hashing upload handlers when available.
+    """
+    content_hash = getattr(file, "content_hash", None)
+    if content_hash is None:
+        digest = hashlib.sha256()
+        for chunk in file.chunks():
+            digest.update(chunk)
+        content_hash = digest.hexdigest()
+        file.seek(0)
+    return content_hash
+
+
+def copy_stored_file(storage, name, new_name):
+    """
+    Store the file under ``new_name`` as well, leaving ``name`` in place.
+
+    Local files are hard linked instead of copied when possible.
+    """
+    try:
+        path, new_path = storage.path(name), storage.path(new_name)
+    except NotImplementedError:
+        with storage.open(name) as file:
+            storage.save(new_name, file)
+        return
+    os.makedirs(os.path.dirname(new_path), exist_ok=True)
+    try:
+        os.link(path, new_path)
+    except FileExistsError:
+        pass
+    except OSError:
+        shutil.copy2(path, new_path)
+
+
+class MediaStorage(FileSystemStorage):
+    """
+    Local filesystem storage replacing files atomically.
+
+    Originals are named by content hash and thumbnails after their original,
+    so saving under an existing one of those names replaces the file, the
+    way object storages behave, instead of picking another name. Other names
+    get an available name as usual, so they never replace another file.
+    Files are written under a temporary name and moved into place, so a
+    partially written file is never visible under its name.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        basename = posixpath.basename(name)
+        if CONTENT_HASH_RE.match(basename) or THUMBNAIL_NAME_RE.search(basename):
+            return name
+        return super().get_available_name(name, max_length)
+
+    def _save(self, name, content):
+        full_path = self.path(name)
+        directory = os.path.dirname(full_path)
+        os.makedirs(directory, exist_ok=True)
+
+        if hasattr(content, "temporary_file_path"):
+            # A rename when the upload was spooled on the same filesystem
+            file_move_safe(
+                content.temporary_file_path(), full_path, allow_overwrite=True
+            )
+        else:
+            fd, temporary_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as file:
+                    for chunk in content.chunks():
+                        file.write(chunk)
+                os.replace(temporary_path, full_path)
+            except BaseException:
+                if os.path.exists(temporary_path):
+                    os.remove(temporary_path)
+                raise
+
+        if self.file_permissions_mode is not None:
+            os.chmod(full_path, self.file_permissions_mode)
+        return name.replace("\\", "/")
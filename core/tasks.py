@@ -1,20 +1,232 @@
+import hashlib
+import logging
+import os
+
 from celery import shared_task
-from PIL import Image
+from celery.utils.time import get_exponential_backoff_interval
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import OperationalError
+from django.utils import timezone
+
+from . import encoders, metrics
+from .engines import get_engine
+from .models import Rendition
+
+try:
+    from botocore import exceptions as botocore_exceptions
+except ImportError:
+    botocore_exceptions = None
+
+logger = logging.getLogger(__name__)
+
+# Errors of a storage or database briefly out of reach, thumbnail jobs are
+# retried on them. Any other error fails the renditions at once.
+TRANSIENT_ERRORS = (ConnectionError, TimeoutError, OperationalError)
+if botocore_exceptions is not None:
+    TRANSIENT_ERRORS += (
+        botocore_exceptions.ConnectionError,
+        botocore_exceptions.HTTPClientError,
+    )
+
+
+def job_id(image_name, renditions, encoder=None):
+    """
+    Return the task id of a thumbnail job.
+
+    Jobs rendering the same thumbnails of the same original with the same
+    encoder get the same id, whichever image or request queued them.
+    """
+    encoder = encoder or encoders.DEFAULT_ENCODER
+    names = ",".join(sorted(name for name, _ in renditions))
+    key = f"{image_name}|{names}|{encoders.cache_tag(encoder)}"
+    return f"thumbnails-{hashlib.sha256(key.encode()).hexdigest()[:32]}"
+
+
+# Caches only seen by the process using them, the workers could not release
+# the claims taken in them
+PROCESS_LOCAL_CACHES = (LocMemCache, DummyCache)
+
+
+def job_claims():
+    """Return the cache of job claims, None when it is not shared."""
+    cache = caches["default"]
+    if isinstance(cache, PROCESS_LOCAL_CACHES):
+        return None
+    return cache
+
+
+def claim_job(task_id):
+    """
+    Return whether the job may be queued, no job with its id being pending.
+
+    The claim is kept in the shared cache until the job finishes or
+    ``THUMBNAIL_JOB_DEDUP_SECONDS`` pass. Without a shared cache, such as
+    Redis at ``CACHE_REDIS_URL``, every job is queued.
+    """
+    cache = job_claims()
+    if cache is None:
+        return True
+    return cache.add(
+        f"thumbnail-job:{task_id}", True, timeout=settings.THUMBNAIL_JOB_DEDUP_SECONDS
+    )
+
 
+def release_job(task_id):
+    cache = job_claims()
+    if cache is not None:
+        cache.delete(f"thumbnail-job:{task_id}")
 
-@shared_task()
+
+def storage_name(path):
+    """Return the storage name of a MEDIA_ROOT path of earlier task messages."""
+    if not os.path.isabs(path):
+        return path
+    return os.path.relpath(path, settings.MEDIA_ROOT).replace(os.sep, "/")
+
+
+@shared_task(ignore_result=True)
 def create_thumbnail(image_path, thumbnail_path, height=200):
+    """Render a thumbnail queued by earlier versions, with absolute paths."""
+    thumbnail_name = storage_name(thumbnail_path)
+    record_renditions(
+        render_thumbnails(storage_name(image_path), [(thumbnail_name, height)])
+    )
+
+
+@shared_task(bind=True, ignore_result=True)
+def create_thumbnails(self, image_name, renditions, encoder=None):
+    """
+    Render and record the thumbnails of an image.
+
+    Transient errors are retried with exponential backoff and jitter, up to
+    ``THUMBNAIL_TASK_MAX_RETRIES`` times, after which the renditions fail.
+    The job's claim is released once it has finished.
+    """
+    retry_errors = ()
+    if self.request.retries < settings.THUMBNAIL_TASK_MAX_RETRIES:
+        retry_errors = TRANSIENT_ERRORS
     try:
-        with Image.open(image_path) as img:
-            # Convert RGBA to RGB if the image is in RGBA mode
-            if img.mode == "RGBA":
-                img = img.convert("RGB")
-            width_percent = height / float(img.size[1])
-            new_width = int((float(img.size[0]) * float(width_percent)))
+        record_renditions(
+            render_thumbnails(image_name, renditions, encoder, retry_errors)
+        )
+    except retry_errors as e:
+        logger.warning("Retrying thumbnails of %s after %r", image_name, e)
+        raise self.retry(
+            exc=e,
+            max_retries=settings.THUMBNAIL_TASK_MAX_RETRIES,
+            countdown=get_exponential_backoff_interval(
+                settings.THUMBNAIL_TASK_RETRY_BACKOFF,
+                self.request.retries,
+                settings.THUMBNAIL_TASK_RETRY_BACKOFF_MAX,
+                full_jitter=True,
+            ),
+        )
+    except Exception:
+        release_job(self.request.id)
+        raise
+    release_job(self.request.id)
+
+
+def rendition_result(name, status, started_at, error=""):
+    return {
+        "name": name,
+        "status": status,
+        "started_at": started_at,
+        "finished_at": timezone.now(),
+        "error": error,
+    }
 
-            # Resize the image to the new dimensions
-            img.thumbnail((new_width, height), Image.Resampling.LANCZOS)
 
-            img.save(thumbnail_path)
+def record_renditions(results):
+    """Store the outcome of rendered thumbnails on the renditions using them."""
+    planned = dict(
+        Rendition.objects.filter(
+            file__in=[result["name"] for result in results],
+            status=Rendition.Status.PENDING,
+        ).values_list("file", "created_at")
+    )
+    for result in results:
+        if result["name"] in planned:
+            metrics.THUMBNAIL_QUEUE_WAIT_SECONDS.observe(
+                max((result["started_at"] - planned[result["name"]]).total_seconds(), 0)
+            )
+        renditions = Rendition.objects.filter(file=result.pop("name"))
+        if result["status"] == Rendition.Status.FAILED:
+            # Never mark a thumbnail rendered by an earlier job as failed
+            renditions = renditions.exclude(status=Rendition.Status.READY)
+        renditions.update(**result)
+
+
+def render_thumbnails(image_name, renditions, encoder=None, retry_errors=()):
+    """
+    Create every rendition of an image from a single decode of the original.
+
+    ``renditions`` is a list of ``(thumbnail_name, height)`` pairs. Both the
+    original and the thumbnails are storage names of the default storage.
+    Sizes are produced largest first and each one is derived from the previous
+    result, so the original is only opened and decoded once, at the lowest
+    resolution the engine's decoder supports that is still large enough for
+    the biggest size. Every size is written with ``encoder``, JPEG by default.
+
+    Returns the outcome of every rendition, for ``record_renditions``. The
+    renditions left once an error occurs are failed, unless it is one of
+    ``retry_errors``, which are raised for the job to be retried.
+    """
+    encoder = encoder or encoders.DEFAULT_ENCODER
+    renditions = sorted(renditions, key=lambda rendition: rendition[1], reverse=True)
+    engine = get_engine()
+    started_at = timezone.now()
+    results = []
+    try:
+        with default_storage.open(image_name) as file:
+            source = engine.open(file)
+            description = engine.describe(source)
+            with metrics.thumbnail_stage("decode", *description):
+                img = engine.load(source, renditions[0][1], encoder)
+            for thumbnail_name, height in renditions:
+                with metrics.thumbnail_stage("resize", *description):
+                    img = engine.resize(img, height)
+                with metrics.thumbnail_stage("encode", *description):
+                    content = engine.encode(img, encoder)
+                # Storages replace files atomically, so a partially written
+                # thumbnail is never visible under its name
+                default_storage.save(thumbnail_name, ContentFile(content))
+                metrics.THUMBNAIL_BYTES.labels(encoder["format"]).inc(len(content))
+                results.append(
+                    rendition_result(thumbnail_name, Rendition.Status.READY, started_at)
+                )
+    except retry_errors:
+        raise
     except Exception as e:
-        print(f"Error creating thumbnail: {e}")
+        logger.exception("Error creating thumbnails of %s", image_name)
+        results.extend(
+            rendition_result(
+                thumbnail_name, Rendition.Status.FAILED, started_at, str(e)
+            )
+            for thumbnail_name, _ in renditions[len(results) :]
+        )
+    for result in results:
+        metrics.THUMBNAIL_RENDITIONS.labels(result["status"]).inc()
+    return results
+
+
+def render_thumbnail_content(image_name, height, encoder=None):
+    """Render a single thumbnail of the stored image and return its bytes."""
+    encoder = encoder or encoders.DEFAULT_ENCODER
+    engine = get_engine()
+    with default_storage.open(image_name) as file:
+        source = engine.open(file)
+        description = engine.describe(source)
+        with metrics.thumbnail_stage("decode", *description):
+            img = engine.load(source, height, encoder)
+        with metrics.thumbnail_stage("resize", *description):
+            img = engine.resize(img, height)
+        with metrics.thumbnail_stage("encode", *description):
+            content = engine.encode(img, encoder)
+    metrics.THUMBNAIL_BYTES.labels(encoder["format"]).inc(len(content))
+    return content
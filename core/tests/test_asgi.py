@@ -0,0 +1,67 @@
+"""
+Test for the request body limit of the ASGI application.
+"""
+from django.test import SimpleTestCase
+
+from core.asgi import RequestBodyLimitMiddleware
+
+
+async def read_body_app(scope, receive, send):
+    """Receive the whole body, like Django, then answer with its size."""
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            break
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": str(len(body)).encode()})
+
+
+class RequestBodyLimitMiddlewareTests(SimpleTestCase):
+    """Test request bodies over the limit are rejected."""
+
+    async def request(self, chunks, headers=()):
+        messages = [
+            {"type": "http.request", "body": chunk, "more_body": True}
+            for chunk in chunks
+        ]
+        messages[-1]["more_body"] = False
+        received = []
+
+        async def receive():
+            message = messages.pop(0)
+            received.append(message)
+            return message
+
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {"type": "http", "method": "POST", "headers": list(headers)}
+        await RequestBodyLimitMiddleware(read_body_app, 10)(scope, receive, send)
+        return sent[0]["status"], sent[1]["body"], len(received)
+
+    async def test_body_within_limit_passed_on(self):
+        """Test bodies up to the limit reach the application."""
+        status, body, _ = await self.request([b"12345", b"67890"])
+
+        self.assertEqual(status, 200)
+        self.assertEqual(body, b"10")
+
+    async def test_announced_length_rejected_before_reading(self):
+        """Test a larger Content-Length is rejected without receiving the body."""
+        status, _, received = await self.request(
+            [b"0" * 20], headers=[(b"content-length", b"20")]
+        )
+
+        self.assertEqual(status, 413)
+        self.assertEqual(received, 0)
+
+    async def test_streamed_body_rejected_once_over_limit(self):
+        """Test a body without Content-Length is rejected as it passes the limit."""
+        status, _, received = await self.request([b"123456"] * 5)
+
+        self.assertEqual(status, 413)
+        self.assertEqual(received, 2)
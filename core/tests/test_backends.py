@@ -0,0 +1,198 @@
+"""
+Test for thumbnail execution backends.
+"""
+import os
+import shutil
+import tempfile
+from unittest import skipUnless
+from unittest.mock import patch
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache, caches
+from django.core.cache.backends.redis import RedisCache
+from django.test import TransactionTestCase, override_settings
+from PIL import Image as PILImage
+
+from core import backends, tasks
+from core.models import Image, Rendition
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+def fake_redis_cache(server):
+    """Return settings of a Redis cache on the fake server."""
+    return {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": "redis://localhost:6379/0",
+        "OPTIONS": {"connection_class": fakeredis.FakeConnection, "server": server},
+    }
+
+
+class ThumbnailBackendTests(TransactionTestCase):
+    """Test thumbnail execution backends."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.enterContext(override_settings(MEDIA_ROOT=self.directory))
+        # Claims of queued jobs are kept in the cache
+        cache.clear()
+        self.image_name = "test.png"
+        self.thumbnail_name = "test_thumbnail_200px.jpg"
+        PILImage.new("RGB", (400, 400)).save(os.path.join(self.directory, "test.png"))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def assertThumbnailRendered(self):
+        self.assertTrue(
+            os.path.isfile(os.path.join(self.directory, self.thumbnail_name))
+        )
+
+    def create_rendition(self):
+        user = get_user_model().objects.create_user("user@example.com")
+        image = Image.objects.create(user=user, file=self.image_name)
+        return Rendition.objects.create(
+            image=image, height=200, file=self.thumbnail_name
+        )
+
+    @override_settings(THUMBNAIL_BACKEND="celery")
+    @patch("core.backends.create_thumbnails.apply_async")
+    def test_celery_backend_queues_task(self, patched_apply_async):
+        """Test the Celery backend queues a single task on the tier queue."""
+        renditions = [(self.thumbnail_name, 200)]
+
+        backends.get_thumbnail_backend().submit(
+            self.image_name, renditions, "Enterprise"
+        )
+
+        patched_apply_async.assert_called_once()
+        args, kwargs = patched_apply_async.call_args
+        self.assertEqual(
+            args[0],
+            (self.image_name, renditions, settings.THUMBNAIL_ENCODERS["Enterprise"]),
+        )
+        self.assertEqual(kwargs["queue"], "thumbnails.enterprise")
+        self.assertEqual(kwargs["priority"], 0)
+        self.assertEqual(kwargs["task_id"], tasks.job_id(self.image_name, *args[0][1:]))
+
+    @patch("core.backends.create_thumbnails.apply_async")
+    def test_celery_backend_priority_override(self, patched_apply_async):
+        """Test a backend priority replaces the priority of the tier."""
+        backends.CeleryBackend(priority=9).submit(
+            self.image_name, [(self.thumbnail_name, 200)], "Enterprise"
+        )
+
+        kwargs = patched_apply_async.call_args.kwargs
+        self.assertEqual(kwargs["queue"], "thumbnails.enterprise")
+        self.assertEqual(kwargs["priority"], 9)
+
+    def test_thumbnail_route_defaults_to_basic(self):
+        """Test jobs without a known tier are routed like Basic ones."""
+        self.assertEqual(
+            backends.thumbnail_route(None), backends.thumbnail_route("Basic")
+        )
+
+    @override_settings(THUMBNAIL_BACKEND="celery")
+    @patch("core.backends.group")
+    def test_celery_backend_groups_many_jobs(self, patched_group):
+        """Test the Celery backend queues many jobs as a single group."""
+        jobs = [
+            (self.image_name, [(f"test_thumbnail_{size}px.jpg", size)], "Basic")
+            for size in (100, 200, 300)
+        ]
+
+        backends.get_thumbnail_backend().submit_many(jobs)
+
+        patched_group.assert_called_once()
+        self.assertEqual(len(list(patched_group.call_args.args[0])), 3)
+        patched_group.return_value.apply_async.assert_called_once_with()
+
+    @skipUnless(fakeredis, "Requires fakeredis.")
+    @patch("core.backends.create_thumbnails.apply_async")
+    def test_celery_backend_queues_duplicate_jobs_once(self, patched_apply_async):
+        """Test a job still pending is not queued again until a worker ends it."""
+        server = fakeredis.FakeServer()
+        cache_settings = fake_redis_cache(server)
+        backend = backends.CeleryBackend()
+        job = (self.image_name, [(self.thumbnail_name, 200)], "Basic")
+
+        with override_settings(CACHES={"default": cache_settings}):
+            self.addCleanup(caches["default"].close)
+            backend.submit_many([job, job])
+            backend.submit(*job)
+
+            patched_apply_async.assert_called_once()
+            # The worker releases the job through its own cache connection
+            worker_cache = RedisCache(cache_settings["LOCATION"], cache_settings)
+            with patch("core.tasks.caches", {"default": worker_cache}):
+                tasks.release_job(patched_apply_async.call_args.kwargs["task_id"])
+            backend.submit(*job)
+
+        self.assertEqual(patched_apply_async.call_count, 2)
+
+    @patch("core.backends.create_thumbnails.apply_async")
+    def test_celery_backend_queues_every_job_without_shared_cache(
+        self, patched_apply_async
+    ):
+        """Test jobs are not claimed in a cache the workers cannot release."""
+        backend = backends.CeleryBackend()
+        job = (self.image_name, [(self.thumbnail_name, 200)], "Basic")
+
+        backend.submit(*job)
+        backend.submit(*job)
+
+        self.assertEqual(patched_apply_async.call_count, 2)
+
+    @patch("core.backends.create_thumbnails.apply_async")
+    def test_celery_backend_releases_jobs_failing_to_queue(self, patched_apply_async):
+        """Test jobs the broker did not accept can be queued again."""
+        patched_apply_async.side_effect = ConnectionError
+        job = (self.image_name, [(self.thumbnail_name, 200)], "Basic")
+
+        with self.assertRaises(ConnectionError):
+            backends.CeleryBackend().submit(*job)
+
+        patched_apply_async.side_effect = None
+        backends.CeleryBackend().submit(*job)
+        self.assertEqual(patched_apply_async.call_count, 2)
+
+    @override_settings(THUMBNAIL_BACKEND="sync")
+    def test_sync_backend_renders_immediately(self):
+        """Test the sync backend renders before returning."""
+        rendition = self.create_rendition()
+
+        backends.get_thumbnail_backend().submit(
+            self.image_name, [(self.thumbnail_name, 200)]
+        )
+
+        self.assertThumbnailRendered()
+        rendition.refresh_from_db()
+        self.assertEqual(rendition.status, Rendition.Status.READY)
+
+    @override_settings(THUMBNAIL_BACKEND="process", THUMBNAIL_PROCESS_POOL_SIZE=1)
+    def test_process_backend_renders_in_pool(self):
+        """Test the process pool backend renders in a worker process."""
+        rendition = self.create_rendition()
+
+        # Spawned workers load the settings again, from the environment
+        with patch.dict(os.environ, {"MEDIA_ROOT": self.directory}):
+            backends.get_thumbnail_backend().submit(
+                self.image_name, [(self.thumbnail_name, 200)]
+            )
+            backends.ProcessPoolBackend.executor.shutdown(wait=True)
+            backends.ProcessPoolBackend.executor = None
+
+        self.assertThumbnailRendered()
+        # The outcome is recorded by the web process once the job is done
+        rendition.refresh_from_db()
+        self.assertEqual(rendition.status, Rendition.Status.READY)
+
+    @override_settings(THUMBNAIL_BACKEND="unknown")
+    def test_unknown_backend_error(self):
+        """Test an unknown backend name raises an error."""
+        with self.assertRaises(ValueError):
+            backends.get_thumbnail_backend()
@@ -0,0 +1,84 @@
+"""
+Test the removal of the stored files of deleted images.
+"""
+import os
+import shutil
+import tempfile
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.test import TestCase, override_settings
+
+from core.models import Image, Rendition
+
+
+class DeleteImageFilesTests(TestCase):
+    """Test deleting images deletes the files only they use."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.enterContext(override_settings(MEDIA_ROOT=self.directory))
+        self.user = get_user_model().objects.create_user(
+            "test@example.com", "testpass123"
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def create_image(self, original, thumbnail):
+        for name in (original, thumbnail):
+            default_storage.save(name, ContentFile(b"content"))
+        image = Image.objects.create(
+            user=self.user,
+            file=original,
+            original=original,
+            thumbnail_200px=thumbnail,
+        )
+        Rendition.objects.create(image=image, height=200, file=thumbnail)
+        return image
+
+    def test_delete_image_deletes_files(self):
+        """Test the original and thumbnails of a deleted image are deleted."""
+        image = self.create_image("images/aa/aa/a.png", "images/aa/aa/a_200.jpg")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            image.delete()
+
+        self.assertFalse(default_storage.exists("images/aa/aa/a.png"))
+        self.assertFalse(default_storage.exists("images/aa/aa/a_200.jpg"))
+
+    def test_shared_files_kept(self):
+        """Test files of an image are kept while a duplicate refers to them."""
+        image = self.create_image("images/aa/aa/a.png", "images/aa/aa/a_200.jpg")
+        self.create_image("images/aa/aa/a.png", "images/aa/aa/a_200.jpg")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            image.delete()
+
+        self.assertTrue(default_storage.exists("images/aa/aa/a.png"))
+        self.assertTrue(default_storage.exists("images/aa/aa/a_200.jpg"))
+
+    def test_files_stored_again_during_delete_kept(self):
+        """Test files an upload stored again before the deletion committed."""
+        image = self.create_image("images/aa/aa/a.png", "images/aa/aa/a_200.jpg")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            image.delete()
+            # An upload of the same content writes the original again
+            modified = time.time() + 1
+            os.utime(default_storage.path("images/aa/aa/a.png"), (modified, modified))
+
+        self.assertTrue(default_storage.exists("images/aa/aa/a.png"))
+        self.assertFalse(default_storage.exists("images/aa/aa/a_200.jpg"))
+
+    def test_files_kept_when_delete_rolled_back(self):
+        """Test no file is deleted before the deletion is committed."""
+        image = self.create_image("images/aa/aa/a.png", "images/aa/aa/a_200.jpg")
+
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            image.delete()
+
+        self.assertEqual(len(callbacks), 1)
+        self.assertTrue(default_storage.exists("images/aa/aa/a.png"))
@@ -1,13 +1,22 @@
 """
 Test custom django management commands.
 """
+import os
+import shutil
+import tempfile
+from io import StringIO
 from unittest.mock import patch
 
-from django.core.management import call_command
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
 from django.db.utils import OperationalError
-from django.test import SimpleTestCase
+from django.test import SimpleTestCase, TestCase, override_settings
 from psycopg2 import OperationalError as Psycopg2Error
 
+from core.models import Image, Rendition
+
 
 @patch("core.management.commands.wait_for_db.Command.check")
 class CommandTests(SimpleTestCase):
@@ -32,3 +41,115 @@ class CommandTests(SimpleTestCase):
 
         self.assertEqual(patched_check.call_count, 6)
         patched_check.assert_called_with(databases=["default"])
+
+
+@override_settings(
+    THUMBNAIL_WORKER_POOLS={"thumbnails.enterprise": (4, 1), "thumbnails.basic": (1, 1)}
+)
+class ThumbnailWorkersCommandTests(SimpleTestCase):
+    """Test the thumbnail workers command."""
+
+    def test_worker_per_queue(self):
+        """Test one autoscaled worker is started per configured queue."""
+        out = StringIO()
+
+        call_command("run_thumbnail_workers", "--dry-run", stdout=out)
+
+        commands = out.getvalue().splitlines()
+        self.assertEqual(len(commands), 2)
+        self.assertIn("-Q thumbnails.enterprise ", commands[0])
+        self.assertIn("--autoscale=4,1", commands[0])
+        self.assertIn("-Q thumbnails.basic,celery", commands[1])
+
+    @patch("core.management.commands.run_thumbnail_workers.subprocess.Popen")
+    def test_selected_queue_only(self, patched_popen):
+        """Test only the selected queue is started and waited for."""
+        call_command("run_thumbnail_workers", "--queue=thumbnails.basic")
+
+        patched_popen.assert_called_once()
+        self.assertIn("thumbnails.basic,celery", patched_popen.call_args.args[0])
+        patched_popen.return_value.wait.assert_called_once_with()
+
+    def test_unknown_queue_error(self):
+        """Test an unknown queue name raises an error."""
+        with self.assertRaises(CommandError):
+            call_command("run_thumbnail_workers", "--queue=missing", "--dry-run")
+
+
+class MediaCommandTests(TestCase):
+    """Test the commands managing stored images."""
+
+    content_hash = "ab12" + "0" * 60
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.enterContext(override_settings(MEDIA_ROOT=self.directory))
+        self.user = get_user_model().objects.create_user(
+            "test@example.com", "testpass123"
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def store(self, name):
+        default_storage.save(name, ContentFile(b"content"))
+        return name
+
+    def age(self, name, seconds=7200):
+        """Make the stored file look modified ``seconds`` ago."""
+        path = default_storage.path(name)
+        modified = os.path.getmtime(path) - seconds
+        os.utime(path, (modified, modified))
+
+    def test_shard_media_moves_flat_files(self):
+        """Test flat originals and thumbnails move to their shard directory."""
+        original = self.store(f"images/{self.content_hash}.png")
+        thumbnail = self.store(f"images/{self.content_hash}_thumbnail_200px.jpg")
+        image = Image.objects.create(
+            user=self.user, file=original, original=original, thumbnail_200px=thumbnail
+        )
+        Rendition.objects.create(image=image, height=200, file=thumbnail)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("shard_media", stdout=StringIO())
+
+        image.refresh_from_db()
+        shard = "images/ab/12"
+        self.assertEqual(image.original, f"{shard}/{self.content_hash}.png")
+        self.assertEqual(image.file.name, image.original)
+        self.assertEqual(
+            image.thumbnail_200px.name, f"{shard}/{os.path.basename(thumbnail)}"
+        )
+        self.assertEqual(image.renditions.get().file.name, image.thumbnail_200px.name)
+        self.assertTrue(default_storage.exists(image.original))
+        self.assertTrue(default_storage.exists(image.thumbnail_200px.name))
+        self.assertFalse(default_storage.exists(original))
+        self.assertFalse(default_storage.exists(thumbnail))
+
+    def test_collect_media_garbage_deletes_orphans(self):
+        """Test only old files no row refers to are deleted."""
+        referenced = self.store(f"images/ab/12/{self.content_hash}.png")
+        orphan = self.store("images/cd/34/orphan.png")
+        recent_orphan = self.store("images/cd/34/recent.png")
+        Image.objects.create(user=self.user, original=referenced)
+        self.age(referenced)
+        self.age(orphan)
+
+        out = StringIO()
+        call_command("collect_media_garbage", "--batch-size=2", stdout=out)
+
+        self.assertIn("3 files checked, 1 deleted", out.getvalue())
+        self.assertTrue(default_storage.exists(referenced))
+        self.assertFalse(default_storage.exists(orphan))
+        self.assertTrue(default_storage.exists(recent_orphan))
+
+    def test_collect_media_garbage_dry_run(self):
+        """Test a dry run lists orphans without deleting them."""
+        orphan = self.store("images/cd/34/orphan.png")
+        self.age(orphan)
+
+        out = StringIO()
+        call_command("collect_media_garbage", "--dry-run", stdout=out)
+
+        self.assertIn(orphan, out.getvalue())
+        self.assertTrue(default_storage.exists(orphan))
@@ -0,0 +1,113 @@
+"""
+Test for the resize engines.
+"""
+from io import BytesIO
+from unittest import skipUnless
+
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase
+from PIL import Image, ImageChops, ImageStat
+
+from core import engines
+
+# Largest mean difference per channel, out of 255, between the thumbnails of
+# two engines composited on white.
+PARITY_TOLERANCE = 4
+
+
+def source_image(mode, size=(3000, 2000)):
+    """Return a synthetic image with gradients and fine detail."""
+    gradient = Image.linear_gradient("L").resize(size)
+    detail = Image.effect_mandelbrot(size, (-2, -1.2, 1, 1.2), 60)
+    mirrored = gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT)
+    if mode == "L":
+        return detail
+    if mode == "P":
+        return Image.merge("RGB", (gradient, detail, mirrored)).quantize(64)
+    return Image.merge(mode, (gradient, detail, mirrored, detail)[: len(mode)])
+
+
+def render(engine, content, heights, encoder):
+    """Render the heights, largest first, and return the decoded thumbnails."""
+    source = engine.open(BytesIO(content))
+    img = engine.load(source, heights[0], encoder)
+    thumbnails = []
+    for height in heights:
+        img = engine.resize(img, height)
+        thumbnails.append(Image.open(BytesIO(engine.encode(img, encoder))))
+    return thumbnails
+
+
+def on_white(img):
+    background = Image.new("RGBA", img.size, "white")
+    return Image.alpha_composite(background, img.convert("RGBA"))
+
+
+class EngineTests(SimpleTestCase):
+    """Test selecting engines."""
+
+    def test_engine_from_settings(self):
+        """Test the engine named by THUMBNAIL_ENGINE is used."""
+        with self.settings(THUMBNAIL_ENGINE="pillow"):
+            self.assertIsInstance(engines.get_engine(), engines.PillowEngine)
+
+    def test_unknown_engine_error(self):
+        """Test an unknown engine name raises an error."""
+        with self.assertRaises(ValueError):
+            engines.get_engine("missing")
+
+    def test_vips_requires_pyvips(self):
+        """Test the libvips engine cannot be used without pyvips."""
+        with self.settings(THUMBNAIL_ENGINE="vips"):
+            original, engines.pyvips = engines.pyvips, None
+            try:
+                with self.assertRaises(ImproperlyConfigured):
+                    engines.get_engine()
+            finally:
+                engines.pyvips = original
+
+
+@skipUnless(engines.pyvips, "pyvips and libvips are not installed")
+class EngineParityTests(SimpleTestCase):
+    """Test libvips renders thumbnails like Pillow."""
+
+    cases = (
+        ("JPEG", "RGB", {"format": "JPEG", "quality": 90}),
+        ("PNG", "L", {"format": "JPEG", "quality": 90}),
+        ("PNG", "P", {"format": "JPEG", "quality": 90}),
+        ("PNG", "RGBA", {"format": "JPEG", "quality": 90}),
+        ("PNG", "RGBA", {"format": "WEBP", "quality": 90, "method": 4}),
+    )
+
+    def test_thumbnails_match(self):
+        """Test both engines render the same sizes and modes, nearly alike."""
+        for source_format, mode, encoder in self.cases:
+            content = BytesIO()
+            source_image(mode).save(content, source_format)
+            with self.subTest(source=source_format, mode=mode, encoder=encoder):
+                expected = render(
+                    engines.PillowEngine(), content.getvalue(), [400, 200], encoder
+                )
+                actual = render(
+                    engines.VipsEngine(), content.getvalue(), [400, 200], encoder
+                )
+                for pillow, vips in zip(expected, actual):
+                    self.assertEqual(vips.format, encoder["format"])
+                    self.assertEqual(vips.mode, pillow.mode)
+                    self.assertEqual(vips.height, pillow.height)
+                    self.assertLessEqual(abs(vips.width - pillow.width), 1)
+                    difference = ImageChops.difference(
+                        on_white(pillow), on_white(vips.resize(pillow.size))
+                    )
+                    self.assertLessEqual(
+                        max(ImageStat.Stat(difference).mean), PARITY_TOLERANCE
+                    )
+
+    def test_source_described(self):
+        """Test sources are described with Pillow format names."""
+        content = BytesIO()
+        source_image("RGB").save(content, "JPEG")
+
+        source = engines.VipsEngine().open(BytesIO(content.getvalue()))
+
+        self.assertEqual(engines.VipsEngine().describe(source), ("JPEG", (3000, 2000)))
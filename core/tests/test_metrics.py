@@ -0,0 +1,91 @@
+"""
+Test for pipeline metrics.
+"""
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase, override_settings
+from PIL import Image as PILImage
+from prometheus_client import REGISTRY
+
+from core import metrics, tasks
+from core.rendition_cache import RenditionCache
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+class MetricsTests(TestCase):
+    """Test metrics of the thumbnail pipeline."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.enterContext(override_settings(MEDIA_ROOT=self.directory))
+        PILImage.new("RGB", (1000, 800)).save(os.path.join(self.directory, "a.png"))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_megapixel_range(self):
+        """Test sources are grouped by megapixel range."""
+        self.assertEqual(metrics.megapixel_range((1000, 800)), "0-1")
+        self.assertEqual(metrics.megapixel_range((4000, 3000)), "6-24")
+        self.assertEqual(metrics.megapixel_range((10000, 8000)), "50+")
+
+    def test_render_stages_timed(self):
+        """Test decode, resize and encode are timed by source format and size."""
+        labels = {"format": "PNG", "megapixels": "0-1"}
+        before = {
+            stage: sample("thumbnail_stage_seconds_count", stage=stage, **labels)
+            for stage in ("decode", "resize", "encode")
+        }
+        rendered = sample("thumbnail_renditions_total", status="ready")
+        output = sample("thumbnail_bytes_total", format="JPEG")
+
+        tasks.render_thumbnails("a.png", [("a_200.jpg", 200), ("a_400.jpg", 400)])
+
+        self.assertEqual(
+            sample("thumbnail_stage_seconds_count", stage="decode", **labels),
+            before["decode"] + 1,
+        )
+        for stage in ("resize", "encode"):
+            self.assertEqual(
+                sample("thumbnail_stage_seconds_count", stage=stage, **labels),
+                before[stage] + 2,
+            )
+        self.assertEqual(
+            sample("thumbnail_renditions_total", status="ready"), rendered + 2
+        )
+        self.assertGreater(sample("thumbnail_bytes_total", format="JPEG"), output)
+
+    def test_failed_renditions_counted(self):
+        """Test renditions of an unreadable source are counted as failed."""
+        failed = sample("thumbnail_renditions_total", status="failed")
+
+        with self.assertLogs("core.tasks", "ERROR"):
+            tasks.render_thumbnails("missing.png", [("missing_200.jpg", 200)])
+
+        self.assertEqual(
+            sample("thumbnail_renditions_total", status="failed"), failed + 1
+        )
+
+    def test_rendition_cache_results_counted(self):
+        """Test cache lookups are counted by the tier that answered."""
+        cache = RenditionCache(os.path.join(self.directory, "cache"), 1024, 4096)
+        before = {
+            result: sample("rendition_cache_requests_total", result=result)
+            for result in ("miss", "memory", "disk")
+        }
+
+        cache.get_or_render("key", lambda: b"content")
+        cache.get_or_render("key", lambda: b"content")
+        cache.memory.clear()
+        cache.get_or_render("key", lambda: b"content")
+
+        for result in ("miss", "memory", "disk"):
+            self.assertEqual(
+                sample("rendition_cache_requests_total", result=result),
+                before[result] + 1,
+            )
@@ -0,0 +1,69 @@
+"""
+Test data migrations.
+"""
+import importlib
+import shutil
+import tempfile
+
+from django.apps import apps
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.test import TestCase, override_settings
+
+from core.models import Image
+
+image_original = importlib.import_module("core.migrations.0007_image_original")
+
+
+class ImageOriginalMigrationTests(TestCase):
+    """Test the backfill of image originals."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.enterContext(override_settings(MEDIA_ROOT=self.directory))
+        self.user = get_user_model().objects.create(
+            email="test@example.com", tier="Basic"
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_original_copied_from_file(self):
+        """Test images linking their original keep it as original."""
+        image = Image.objects.create(user=self.user, file="images/photo.png")
+
+        image_original.copy_file_to_original(apps, None)
+
+        image.refresh_from_db()
+        self.assertEqual(image.original, "images/photo.png")
+
+    def test_original_found_from_thumbnail_name(self):
+        """Test originals hidden by the tier are found by their thumbnails."""
+        for name in (
+            "images/photo.png",
+            "images/photo_thumbnail_200px.jpg",
+            "images/other.png",
+        ):
+            default_storage.save(name, ContentFile(b"content"))
+        image = Image.objects.create(
+            user=self.user, file="", thumbnail_200px="images/photo_thumbnail_200px.jpg"
+        )
+
+        image_original.copy_file_to_original(apps, None)
+
+        image.refresh_from_db()
+        self.assertEqual(image.original, "images/photo.png")
+
+    def test_ambiguous_original_left_empty(self):
+        """Test no original is guessed when several files share the name."""
+        for name in ("images/photo.png", "images/photo.jpg"):
+            default_storage.save(name, ContentFile(b"content"))
+        image = Image.objects.create(
+            user=self.user, file="", thumbnail_200px="images/photo_thumbnail_200px.jpg"
+        )
+
+        image_original.copy_file_to_original(apps, None)
+
+        image.refresh_from_db()
+        self.assertEqual(image.original, "")
@@ -1,8 +1,14 @@
 """
 Test for models.
 """
+import hashlib
+import shutil
+import tempfile
+
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
 
 from core import models
 
@@ -15,4 +21,36 @@ class ModelTests(TestCase):
         user = get_user_model().objects.create_user("test@example.com", "testpass123")
         image = models.Image.objects.create(user=user, file="test.jpg")
         self.assertEqual(user, image.user)
-        
\ No newline at end of file
+
+    def test_image_saved_without_hash_named_by_content(self):
+        """Test originals saved outside the upload views never share a name."""
+        user = get_user_model().objects.create_user("test@example.com", "testpass123")
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+
+        with override_settings(MEDIA_ROOT=media_root):
+            first, second = (
+                models.Image.objects.create(
+                    user=user, file=SimpleUploadedFile("photo.png", content)
+                )
+                for content in (b"first", b"second")
+            )
+
+        self.assertEqual(first.content_hash, hashlib.sha256(b"first").hexdigest())
+        self.assertNotEqual(first.file.name, second.file.name)
+        self.assertTrue(first.file.name.endswith(f"{first.content_hash}.png"))
+
+    def test_custom_tier_thumbnail_sizes(self):
+        """Test custom tier sizes are parsed from a comma separated list."""
+        custom_tier = models.CustomTier(name="Custom", thumbnail_sizes="600, 100,300")
+
+        self.assertEqual(custom_tier.get_thumbnail_sizes(), [100, 300, 600])
+
+    def test_custom_tier_invalid_thumbnail_sizes(self):
+        """Test invalid custom tier sizes are rejected."""
+        for thumbnail_sizes in ("", "abc", "100,-5"):
+            custom_tier = models.CustomTier(
+                name="Custom", thumbnail_sizes=thumbnail_sizes
+            )
+            with self.assertRaises(ValidationError):
+                custom_tier.full_clean()
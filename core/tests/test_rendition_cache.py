@@ -0,0 +1,81 @@
+"""
+Test for the rendition cache.
+"""
+import shutil
+import tempfile
+import threading
+import time
+from unittest.mock import Mock
+
+from django.test import SimpleTestCase
+
+from core.rendition_cache import RenditionCache
+
+
+class RenditionCacheTests(SimpleTestCase):
+    """Test the two tier rendition cache."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_render_once_then_cached(self):
+        """Test content is rendered on a miss and served from cache after."""
+        cache = RenditionCache(self.directory, 1024, 4096)
+        render = Mock(return_value=b"x" * 10)
+
+        self.assertEqual(cache.get_or_render("abc", render), b"x" * 10)
+        self.assertEqual(cache.get_or_render("abc", render), b"x" * 10)
+
+        render.assert_called_once_with()
+
+    def test_memory_evicts_least_recently_used(self):
+        """Test the memory tier stays in its budget and falls back to disk."""
+        cache = RenditionCache(self.directory, 20, 4096)
+        cache.get_or_render("aa1", lambda: b"1" * 10)
+        cache.get_or_render("aa2", lambda: b"2" * 10)
+        cache.get_or_render("aa1", Mock())
+        cache.get_or_render("aa3", lambda: b"3" * 10)
+
+        self.assertEqual(list(cache.memory), ["aa1", "aa3"])
+        self.assertLessEqual(cache.memory_bytes, 20)
+        render = Mock()
+        self.assertEqual(cache.get_or_render("aa2", render), b"2" * 10)
+        render.assert_not_called()
+
+    def test_disk_is_pruned_to_budget(self):
+        """Test least recently used entries are removed from disk."""
+        cache = RenditionCache(self.directory, 0, 100)
+        for index in range(5):
+            cache.get_or_render(f"key{index}", lambda: b"x" * 30)
+
+        self.assertLessEqual(cache.disk_bytes, 100)
+        self.assertIsNotNone(cache.disk_get("key4"))
+        self.assertIsNone(cache.disk_get("key0"))
+
+    def test_concurrent_requests_render_once(self):
+        """Test concurrent requests for a key collapse into one render."""
+        cache = RenditionCache(self.directory, 1024, 4096)
+        calls = []
+
+        def render():
+            calls.append(1)
+            time.sleep(0.1)
+            return b"content"
+
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(cache.get_or_render("key", render))
+            )
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [b"content"] * 5)
@@ -0,0 +1,136 @@
+"""
+Test for the media storage.
+"""
+import os
+import shutil
+import tempfile
+from io import BytesIO
+from unittest import skipUnless
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.test import SimpleTestCase, override_settings
+from PIL import Image as PILImage
+
+from core.storage import MediaStorage, sharded_name
+from core.tasks import render_thumbnails
+
+try:
+    import boto3
+    from moto import mock_s3
+    from storages.backends.s3 import S3Storage
+except ImportError:
+    mock_s3 = None
+
+S3_STORAGES = {"default": {"BACKEND": "storages.backends.s3.S3Storage"}}
+
+
+def image_content(size=(400, 400)):
+    content = BytesIO()
+    PILImage.new("RGB", size).save(content, "png")
+    return ContentFile(content.getvalue())
+
+
+class ShardedNameTests(SimpleTestCase):
+    """Test the sharded layout of stored names."""
+
+    def test_content_hash_names_sharded_by_hash(self):
+        """Test originals and their thumbnails share the shard of the hash."""
+        content_hash = "ab12" + "0" * 60
+
+        self.assertEqual(
+            sharded_name(f"images/{content_hash}.png"),
+            f"images/ab/12/{content_hash}.png",
+        )
+        self.assertEqual(
+            sharded_name(f"images/{content_hash}_thumbnail_200px.jpg"),
+            f"images/ab/12/{content_hash}_thumbnail_200px.jpg",
+        )
+
+    def test_other_names_sharded_by_name_hash(self):
+        """Test names without a content hash are spread by their own hash."""
+        name = sharded_name("images/photo.png")
+
+        self.assertRegex(name, r"^images/[0-9a-f]{2}/[0-9a-f]{2}/photo\.png$")
+        self.assertEqual(sharded_name("images/photo.png"), name)
+
+
+class MediaStorageTests(SimpleTestCase):
+    """Test the local media storage."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.storage = MediaStorage(location=self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_save_replaces_existing_content_hash_file(self):
+        """Test saving an existing content hash name replaces that file."""
+        basename = "ab12" + "0" * 60 + ".png"
+        self.storage.save(f"images/{basename}", ContentFile(b"first"))
+
+        name = self.storage.save(f"images/{basename}", ContentFile(b"second"))
+
+        self.assertEqual(name, f"images/{basename}")
+        self.assertEqual(os.listdir(os.path.join(self.directory, "images")), [basename])
+        with self.storage.open(name) as file:
+            self.assertEqual(file.read(), b"second")
+
+    def test_save_keeps_existing_file_of_other_name(self):
+        """Test names not derived from the content are never overwritten."""
+        self.storage.save("images/photo.png", ContentFile(b"first"))
+
+        name = self.storage.save("images/photo.png", ContentFile(b"second"))
+
+        self.assertNotEqual(name, "images/photo.png")
+        with self.storage.open("images/photo.png") as file:
+            self.assertEqual(file.read(), b"first")
+
+
+@skipUnless(mock_s3, "Requires moto and django-storages.")
+@override_settings(
+    STORAGES=S3_STORAGES,
+    AWS_STORAGE_BUCKET_NAME="images",
+    AWS_ACCESS_KEY_ID="testing",
+    AWS_SECRET_ACCESS_KEY="testing",
+    AWS_S3_REGION_NAME="us-east-1",
+)
+class S3StorageTests(SimpleTestCase):
+    """Test thumbnails rendered against an S3 stand-in."""
+
+    def setUp(self):
+        self.enterContext(mock_s3())
+        boto3.client("s3", region_name="us-east-1").create_bucket(Bucket="images")
+
+    def test_thumbnails_use_object_storage(self):
+        """Test thumbnails are read from and written to object storage."""
+        default_storage.save("images/original.png", image_content())
+
+        render_thumbnails("images/original.png", [("images/thumb.jpg", 200)])
+
+        with default_storage.open("images/thumb.jpg") as file:
+            with PILImage.open(file) as img:
+                self.assertEqual(img.size, (200, 200))
+
+    def test_files_served_unsigned_and_cached(self):
+        """Test files get stable public URLs and long lived cache headers."""
+        storage = S3Storage(
+            **{
+                **settings.S3_STORAGE_OPTIONS,
+                "bucket_name": "images",
+                "region_name": "us-east-1",
+                "custom_domain": "media.example.com/images",
+            }
+        )
+
+        name = storage.save("images/original.png", image_content())
+
+        self.assertEqual(
+            storage.url(name), "https://media.example.com/images/images/original.png"
+        )
+        head = boto3.client("s3", region_name="us-east-1").head_object(
+            Bucket="images", Key=name
+        )
+        self.assertIn("immutable", head["CacheControl"])
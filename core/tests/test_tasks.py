@@ -0,0 +1,212 @@
+"""
+Test for thumbnail tasks.
+"""
+import os
+import shutil
+import tempfile
+from unittest import skipUnless
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+from PIL import Image as PILImage
+
+from core import engines, tasks
+from core.models import Image, Rendition
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+class ThumbnailTaskTests(TestCase):
+    """Test thumbnail generation tasks."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.enterContext(override_settings(MEDIA_ROOT=self.directory))
+        self.image_name = "test.png"
+        PILImage.new("RGB", (1000, 800)).save(self.path(self.image_name))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def thumbnail_name(self, height):
+        return f"test_thumbnail_{height}px.jpg"
+
+    def test_create_thumbnails_renders_all_sizes(self):
+        """Test every requested height is rendered preserving aspect ratio."""
+        tasks.create_thumbnails(
+            self.image_name,
+            [(self.thumbnail_name(200), 200), (self.thumbnail_name(400), 400)],
+        )
+
+        with PILImage.open(self.path(self.thumbnail_name(200))) as img:
+            self.assertEqual(img.size, (250, 200))
+        with PILImage.open(self.path(self.thumbnail_name(400))) as img:
+            self.assertEqual(img.size, (500, 400))
+
+    def test_create_thumbnail_translates_queued_paths(self):
+        """Test tasks queued with MEDIA_ROOT paths render to the storage."""
+        tasks.create_thumbnail(
+            self.path(self.image_name), self.path(self.thumbnail_name(200)), 200
+        )
+
+        with PILImage.open(self.path(self.thumbnail_name(200))) as img:
+            self.assertEqual(img.size, (250, 200))
+
+    @override_settings(THUMBNAIL_ENGINE="pillow")
+    def test_create_thumbnails_decodes_original_once(self):
+        """Test the original is opened once regardless of the number of sizes."""
+        with patch("core.engines.Image.open", wraps=PILImage.open) as patched_open:
+            tasks.create_thumbnails(
+                self.image_name,
+                [(self.thumbnail_name(200), 200), (self.thumbnail_name(400), 400)],
+            )
+
+        patched_open.assert_called_once()
+
+    @override_settings(THUMBNAIL_ENGINE="pillow")
+    def test_jpeg_is_decoded_at_reduced_scale(self):
+        """Test large JPEGs are draft-decoded near the target size."""
+        PILImage.new("RGB", (4000, 3000)).save(self.path("large.jpg"))
+
+        with PILImage.open(self.path("large.jpg")) as img:
+            engines._reduce_decode(img, 200)
+            self.assertEqual(img.size, (1000, 750))
+
+        tasks.create_thumbnails("large.jpg", [(self.thumbnail_name(200), 200)])
+        with PILImage.open(self.path(self.thumbnail_name(200))) as img:
+            self.assertEqual(img.size, (266, 200))
+
+    def test_encoder_settings_are_applied(self):
+        """Test thumbnails are written with the format and options given."""
+        tasks.create_thumbnails(
+            self.image_name,
+            [(self.thumbnail_name(200), 200)],
+            {"format": "JPEG", "quality": 80, "progressive": True},
+        )
+
+        with PILImage.open(self.path(self.thumbnail_name(200))) as img:
+            self.assertTrue(img.info.get("progressive"))
+
+    def test_webp_keeps_transparency(self):
+        """Test formats with an alpha channel keep the source transparency."""
+        webp_name = "transparent_thumbnail_200px.webp"
+        PILImage.new("RGBA", (400, 400), (0, 0, 0, 0)).save(
+            self.path("transparent.png")
+        )
+
+        tasks.create_thumbnails(
+            "transparent.png", [(webp_name, 200)], {"format": "WEBP", "quality": 80}
+        )
+
+        with PILImage.open(self.path(webp_name)) as img:
+            self.assertEqual(img.format, "WEBP")
+            self.assertEqual(img.mode, "RGBA")
+
+    def test_thumbnails_replace_existing_files(self):
+        """Test rendering again replaces the stored thumbnail in place."""
+        PILImage.new("RGB", (10, 10)).save(self.path(self.thumbnail_name(200)))
+
+        tasks.create_thumbnails(self.image_name, [(self.thumbnail_name(200), 200)])
+
+        self.assertEqual(
+            sorted(os.listdir(self.directory)), ["test.png", "test_thumbnail_200px.jpg"]
+        )
+        with PILImage.open(self.path(self.thumbnail_name(200))) as img:
+            self.assertEqual(img.size, (250, 200))
+
+    def create_rendition(self, height):
+        user = get_user_model().objects.create_user(f"user{height}@example.com")
+        image = Image.objects.create(user=user, file=self.image_name)
+        return Rendition.objects.create(
+            image=image, height=height, file=self.thumbnail_name(height)
+        )
+
+    def test_rendered_thumbnails_are_ready(self):
+        """Test rendered thumbnails mark their renditions ready with timings."""
+        rendition = self.create_rendition(200)
+
+        tasks.create_thumbnails(self.image_name, [(self.thumbnail_name(200), 200)])
+
+        rendition.refresh_from_db()
+        self.assertEqual(rendition.status, Rendition.Status.READY)
+        self.assertEqual(rendition.error, "")
+        self.assertLessEqual(rendition.started_at, rendition.finished_at)
+
+    def test_failed_thumbnails_record_error(self):
+        """Test renditions of an unreadable original are failed with the error."""
+        rendition = self.create_rendition(200)
+
+        with self.assertLogs("core.tasks", "ERROR"):
+            tasks.create_thumbnails("missing.png", [(self.thumbnail_name(200), 200)])
+
+        rendition.refresh_from_db()
+        self.assertEqual(rendition.status, Rendition.Status.FAILED)
+        self.assertIn("missing.png", rendition.error)
+        self.assertIsNotNone(rendition.finished_at)
+
+    @override_settings(THUMBNAIL_TASK_MAX_RETRIES=2)
+    def test_transient_errors_retried(self):
+        """Test jobs are retried on transient errors before failing."""
+        rendition = self.create_rendition(200)
+
+        with patch(
+            "core.tasks.default_storage.open", side_effect=ConnectionError("down")
+        ) as patched_open, self.assertLogs("core.tasks", "WARNING"):
+            tasks.create_thumbnails.apply(
+                (self.image_name, [(self.thumbnail_name(200), 200)])
+            )
+
+        self.assertEqual(patched_open.call_count, 3)
+        rendition.refresh_from_db()
+        self.assertEqual(rendition.status, Rendition.Status.FAILED)
+        self.assertIn("down", rendition.error)
+
+    @skipUnless(fakeredis, "Requires fakeredis.")
+    def test_finished_job_released(self):
+        """Test a finished job can be queued again."""
+        redis_caches = {
+            "default": {
+                "BACKEND": "django.core.cache.backends.redis.RedisCache",
+                "LOCATION": "redis://localhost:6379/0",
+                "OPTIONS": {
+                    "connection_class": fakeredis.FakeConnection,
+                    "server": fakeredis.FakeServer(),
+                },
+            }
+        }
+        self.enterContext(override_settings(CACHES=redis_caches))
+        self.addCleanup(caches["default"].close)
+        renditions = [(self.thumbnail_name(200), 200)]
+        task_id = tasks.job_id(self.image_name, renditions)
+        self.assertTrue(tasks.claim_job(task_id))
+
+        self.assertFalse(tasks.claim_job(task_id))
+
+        tasks.create_thumbnails.apply((self.image_name, renditions), task_id=task_id)
+
+        self.assertTrue(tasks.claim_job(task_id))
+        tasks.release_job(task_id)
+
+    def test_job_id_identifies_rendered_files(self):
+        """Test jobs rendering the same files share their id."""
+        renditions = [("a_200.jpg", 200), ("a_400.jpg", 400)]
+
+        self.assertEqual(
+            tasks.job_id("a.png", renditions),
+            tasks.job_id("a.png", list(reversed(renditions))),
+        )
+        self.assertNotEqual(
+            tasks.job_id("a.png", renditions), tasks.job_id("b.png", renditions)
+        )
+        self.assertNotEqual(
+            tasks.job_id("a.png", renditions),
+            tasks.job_id("a.png", renditions, {"format": "JPEG", "quality": 50}),
+        )
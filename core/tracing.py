@@ -0,0 +1,47 @@
+"""
+Optional OpenTelemetry tracing of uploads and thumbnail jobs.
+
+Tracing is enabled by ``configure_tracing`` when the OpenTelemetry SDK and
+instrumentations are installed and ``OTEL_EXPORTER_OTLP_ENDPOINT`` is set.
+Django requests and Celery tasks are then instrumented, so the spans of a
+thumbnail task continue the trace of the request that queued it. Otherwise
+``span`` does nothing.
+"""
+import contextlib
+import os
+
+try:
+    from opentelemetry import trace
+except ImportError:
+    trace = None
+
+
+def configure_tracing(service_name):
+    """Export spans to the OTLP endpoint, returns whether tracing is enabled."""
+    if trace is None or not os.environ.get("OTEL_EXPORTER_OTLP_ENDPOINT"):
+        return False
+
+    from opentelemetry.exporter.otlp.proto.http.trace_exporter import (
+        OTLPSpanExporter,
+    )
+    from opentelemetry.instrumentation.celery import CeleryInstrumentor
+    from opentelemetry.instrumentation.django import DjangoInstrumentor
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor
+
+    provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    trace.set_tracer_provider(provider)
+    DjangoInstrumentor().instrument()
+    # Injects the trace context in the published tasks and continues it in
+    # the worker
+    CeleryInstrumentor().instrument()
+    return True
+
+
+def span(name, **attributes):
+    """Return a context manager tracing the block as a span of the trace."""
+    if trace is None:
+        return contextlib.nullcontext()
+    return trace.get_tracer(__name__).start_as_current_span(name, attributes=attributes)
@@ -1,6 +1,17 @@
+import os
+
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class UserimagesConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "userImages"
+
+    def ready(self):
+        # Register the entitlements cache invalidation receivers
+        from . import entitlements  # noqa: F401
+
+        # Large uploads are streamed into this directory
+        if settings.FILE_UPLOAD_TEMP_DIR:
+            os.makedirs(settings.FILE_UPLOAD_TEMP_DIR, exist_ok=True)
@@ -0,0 +1,113 @@
+"""
+Cached entitlements of the user tiers.
+
+The built in tiers are constants. Custom tiers are read from the database
+once and then kept in a short lived local memory cache in front of the
+shared default cache, so uploads and thumbnail requests of custom tier users
+do not query their tier. Saving or deleting a ``CustomTier`` invalidates it.
+"""
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from core.models import CustomTier
+
+from .image_processors import TIER_PROCESSORS, CustomImageProcessor
+from .utils import LocalCache
+
+LOCAL_CACHE_MAX_ENTRIES = 1024
+
+
+@dataclass(frozen=True)
+class Entitlements:
+    """What the images of a tier get, usable wherever a CustomTier is."""
+
+    tier: str
+    thumbnail_sizes: tuple
+    include_original_link: bool = False
+    generate_expiring_links: bool = False
+
+    def get_thumbnail_sizes(self):
+        return list(self.thumbnail_sizes)
+
+
+TIER_ENTITLEMENTS = {
+    "Basic": Entitlements("Basic", tuple(TIER_PROCESSORS["Basic"].thumbnail_sizes)),
+    "Premium": Entitlements(
+        "Premium",
+        tuple(TIER_PROCESSORS["Premium"].thumbnail_sizes),
+        include_original_link=True,
+    ),
+    "Enterprise": Entitlements(
+        "Enterprise",
+        tuple(TIER_PROCESSORS["Enterprise"].thumbnail_sizes),
+        include_original_link=True,
+        generate_expiring_links=True,
+    ),
+}
+
+
+local_cache = LocalCache(LOCAL_CACHE_MAX_ENTRIES)
+
+
+def custom_tier_key(custom_tier_id):
+    return f"entitlements:custom-tier:{custom_tier_id}"
+
+
+def load_custom_entitlements(custom_tier_id):
+    custom_tier = CustomTier.objects.get(pk=custom_tier_id)
+    return Entitlements(
+        CustomImageProcessor.tier,
+        tuple(CustomImageProcessor.get_thumbnail_sizes(custom_tier)),
+        include_original_link=custom_tier.include_original_link,
+        generate_expiring_links=custom_tier.generate_expiring_links,
+    )
+
+
+def get_entitlements(user):
+    """
+    Return the entitlements of the user's tier.
+
+    Only the tier columns of the already loaded user are read. Custom tiers
+    are looked up in the local cache, then the shared cache, and only loaded
+    from the database on a miss.
+    """
+    if user.custom_tier_id is None:
+        return TIER_ENTITLEMENTS[user.tier]
+
+    key = custom_tier_key(user.custom_tier_id)
+    entitlements = local_cache.get(key)
+    if entitlements is None:
+        entitlements = cache.get(key)
+        if entitlements is None:
+            entitlements = load_custom_entitlements(user.custom_tier_id)
+            cache.set(key, entitlements, settings.ENTITLEMENTS_CACHE_TIMEOUT)
+        local_cache.set(key, entitlements, settings.ENTITLEMENTS_LOCAL_TIMEOUT)
+    return entitlements
+
+
+def get_tier(user):
+    """Return the name of the user's tier, "Custom" for custom tiers."""
+    return get_entitlements(user).tier
+
+
+def get_thumbnail_sizes(user):
+    """Return the thumbnail heights the user's tier is entitled to."""
+    return get_entitlements(user).get_thumbnail_sizes()
+
+
+@receiver(post_save, sender=CustomTier)
+@receiver(post_delete, sender=CustomTier)
+def invalidate_custom_tier(sender, instance, **kwargs):
+    """
+    Drop the cached entitlements of a changed custom tier.
+
+    Other processes keep their local copy for at most
+    ``ENTITLEMENTS_LOCAL_TIMEOUT`` seconds.
+    """
+    key = custom_tier_key(instance.pk)
+    local_cache.delete(key)
+    cache.delete(key)
@@ -1,51 +1,126 @@
-import os
+import posixpath
 
 from django.conf import settings
+from django.core.files.storage import default_storage
 from django.urls import reverse
 from django.utils import timezone
 
-from core.tasks import create_thumbnail
+from core.backends import get_thumbnail_backend
+from core.encoders import cache_tag, extension, thumbnail_encoder
+from core.models import Rendition
 
-from .utils import generate_expiring_link
+from .links import generate_expiring_link
 
 
 class BaseImageProcessor:
-    def create_thumbnail(self, instance, thumbnail_suffix, thumbnail_size=None):
-        image_path = instance.file.path
-        thumbnail_filename = (
-            os.path.splitext(os.path.basename(image_path))[0] + thumbnail_suffix
+    tier = None
+    thumbnail_sizes = []
+
+    def __init__(self):
+        self.jobs = []
+        self.renditions = []
+
+    def thumbnail_name(self, image_name, thumbnail_size):
+        """
+        Return the storage name of a thumbnail, next to the original.
+
+        The name carries the tag of the tier's encoder and the engine, so
+        tiers encoding the same original differently never share or overwrite
+        a thumbnail, and thumbnails rendered with other settings get new names
+        rather than replacing files served as immutable.
+        """
+        directory, basename = posixpath.split(image_name)
+        basename = posixpath.splitext(basename)[0]
+        encoder = thumbnail_encoder(self.tier)
+        return posixpath.join(
+            directory,
+            f"{basename}_thumbnail_{thumbnail_size}px_{cache_tag(encoder)}"
+            f".{extension(encoder)}",
         )
-        thumbnail_path = os.path.join(settings.MEDIA_ROOT, "images", thumbnail_filename)
 
-        create_thumbnail.delay(image_path, thumbnail_path, thumbnail_size)
-        return os.path.relpath(thumbnail_path, start=settings.MEDIA_ROOT)
+    def create_thumbnails(self, instance, thumbnail_sizes, force=False):
+        """
+        Plan a single job rendering all the given sizes of the image.
+
+        The job is collected in ``self.jobs`` and only handed to the thumbnail
+        backend by ``submit_jobs``, once the image has been committed. Unsaved
+        ``Rendition`` rows for every size are collected in ``self.renditions``
+        for the caller to insert along with the image, pending until the
+        job records their outcome. Originals
+        are named by content hash, so sizes already rendered for the same
+        content are reused and left out of the job, unless ``force`` is set.
+        Returns a mapping of size to the thumbnail storage name.
+
+        With ``THUMBNAIL_EAGER_RENDITIONS`` disabled nothing is planned, the
+        sizes map to None and are only rendered when requested.
+        """
+        if not settings.THUMBNAIL_EAGER_RENDITIONS:
+            self.renditions.extend(
+                Rendition(
+                    image=instance,
+                    height=thumbnail_size,
+                    status=Rendition.Status.ON_DEMAND,
+                )
+                for thumbnail_size in thumbnail_sizes
+            )
+            return dict.fromkeys(thumbnail_sizes)
+
+        image_name = instance.original or instance.file.name
+        renditions = []
+        thumbnails = {}
+        for thumbnail_size in thumbnail_sizes:
+            thumbnail_name = self.thumbnail_name(image_name, thumbnail_size)
+            thumbnails[thumbnail_size] = thumbnail_name
+            rendition = Rendition(
+                image=instance, height=thumbnail_size, file=thumbnail_name
+            )
+            if not force and default_storage.exists(thumbnail_name):
+                rendition.status = Rendition.Status.READY
+            else:
+                renditions.append((thumbnail_name, thumbnail_size))
+            self.renditions.append(rendition)
+
+        if renditions:
+            self.jobs.append((image_name, renditions, self.tier))
+        return thumbnails
+
+    def assign_thumbnails(self, instance, thumbnails):
+        """Set the thumbnail columns of the tier from a size to name mapping."""
+        instance.thumbnail_200px = thumbnails.get(200)
+        instance.thumbnail_400px = thumbnails.get(400)
+        instance.custom_thumbnail = None
+
+    def submit_jobs(self):
+        """Hand the collected thumbnail jobs to the backend on commit."""
+        get_thumbnail_backend().submit_on_commit(self.jobs)
+        self.jobs = []
 
 
 class BasicImageProcessor(BaseImageProcessor):
+    tier = "Basic"
+    thumbnail_sizes = [200]
+
     def process_image(self, instance):
-        instance.thumbnail_200px = self.create_thumbnail(
-            instance, "_thumbnail_200px.jpg", 200
-        )
+        thumbnails = self.create_thumbnails(instance, self.thumbnail_sizes)
+        self.assign_thumbnails(instance, thumbnails)
 
 
 class PremiumImageProcessor(BaseImageProcessor):
+    tier = "Premium"
+    thumbnail_sizes = [200, 400]
+
     def process_image(self, instance):
-        instance.thumbnail_200px = self.create_thumbnail(
-            instance, "_thumbnail_200px.jpg", 200
-        )
-        instance.thumbnail_400px = self.create_thumbnail(
-            instance, "_thumbnail_400px.jpg", 400
-        )
+        thumbnails = self.create_thumbnails(instance, self.thumbnail_sizes)
+        self.assign_thumbnails(instance, thumbnails)
 
 
 class EnterpriseImageProcessor(BaseImageProcessor):
+    tier = "Enterprise"
+    thumbnail_sizes = [200, 400]
+
     def process_image(self, instance, request):
-        instance.thumbnail_200px = self.create_thumbnail(
-            instance, "_thumbnail_200px.jpg", 200
-        )
-        instance.thumbnail_400px = self.create_thumbnail(
-            instance, "_thumbnail_400px.jpg", 400
-        )
+        thumbnails = self.create_thumbnails(instance, self.thumbnail_sizes)
+        self.assign_thumbnails(instance, thumbnails)
         self.request = request
         expiration_seconds = self.request.data.get("expiration_time")
         if expiration_seconds is None or not expiration_seconds.strip():
@@ -58,7 +133,7 @@ class EnterpriseImageProcessor(BaseImageProcessor):
             )
 
             # Generate the expiring link
-            expiring_link = generate_expiring_link(instance.file.url, expiration_time)
+            expiring_link = generate_expiring_link(instance.pk, expiration_time)
 
             # Include the expiring link
             full_url = self.request.build_absolute_uri(
@@ -68,15 +143,28 @@ class EnterpriseImageProcessor(BaseImageProcessor):
 
 
 class CustomImageProcessor(BaseImageProcessor):
+    tier = "Custom"
+
+    @staticmethod
+    def get_thumbnail_sizes(user_tier):
+        return user_tier.get_thumbnail_sizes()
+
+    def assign_thumbnails(self, instance, thumbnails):
+        # Every size is listed in the image renditions, the legacy column
+        # keeps the first one
+        instance.thumbnail_200px = None
+        instance.thumbnail_400px = None
+        instance.custom_thumbnail = next(iter(thumbnails.values()))
+
     def process_image(self, instance, user_tier, request):
-        thumbnail_size = int(user_tier.thumbnail_sizes)
-        instance.custom_thumbnail = self.create_thumbnail(
-            instance, f"_thumbnail_{thumbnail_size}px.jpg", thumbnail_size
-        )
+        thumbnail_sizes = self.get_thumbnail_sizes(user_tier)
+        thumbnails = self.create_thumbnails(instance, thumbnail_sizes)
+        self.assign_thumbnails(instance, thumbnails)
 
         link_to_original_file = user_tier.include_original_link
         generate_expiring_links = user_tier.generate_expiring_links
 
+        expiration_seconds = None
         if generate_expiring_links:
             expiration_seconds = request.data.get("expiration_time")
 
@@ -90,7 +178,7 @@ class CustomImageProcessor(BaseImageProcessor):
             )
 
             # Generate the expiring link
-            expiring_link = generate_expiring_link(instance.file.url, expiration_time)
+            expiring_link = generate_expiring_link(instance.pk, expiration_time)
 
             # Include the expiring link
             full_url = request.build_absolute_uri(
@@ -100,3 +188,10 @@ class CustomImageProcessor(BaseImageProcessor):
 
         if not link_to_original_file:
             instance.file = ""
+
+
+TIER_PROCESSORS = {
+    "Basic": BasicImageProcessor,
+    "Premium": PremiumImageProcessor,
+    "Enterprise": EnterpriseImageProcessor,
+}
@@ -0,0 +1,369 @@
+"""
+Django command to benchmark thumbnail generation on a synthetic image corpus.
+"""
+import json
+import math
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import statistics
+import tempfile
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+import PIL
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import override_settings
+from django.utils import timezone
+from PIL import Image as PILImage
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from core import engines
+from core.models import Rendition
+from core.tasks import create_thumbnails
+from userImages import links
+
+# Kind of corpus image -> (PIL mode, file format, extension).
+CORPUS_KINDS = {
+    "jpeg": ("RGB", "JPEG", "jpg"),
+    "png": ("RGB", "PNG", "png"),
+    "rgba": ("RGBA", "PNG", "png"),
+    "palette": ("P", "PNG", "png"),
+}
+
+WORKLOADS = ("task", "upload")
+
+THUMBNAIL_SIZES = (200, 400)
+
+# The corpus is written to a local directory, whatever the configured storage.
+LOCAL_STORAGE = {"BACKEND": "core.storage.MediaStorage"}
+
+
+def corpus_image(mode, megapixels):
+    """
+    Create a deterministic image of roughly the given size.
+
+    The content is built from a Mandelbrot fractal and gradients, so it has
+    real detail for the encoders while being identical between runs.
+    """
+    height = max(int(math.sqrt(megapixels * 1_000_000 * 3 / 4)), 1)
+    width = max(int(height * 4 / 3), 1)
+    size = (width, height)
+    fractal = PILImage.effect_mandelbrot(size, (-2.0, -1.2, 1.0, 1.2), 40)
+    linear = PILImage.linear_gradient("L").resize(size)
+    radial = PILImage.radial_gradient("L").resize(size)
+    img = PILImage.merge("RGB", (fractal, linear, radial))
+    if mode == "RGBA":
+        img.putalpha(radial)
+    elif mode == "P":
+        img = img.quantize(256)
+    return img
+
+
+def build_corpus(directory, megapixels, large_megapixels):
+    """Write the corpus to the directory and return its entries."""
+    specs = [(kind, size) for size in megapixels for kind in CORPUS_KINDS]
+    if large_megapixels:
+        specs.append(("jpeg", large_megapixels))
+
+    corpus = []
+    for kind, size in specs:
+        mode, file_format, extension = CORPUS_KINDS[kind]
+        name = f"{kind}_{size:g}mp.{extension}"
+        path = os.path.join(directory, name)
+        img = corpus_image(mode, size)
+        img.save(path, file_format)
+        corpus.append(
+            {
+                "name": name,
+                "path": path,
+                "kind": kind,
+                "format": file_format,
+                "megapixels": round(img.size[0] * img.size[1] / 1_000_000, 2),
+                "bytes": os.path.getsize(path),
+            }
+        )
+    return corpus
+
+
+def percentile(samples, fraction):
+    """Return the nearest-rank percentile of the samples."""
+    ordered = sorted(samples)
+    index = max(math.ceil(fraction * len(ordered)) - 1, 0)
+    return ordered[index]
+
+
+def run_task(entry, directory):
+    """Render the Premium tier thumbnails of the entry with the Celery task."""
+    renditions = [(f"bench_thumbnail_{size}px.jpg", size) for size in THUMBNAIL_SIZES]
+    create_thumbnails(entry["name"], renditions)
+
+
+def run_upload(entry, directory):
+    """
+    Post the entry through ImageUploadView.perform_create as a Premium user.
+
+    The user and the upload are rolled back. Thumbnail jobs are submitted
+    once the upload is committed, so the commit callbacks are run before,
+    rendering the thumbnails with the sync backend.
+    """
+    from userImages.throttles import UploadRateThrottle
+    from userImages.views import ImageUploadView
+
+    with open(entry["path"], "rb") as source:
+        content = source.read()
+
+    with transaction.atomic():
+        user = get_user_model().objects.create_user(
+            f"benchmark-{uuid.uuid4().hex}@example.com", tier="Premium"
+        )
+        # The rolled back user's primary key is handed out again, start it
+        # with a full upload bucket
+        cache.delete(UploadRateThrottle.bucket_key(user))
+        request = APIRequestFactory().post(
+            "/api/images/",
+            {"file": SimpleUploadedFile(entry["name"], content)},
+            format="multipart",
+        )
+        force_authenticate(request, user=user)
+        callbacks = len(connection.run_on_commit)
+        response = ImageUploadView.as_view({"post": "create"})(request)
+        # Run the callbacks of the upload in order, including those they add
+        while len(connection.run_on_commit) > callbacks:
+            _, callback, _ = connection.run_on_commit.pop(callbacks)
+            callback()
+        if response.status_code != 201:
+            raise RuntimeError(f"Upload failed with {response.status_code}.")
+        unrendered = Rendition.objects.filter(
+            image__user=user,
+            status__in=[Rendition.Status.PENDING, Rendition.Status.FAILED],
+        )
+        if unrendered.exists():
+            raise RuntimeError("Upload did not render its thumbnails.")
+        transaction.set_rollback(True)
+
+
+RUNNERS = {"task": run_task, "upload": run_upload}
+
+
+def measure(workload, engine, entry, iterations, directory, connection):
+    """
+    Time the workload in a child process and send the samples back.
+
+    Running each case in its own process keeps peak memory of one case from
+    hiding the next one.
+    """
+    try:
+        baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        samples = []
+        with override_settings(
+            MEDIA_ROOT=directory,
+            STORAGES={**settings.STORAGES, "default": LOCAL_STORAGE},
+            THUMBNAIL_BACKEND="sync",
+            THUMBNAIL_ENGINE=engine,
+        ):
+            for _ in range(iterations):
+                started = time.perf_counter()
+                RUNNERS[workload](entry, directory)
+                samples.append(time.perf_counter() - started)
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        connection.send({"samples": samples, "peak_rss_kb": peak_rss - baseline_rss})
+    except Exception as e:
+        connection.send({"error": str(e)})
+    finally:
+        connection.close()
+
+
+def run_case(workload, engine, entry, iterations, directory):
+    """Run a benchmark case in a forked process and summarize the result."""
+    context = multiprocessing.get_context("fork")
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(
+        target=measure,
+        args=(workload, engine, entry, iterations, directory, sender),
+    )
+    process.start()
+    sender.close()
+    outcome = receiver.recv()
+    process.join()
+
+    result = {
+        "workload": workload,
+        "engine": engine,
+        "image": entry["name"],
+        "kind": entry["kind"],
+        "format": entry["format"],
+        "megapixels": entry["megapixels"],
+        "bytes": entry["bytes"],
+        "iterations": iterations,
+    }
+    if "error" in outcome:
+        result["error"] = outcome["error"]
+        return result
+
+    samples = outcome["samples"]
+    total = sum(samples)
+    result.update(
+        {
+            "p50_ms": round(percentile(samples, 0.50) * 1000, 3),
+            "p95_ms": round(percentile(samples, 0.95) * 1000, 3),
+            "mean_ms": round(statistics.mean(samples) * 1000, 3),
+            "throughput_per_s": round(len(samples) / total, 3) if total else None,
+            "megapixels_per_s": (
+                round(len(samples) * entry["megapixels"] / total, 3) if total else None
+            ),
+            "peak_rss_kb": outcome["peak_rss_kb"],
+        }
+    )
+    return result
+
+
+def time_per_call(function, iterations):
+    """Return the mean duration of a call in microseconds."""
+    started = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return round((time.perf_counter() - started) / iterations * 1_000_000, 3)
+
+
+def benchmark_expiring_links(iterations):
+    """Compare the length and verification time of both expiring link formats."""
+    expiration_time = timezone.now() + timezone.timedelta(hours=1)
+    name = f"images/{'0' * 64}.jpg"
+    legacy = signing.dumps(
+        (name, expiration_time.strftime(links.LEGACY_EXPIRATION_FORMAT))
+    )
+    token = links.generate_expiring_link(1, expiration_time)
+    verified_tokens = links.verified_tokens
+    links.verified_tokens = links.LocalCache(1)
+    try:
+        links.verify_cached_token(token)
+        return {
+            "iterations": iterations,
+            "legacy": {
+                "length": len(legacy),
+                "verify_us": time_per_call(
+                    lambda: links.verify_legacy_link(legacy), iterations
+                ),
+            },
+            "token": {
+                "length": len(token),
+                "verify_us": time_per_call(
+                    lambda: links.verify_token(token), iterations
+                ),
+                "cached_us": time_per_call(
+                    lambda: links.verify_cached_token(token), iterations
+                ),
+            },
+        }
+    finally:
+        links.verified_tokens = verified_tokens
+
+
+def parse_floats(value):
+    return [float(item) for item in value.split(",") if item.strip()]
+
+
+class Command(BaseCommand):
+    """Django command to benchmark thumbnail generation."""
+
+    help = (
+        "Benchmark thumbnail generation on a synthetic corpus and report "
+        "latency, throughput and peak memory as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--megapixels",
+            type=parse_floats,
+            default=[1.0, 6.0, 24.0],
+            help="Comma separated corpus image sizes in megapixels.",
+        )
+        parser.add_argument(
+            "--large-megapixels",
+            type=float,
+            default=50.0,
+            help="Size of the additional very large JPEG, 0 to skip it.",
+        )
+        parser.add_argument("--iterations", type=int, default=5)
+        parser.add_argument(
+            "--workload",
+            choices=WORKLOADS,
+            action="append",
+            help="Workload to run, may be repeated. Defaults to all workloads.",
+        )
+        parser.add_argument(
+            "--engine",
+            choices=engines.ENGINES,
+            action="append",
+            help="Resize engine to run, may be repeated. Defaults to THUMBNAIL_ENGINE.",
+        )
+        parser.add_argument(
+            "--link-iterations",
+            type=int,
+            default=10000,
+            help="Verifications per expiring link format, 0 to skip them.",
+        )
+        parser.add_argument(
+            "--output", help="Write the JSON report to this file instead of stdout."
+        )
+
+    def handle(self, *args, **options):
+        """Entry point for command."""
+        workloads = options["workload"] or WORKLOADS
+        engine_names = options["engine"] or [settings.THUMBNAIL_ENGINE]
+        directory = tempfile.mkdtemp(prefix="thumbnail-benchmark-")
+        try:
+            # Built in a child process, so the corpus images do not raise the
+            # peak memory the benchmark cases start from
+            with ProcessPoolExecutor(
+                max_workers=1, mp_context=multiprocessing.get_context("fork")
+            ) as executor:
+                corpus = executor.submit(
+                    build_corpus,
+                    directory,
+                    options["megapixels"],
+                    options["large_megapixels"],
+                ).result()
+            results = [
+                run_case(workload, engine, entry, options["iterations"], directory)
+                for workload in workloads
+                for engine in engine_names
+                for entry in corpus
+            ]
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+        report = {
+            "environment": {
+                "python": platform.python_version(),
+                "pillow": PIL.__version__,
+                "libvips": (
+                    ".".join(str(engines.pyvips.version(i)) for i in range(3))
+                    if engines.pyvips
+                    else None
+                ),
+                "cpu_count": os.cpu_count(),
+            },
+            "thumbnail_sizes": list(THUMBNAIL_SIZES),
+            "results": results,
+        }
+        if options["link_iterations"]:
+            report["expiring_links"] = benchmark_expiring_links(
+                options["link_iterations"]
+            )
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as report_file:
+                report_file.write(output)
+        else:
+            self.stdout.write(output)
@@ -0,0 +1,267 @@
+"""
+Django command to render the thumbnails of existing images again.
+"""
+import json
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+
+from core.backends import BACKENDS, CeleryBackend, get_thumbnail_backend
+from core.cleanup import delete_unreferenced_files
+from core.models import Image, Rendition
+from userImages.entitlements import get_entitlements
+from userImages.image_processors import TIER_PROCESSORS, CustomImageProcessor
+
+TIERS = ("Basic", "Premium", "Enterprise", "Custom")
+
+
+def chunked(iterable, size):
+    """Yield lists of ``size`` items of the iterable, the last one shorter."""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def write_checkpoint(path, checkpoint):
+    """Replace the checkpoint file atomically."""
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "w") as file:
+        json.dump(checkpoint, file)
+    os.replace(temporary_path, path)
+
+
+def processor_for(entitlements):
+    return TIER_PROCESSORS.get(entitlements.tier, CustomImageProcessor)()
+
+
+def expected_renditions(processor, image, thumbnail_sizes):
+    """
+    Return the ``(height, file, status)`` the image's renditions should have.
+
+    Thumbnail names carry the tag of the tier's encoder and the engine, so
+    renditions of earlier encoder or engine settings are not current.
+    """
+    if not settings.THUMBNAIL_EAGER_RENDITIONS:
+        status = Rendition.Status.ON_DEMAND.value
+        return {(size, None, status) for size in thumbnail_sizes}
+    status = Rendition.Status.READY.value
+    return {
+        (size, processor.thumbnail_name(image.original, size), status)
+        for size in thumbnail_sizes
+    }
+
+
+class Command(BaseCommand):
+    """Django command to render the thumbnails of existing images again."""
+
+    help = (
+        "Render the thumbnails of existing images for their owner's current "
+        "tier and settings, resuming from the last checkpoint."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--user",
+            action="append",
+            default=[],
+            help="Only images of the user with this email, may be repeated.",
+        )
+        parser.add_argument(
+            "--tier",
+            action="append",
+            default=[],
+            choices=TIERS,
+            help="Only images of users of this tier, may be repeated.",
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help=(
+                "Render thumbnails again even when they are current, replacing "
+                "them under the same names with the same settings."
+            ),
+        )
+        parser.add_argument("--chunk-size", type=int, default=500)
+        parser.add_argument(
+            "--backend",
+            choices=BACKENDS,
+            help="Thumbnail backend, THUMBNAIL_BACKEND by default.",
+        )
+        parser.add_argument(
+            "--rate",
+            type=float,
+            default=0,
+            help="Most images scheduled per second, 0 for no limit.",
+        )
+        parser.add_argument(
+            "--max-pending",
+            type=int,
+            default=1000,
+            help="Wait while this many thumbnails are pending, 0 to never wait.",
+        )
+        parser.add_argument(
+            "--checkpoint",
+            default=os.path.join(settings.BASE_DIR, "rethumbnail.checkpoint.json"),
+            help="File recording the last image done, to resume from.",
+        )
+        parser.add_argument(
+            "--restart",
+            action="store_true",
+            help="Ignore the checkpoint and start from the first image.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Report the images that would be rendered without changing them.",
+        )
+
+    def get_queryset(self, options):
+        queryset = Image.objects.select_related("user").order_by("id")
+        if options["user"]:
+            queryset = queryset.filter(user__email__in=options["user"])
+        if options["tier"]:
+            tiers = Q(
+                user__tier__in=[tier for tier in options["tier"] if tier != "Custom"],
+                user__custom_tier__isnull=True,
+            )
+            if "Custom" in options["tier"]:
+                tiers |= Q(user__custom_tier__isnull=False)
+            queryset = queryset.filter(tiers)
+        return queryset
+
+    def load_checkpoint(self, options, filters):
+        """Return the id of the last image done by the same run."""
+        if options["restart"] or not os.path.exists(options["checkpoint"]):
+            return 0
+        with open(options["checkpoint"]) as file:
+            checkpoint = json.load(file)
+        if checkpoint["filters"] != filters:
+            raise CommandError(
+                f"{options['checkpoint']} belongs to a run with other filters, "
+                "use --restart to start over."
+            )
+        return checkpoint["last_id"]
+
+    def wait_for_workers(self, max_pending):
+        """Hold the backfill while the thumbnail workers are behind."""
+        if not max_pending:
+            return
+        while (
+            Rendition.objects.filter(status=Rendition.Status.PENDING).count()
+            >= max_pending
+        ):
+            time.sleep(1)
+
+    def plan(self, images, renditions, force):
+        """
+        Plan the thumbnails of a chunk of images.
+
+        Returns the images to update, their new renditions and the jobs
+        rendering them. Images whose renditions match their tier and
+        settings are skipped unless ``force`` is set.
+        """
+        planned = []
+        new_renditions = []
+        jobs = []
+        for image in images:
+            if not image.original:
+                continue
+            entitlements = get_entitlements(image.user)
+            thumbnail_sizes = entitlements.get_thumbnail_sizes()
+            processor = processor_for(entitlements)
+            current = {
+                (rendition.height, rendition.file.name or None, rendition.status)
+                for rendition in renditions.get(image.id, [])
+            }
+            if not force and current == expected_renditions(
+                processor, image, thumbnail_sizes
+            ):
+                continue
+
+            thumbnails = processor.create_thumbnails(image, thumbnail_sizes, force)
+            processor.assign_thumbnails(image, thumbnails)
+            image.file = image.original if entitlements.include_original_link else ""
+            planned.append(image)
+            new_renditions.extend(processor.renditions)
+            jobs.extend(processor.jobs)
+        return planned, new_renditions, jobs
+
+    def process_chunk(self, images, backend, options):
+        renditions = {}
+        for rendition in Rendition.objects.filter(image__in=images):
+            renditions.setdefault(rendition.image_id, []).append(rendition)
+        planned, new_renditions, jobs = self.plan(images, renditions, options["force"])
+        if options["dry_run"] or not planned:
+            return len(planned)
+
+        old_names = {
+            rendition.file.name
+            for image in planned
+            for rendition in renditions.get(image.id, [])
+        }
+        self.wait_for_workers(options["max_pending"])
+        with transaction.atomic():
+            Rendition.objects.filter(image__in=planned).delete()
+            Rendition.objects.bulk_create(new_renditions)
+            Image.objects.bulk_update(
+                planned,
+                ["file", "thumbnail_200px", "thumbnail_400px", "custom_thumbnail"],
+            )
+            # Thumbnails of earlier settings no image uses anymore
+            transaction.on_commit(lambda: delete_unreferenced_files(old_names))
+        backend.submit_many(jobs)
+        return len(planned)
+
+    def handle(self, *args, **options):
+        """Entry point for command."""
+        filters = {
+            "users": sorted(options["user"]),
+            "tiers": sorted(options["tier"]),
+            "force": options["force"],
+        }
+        last_id = self.load_checkpoint(options, filters)
+        backend = get_thumbnail_backend(options["backend"])
+        if isinstance(backend, CeleryBackend):
+            # Uploads keep the workers first, the backfill takes what is left
+            backend.priority = settings.THUMBNAIL_BACKFILL_PRIORITY
+
+        images = (
+            self.get_queryset(options)
+            .filter(id__gt=last_id)
+            .iterator(chunk_size=options["chunk_size"])
+        )
+        started = time.monotonic()
+        seen = scheduled = 0
+        for chunk in chunked(images, options["chunk_size"]):
+            scheduled += self.process_chunk(chunk, backend, options)
+            seen += len(chunk)
+            last_id = chunk[-1].id
+            if not options["dry_run"]:
+                write_checkpoint(
+                    options["checkpoint"], {"filters": filters, "last_id": last_id}
+                )
+            self.stdout.write(
+                f"{seen} images checked, {scheduled} rendered, last id {last_id}."
+            )
+            if options["rate"]:
+                # Pace the run to the average rate since it started
+                delay = scheduled / options["rate"] - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
+
+        if getattr(backend, "executor", None) is not None:
+            # Let the local pool finish before the command exits
+            backend.executor.shutdown(wait=True)
+            type(backend).executor = None
+        self.stdout.write(
+            self.style.SUCCESS(f"Done: {seen} images checked, {scheduled} rendered.")
+        )
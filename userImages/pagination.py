@@ -0,0 +1,17 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class ImageCursorPagination(CursorPagination):
+    """Keyset pagination of images on their id, newest first."""
+
+    page_size = settings.IMAGE_PAGE_SIZE
+    page_size_query_param = "page_size"
+    max_page_size = settings.IMAGE_MAX_PAGE_SIZE
+    ordering = "-id"
+
+
+class SpritePagination(ImageCursorPagination):
+    """Pages of images packed in a sprite, smaller than the largest list pages."""
+
+    max_page_size = settings.SPRITE_MAX_IMAGES
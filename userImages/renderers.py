@@ -0,0 +1,20 @@
+from rest_framework import renderers
+
+
+class ImageRenderer(renderers.BaseRenderer):
+    """
+    Accept requests asking only for images on views returning image content.
+
+    Image content is returned as an ``HttpResponse`` and bypasses rendering;
+    error responses negotiated to this renderer are sent without a body.
+    """
+
+    media_type = "image/*"
+    format = "image"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, bytes):
+            return data
+        return b""
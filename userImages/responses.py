@@ -0,0 +1,178 @@
+"""
+Responses streaming image files from the default storage.
+"""
+import hashlib
+import mimetypes
+import posixpath
+import re
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+from core.storage import CONTENT_HASH_RE
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def parse_range(header, size):
+    """
+    Parse a single ``bytes=`` Range header.
+
+    Returns ``(start, end)`` with an inclusive end, ``None`` if the header
+    should be ignored, or raises ``ValueError`` if the range is not satisfiable.
+    Multiple ranges are not supported and fall back to the full file.
+    """
+    match = RANGE_RE.match(header.strip())
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range, the last N bytes of the file
+        length = int(last)
+        if length == 0:
+            raise ValueError("Empty suffix range.")
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError("Range start is beyond the end of the file.")
+    return start, end
+
+
+def iter_file_range(name, start, length):
+    """Yield ``length`` bytes of the stored file beginning at ``start``."""
+    with default_storage.open(name) as file:
+        file.seek(start)
+        while length > 0:
+            chunk = file.read(min(STREAM_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+async def aiter_file_range(name, start, length):
+    """
+    Yield ``length`` bytes of the stored file beginning at ``start``.
+
+    Every read runs in the thread pool, so the event loop keeps serving other
+    connections while a slow client drains the response.
+    """
+    file = await sync_to_async(default_storage.open, thread_sensitive=False)(name)
+    try:
+        await sync_to_async(file.seek, thread_sensitive=False)(start)
+        while length > 0:
+            chunk = await sync_to_async(file.read, thread_sensitive=False)(
+                min(STREAM_CHUNK_SIZE, length)
+            )
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        await sync_to_async(file.close, thread_sensitive=False)()
+
+
+def file_etag(name, modified_time, size):
+    """
+    Return the ETag of the stored file without reading it.
+
+    Originals and their thumbnails are named by the content hash of the
+    original, and their names are never reused for other content, so their
+    strong ETag is derived from the name. Other files get a weak ETag from
+    their modification time and size.
+    """
+    if CONTENT_HASH_RE.match(posixpath.basename(name)):
+        return quote_etag(hashlib.sha256(name.encode()).hexdigest()[:32])
+    return f'W/"{int(modified_time.timestamp())}-{size}"'
+
+
+def set_cache_headers(response, etag, last_modified, max_age, public):
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    if public:
+        patch_cache_control(response, public=True, max_age=max_age, immutable=True)
+    else:
+        patch_cache_control(response, private=True, max_age=max_age)
+
+
+def sendfile_response(name, content_type):
+    """Let the front proxy deliver the file, per ``SENDFILE_BACKEND``."""
+    response = HttpResponse(content_type=content_type)
+    if settings.SENDFILE_BACKEND == "nginx":
+        response["X-Accel-Redirect"] = settings.SENDFILE_URL + name
+    else:
+        # Only available with storages on a local filesystem
+        response["X-Sendfile"] = default_storage.path(name)
+    return response
+
+
+def media_file_response(request, name, max_age, public=False):
+    """
+    Stream the file stored under ``name`` in the default storage.
+
+    Responses carry an ETag, Last-Modified and a Cache-Control
+    ``max_age``; ``public`` files are also marked immutable. Requests whose
+    If-None-Match or If-Modified-Since validators match get a 304 response.
+
+    The file is never read into memory as a whole: full responses use
+    ``FileResponse`` (served with the WSGI server's file wrapper when it has
+    one), single byte ranges are streamed in chunks, and if a sendfile backend
+    is configured the transfer is handed over to the front proxy. Under ASGI
+    the content is streamed from an asynchronous iterator instead, which
+    Django would otherwise buffer in memory.
+    """
+    content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+    size = default_storage.size(name)
+    modified_time = default_storage.get_modified_time(name)
+    last_modified = int(modified_time.timestamp())
+    etag = file_etag(name, modified_time, size)
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = file_content_response(request, name, size, content_type)
+    set_cache_headers(response, etag, last_modified, max_age, public)
+    return response
+
+
+def file_content_response(request, name, size, content_type):
+    """Return the response carrying the file content or the requested range."""
+    if settings.SENDFILE_BACKEND:
+        return sendfile_response(name, content_type)
+
+    range_header = request.META.get("HTTP_RANGE")
+    byte_range = None
+    if range_header:
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{size}"
+            return response
+
+    asynchronous = isinstance(request, ASGIRequest)
+    if byte_range is None and not asynchronous:
+        response = FileResponse(default_storage.open(name), content_type=content_type)
+    else:
+        start, end = byte_range or (0, size - 1)
+        length = end - start + 1
+        iter_range = aiter_file_range if asynchronous else iter_file_range
+        response = StreamingHttpResponse(
+            iter_range(name, start, length),
+            status=200 if byte_range is None else 206,
+            content_type=content_type,
+        )
+        response["Content-Length"] = str(length)
+        if byte_range is not None:
+            response["Content-Range"] = f"bytes {start}-{end}/{size}"
+    response["Accept-Ranges"] = "bytes"
+    return response
@@ -1,24 +1,178 @@
+import mimetypes
+import os
+import shutil
+import zipfile
+
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.core.validators import validate_image_file_extension
+from django.db import models
 from rest_framework import serializers
 
-from core.models import Image
+from core.models import Image, Rendition
+
+from .upload_handlers import too_many_pixels
+
+
+class UploadedImageField(serializers.ImageField):
+    """
+    Image field relying on the header read by the upload handlers.
+
+    Uploads identified while they were received are not opened with Pillow
+    again. Other files, such as images extracted from an archive, are fully
+    verified and held to the same byte and pixel limits.
+    """
+
+    default_validators = [validate_image_file_extension]
+
+    def to_internal_value(self, data):
+        if getattr(data, "image_size", None) is not None:
+            return serializers.FileField.to_internal_value(self, data)
+        if getattr(data, "size", 0) > settings.IMAGE_UPLOAD_MAX_BYTES:
+            raise serializers.ValidationError(
+                f"Image is larger than {settings.IMAGE_UPLOAD_MAX_BYTES} bytes."
+            )
+        file = super().to_internal_value(data)
+        file.image_format = file.image.format
+        file.image_size = file.image.size
+        if too_many_pixels(file.image_size):
+            raise serializers.ValidationError(
+                f"Image has more than {settings.IMAGE_UPLOAD_MAX_PIXELS} pixels."
+            )
+        return file
+
+
+class RenditionSerializer(serializers.ModelSerializer):
+    """Serializer for thumbnails of an image"""
+
+    class Meta:
+        model = Rendition
+        fields = ["height", "file", "status", "error", "started_at", "finished_at"]
+        read_only_fields = fields
 
 
 class ImageSerializer(serializers.ModelSerializer):
     """Serializer for Images"""
 
+    serializer_field_mapping = {
+        **serializers.ModelSerializer.serializer_field_mapping,
+        models.ImageField: UploadedImageField,
+    }
+
+    renditions = RenditionSerializer(many=True, read_only=True)
+
+    def __init__(self, *args, fields=None, **kwargs):
+        """Limit the output to ``fields`` when given, for sparse fieldsets."""
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for field_name in set(self.fields) - set(fields):
+                self.fields.pop(field_name)
+
     class Meta:
         model = Image
         fields = [
             "file",
+            "width",
+            "height",
             "thumbnail_200px",
             "thumbnail_400px",
             "custom_thumbnail",
+            "renditions",
             "expiration_time",
             "expiration_image",
         ]
         read_only_fields = (
+            "width",
+            "height",
             "expiration_image",
             "thumbnail_200px",
             "thumbnail_400px",
             "custom_thumbnail",
         )
+
+
+class BulkImageUploadSerializer(serializers.Serializer):
+    """Serializer for uploading many images in one request."""
+
+    files = serializers.ListField(
+        child=UploadedImageField(), required=False, default=list
+    )
+    archive = serializers.FileField(required=False)
+    expiration_time = serializers.IntegerField(
+        required=False, allow_null=True, min_value=300, max_value=30000
+    )
+
+    def validate_archive(self, archive):
+        """
+        Extract and validate every image of the zip archive.
+
+        Members are rejected from the sizes listed in the archive before
+        they are decompressed, and extracted one at a time to temporary
+        files, so archives are never held in memory.
+        """
+        image_field = UploadedImageField()
+        try:
+            with zipfile.ZipFile(archive) as zip_file:
+                members = [
+                    member for member in zip_file.infolist() if not member.is_dir()
+                ]
+                if len(members) > settings.BULK_UPLOAD_MAX_FILES:
+                    raise serializers.ValidationError(
+                        f"Archive can contain at most "
+                        f"{settings.BULK_UPLOAD_MAX_FILES} files."
+                    )
+                if (
+                    sum(member.file_size for member in members)
+                    > settings.BULK_UPLOAD_MAX_ARCHIVE_BYTES
+                ):
+                    raise serializers.ValidationError(
+                        f"Archive is larger than "
+                        f"{settings.BULK_UPLOAD_MAX_ARCHIVE_BYTES} bytes "
+                        f"uncompressed."
+                    )
+                images = []
+                for member in members:
+                    try:
+                        file = self.extract_member(zip_file, member)
+                        images.append(image_field.run_validation(file))
+                    except serializers.ValidationError as e:
+                        raise serializers.ValidationError({member.filename: e.detail})
+        except zipfile.BadZipFile:
+            raise serializers.ValidationError("Upload a valid zip archive.")
+        return images
+
+    @staticmethod
+    def extract_member(zip_file, member):
+        """Return the member extracted to a temporary uploaded file."""
+        if member.file_size > settings.IMAGE_UPLOAD_MAX_BYTES:
+            raise serializers.ValidationError(
+                f"Image is larger than {settings.IMAGE_UPLOAD_MAX_BYTES} bytes."
+            )
+        name = os.path.basename(member.filename)
+        file = TemporaryUploadedFile(
+            name,
+            mimetypes.guess_type(name)[0] or "application/octet-stream",
+            member.file_size,
+            None,
+        )
+        try:
+            # Decompression stops at the size listed for the member
+            with zip_file.open(member) as content:
+                shutil.copyfileobj(content, file.file)
+            file.seek(0)
+        except BaseException:
+            file.close()
+            raise
+        return file
+
+    def validate(self, attrs):
+        files = attrs["files"] + attrs.pop("archive", [])
+        if not files:
+            raise serializers.ValidationError("No images were submitted.")
+        if len(files) > settings.BULK_UPLOAD_MAX_FILES:
+            raise serializers.ValidationError(
+                f"At most {settings.BULK_UPLOAD_MAX_FILES} images can be "
+                f"uploaded at once."
+            )
+        attrs["files"] = files
+        return attrs
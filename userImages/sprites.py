@@ -0,0 +1,139 @@
+"""
+Sprite sheets of the thumbnails of a page of images.
+
+A gallery page loads one sprite holding the thumbnail of every image of the
+page, at one height, instead of one thumbnail per image, and places them
+with the sprite's coordinate map. Thumbnails are packed left to right in rows
+no wider than ``SPRITE_MAX_WIDTH``. The layout only depends on the dimensions
+of the originals, so the map is returned without rendering the sprite, and
+the sprite's version changes whenever the images of the page or their
+thumbnails do.
+"""
+import functools
+import hashlib
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from PIL import Image as PILImage
+
+from core import encoders
+from core.rendition_cache import get_rendition_cache
+from core.tasks import render_thumbnail_content
+
+from .utils import rendition_cache_key
+
+# Pixels left around every thumbnail, so lossy encoding does not bleed one
+# thumbnail into the next.
+SPRITE_PADDING = 2
+
+
+def source_name(image):
+    return image.original or image.file.name
+
+
+def thumbnail_size(image, height):
+    """Return the size of the image's thumbnail no taller than the height."""
+    width, original_height = image.width, image.height
+    if not width or not original_height:
+        # Dimensions are only recorded for images uploaded since they were
+        # added, read the header of older ones
+        with default_storage.open(source_name(image)) as file, PILImage.open(
+            file
+        ) as img:
+            width, original_height = img.size
+    if original_height <= height:
+        return width, original_height
+    return max(int(width * height / original_height), 1), height
+
+
+def pack(sizes, max_width):
+    """
+    Pack boxes of the given sizes in rows no wider than ``max_width``.
+
+    Returns the ``(x, y)`` position of every box and the size of the sheet.
+    """
+    positions = []
+    x = y = row_height = sheet_width = 0
+    for width, height in sizes:
+        cell_width = width + 2 * SPRITE_PADDING
+        if x and x + cell_width > max_width:
+            x, y, row_height = 0, y + row_height, 0
+        positions.append((x + SPRITE_PADDING, y + SPRITE_PADDING))
+        x += cell_width
+        row_height = max(row_height, height + 2 * SPRITE_PADDING)
+        sheet_width = max(sheet_width, x)
+    return positions, (sheet_width, y + row_height)
+
+
+class Sprite:
+    """
+    The sprite of the thumbnails of a list of images.
+
+    ``renditions`` maps image ids to their ready rendition of the height,
+    whose stored thumbnail is used. Thumbnails of other images are rendered
+    with ``thumbnail_encoder`` through the rendition cache, like on demand
+    thumbnails.
+    """
+
+    def __init__(self, images, height, renditions, thumbnail_encoder):
+        self.images = [image for image in images if source_name(image)]
+        self.height = height
+        self.renditions = renditions
+        self.thumbnail_encoder = thumbnail_encoder
+        self.sizes = [thumbnail_size(image, height) for image in self.images]
+        self.positions, self.size = pack(self.sizes, settings.SPRITE_MAX_WIDTH)
+
+    @functools.cached_property
+    def version(self):
+        """Return a digest of the images of the sprite and their thumbnails."""
+        digest = hashlib.sha256(str(self.height).encode())
+        for image in self.images:
+            rendition = self.renditions.get(image.id)
+            digest.update(f"|{image.id}:{source_name(image)}".encode())
+            if rendition is not None:
+                digest.update(
+                    f":{rendition.file.name}:{rendition.finished_at}".encode()
+                )
+        return digest.hexdigest()[:32]
+
+    def tiles(self):
+        """Return the coordinate map of the images in the sprite."""
+        return [
+            {"id": image.id, "x": x, "y": y, "width": width, "height": height}
+            for image, (x, y), (width, height) in zip(
+                self.images, self.positions, self.sizes
+            )
+        ]
+
+    def cache_key(self, encoder):
+        return (
+            f"{self.version}-sprite-{encoders.cache_tag(encoder)}"
+            f".{encoders.extension(encoder)}"
+        )
+
+    def thumbnail_content(self, image):
+        rendition = self.renditions.get(image.id)
+        if rendition is not None:
+            with default_storage.open(rendition.file.name) as file:
+                return file.read()
+        return get_rendition_cache().get_or_render(
+            rendition_cache_key(image, self.height, self.thumbnail_encoder),
+            lambda: render_thumbnail_content(
+                source_name(image), self.height, self.thumbnail_encoder
+            ),
+        )
+
+    def render(self, encoder):
+        """Return the sprite encoded with the encoder settings."""
+        alpha = encoders.FORMATS[encoder["format"]]["alpha"]
+        mode = "RGBA" if alpha else "RGB"
+        sheet = PILImage.new(mode, self.size, (255, 255, 255, 0) if alpha else "white")
+        for image, position, size in zip(self.images, self.positions, self.sizes):
+            with PILImage.open(BytesIO(self.thumbnail_content(image))) as thumbnail:
+                thumbnail = thumbnail.convert(mode)
+                if thumbnail.size != size:
+                    # Thumbnail widths may be rounded differently
+                    thumbnail = thumbnail.resize(size, PILImage.Resampling.LANCZOS)
+                sheet.paste(thumbnail, position)
+        return encoders.encode(sheet, encoder)
@@ -0,0 +1,229 @@
+"""
+Test userImages management commands.
+"""
+import json
+import os
+import shutil
+import tempfile
+from io import BytesIO, StringIO
+from unittest.mock import patch
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from PIL import Image as PILImage
+
+from core.models import CustomTier, Image, Rendition
+from userImages.image_processors import BasicImageProcessor
+from userImages.management.commands.benchmark_thumbnails import (
+    build_corpus,
+    run_upload,
+)
+from userImages.utils import deduplicate_upload
+
+
+class BenchmarkCommandTests(TransactionTestCase):
+    """Test the thumbnail benchmark command."""
+
+    def test_benchmark_reports_json(self):
+        """Test the benchmark reports latency for every corpus image."""
+        out = StringIO()
+
+        call_command(
+            "benchmark_thumbnails",
+            "--megapixels=0.05",
+            "--large-megapixels=0",
+            "--iterations=2",
+            "--link-iterations=10",
+            stdout=out,
+        )
+
+        report = json.loads(out.getvalue())
+        self.assertEqual(len(report["results"]), 8)
+        for result in report["results"]:
+            self.assertNotIn("error", result)
+            self.assertEqual(result["engine"], "pillow")
+            self.assertEqual(result["iterations"], 2)
+            self.assertLessEqual(result["p50_ms"], result["p95_ms"])
+            self.assertIn("peak_rss_kb", result)
+        links = report["expiring_links"]
+        self.assertLess(links["token"]["length"], links["legacy"]["length"])
+
+    def test_upload_workload_renders_thumbnails(self):
+        """Test the upload workload renders thumbnails before rolling back."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        entry = build_corpus(directory, [0.05], 0)[0]
+        # Users of the database are left alone
+        get_user_model().objects.create_user("benchmark@example.com")
+
+        with override_settings(MEDIA_ROOT=directory, THUMBNAIL_BACKEND="sync"):
+            run_upload(entry, directory)
+
+        thumbnails = [
+            name
+            for _, _, files in os.walk(os.path.join(directory, "images"))
+            for name in files
+            if "_thumbnail_" in name
+        ]
+        self.assertEqual(len(thumbnails), 2)
+        self.assertEqual(get_user_model().objects.count(), 1)
+
+
+@override_settings(THUMBNAIL_BACKEND="sync")
+class RethumbnailCommandTests(TestCase):
+    """Test the rethumbnail command."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.enterContext(override_settings(MEDIA_ROOT=self.directory))
+        self.checkpoint = os.path.join(self.directory, "checkpoint.json")
+        self.user = get_user_model().objects.create(
+            email="test@example.com", tier="Basic"
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def create_image(self, user=None, color="black"):
+        """Upload an image the way the API does and return it."""
+        content = BytesIO()
+        PILImage.new("RGB", (800, 600), color).save(content, "png")
+        upload = SimpleUploadedFile("test.png", content.getvalue())
+        content_hash, file = deduplicate_upload(upload)
+        image = Image.objects.create(
+            user=user or self.user, file=file, content_hash=content_hash
+        )
+        image.original = image.file.name
+        processor = BasicImageProcessor()
+        processor.process_image(image)
+        image.file = ""
+        image.save()
+        Rendition.objects.bulk_create(processor.renditions)
+        with self.captureOnCommitCallbacks(execute=True):
+            processor.submit_jobs()
+        return image
+
+    def rethumbnail(self, *args):
+        out = StringIO()
+        call_command(
+            "rethumbnail_images", f"--checkpoint={self.checkpoint}", *args, stdout=out
+        )
+        return out.getvalue()
+
+    def test_tier_change_renders_new_sizes(self):
+        """Test images get the sizes and original link of their new tier."""
+        image = self.create_image()
+        self.user.tier = "Premium"
+        self.user.save()
+
+        output = self.rethumbnail()
+
+        self.assertIn("1 rendered", output)
+        image.refresh_from_db()
+        self.assertEqual(image.file.name, image.original)
+        self.assertTrue(image.thumbnail_400px)
+        renditions = list(image.renditions.all())
+        self.assertEqual([rendition.height for rendition in renditions], [200, 400])
+        for rendition in renditions:
+            self.assertEqual(rendition.status, Rendition.Status.READY)
+            self.assertTrue(
+                os.path.isfile(os.path.join(self.directory, rendition.file.name))
+            )
+
+    def test_current_images_skipped(self):
+        """Test images whose renditions are current are left alone."""
+        self.create_image()
+
+        with patch("core.backends.SyncBackend.submit") as patched_submit:
+            output = self.rethumbnail()
+
+        self.assertIn("0 rendered", output)
+        patched_submit.assert_not_called()
+
+    def test_encoder_change_renders_new_thumbnails(self):
+        """Test thumbnails of earlier encoder settings are replaced by new names."""
+        image = self.create_image()
+        old_name = image.renditions.get().file.name
+        encoders = {
+            **settings.THUMBNAIL_ENCODERS,
+            "Basic": {"format": "JPEG", "quality": 60},
+        }
+
+        with override_settings(THUMBNAIL_ENCODERS=encoders):
+            with self.captureOnCommitCallbacks(execute=True):
+                output = self.rethumbnail()
+
+        self.assertIn("1 rendered", output)
+        rendition = image.renditions.get()
+        self.assertNotEqual(rendition.file.name, old_name)
+        self.assertEqual(rendition.status, Rendition.Status.READY)
+        self.assertFalse(os.path.exists(os.path.join(self.directory, old_name)))
+
+    def test_engine_change_makes_thumbnails_stale(self):
+        """Test thumbnails rendered by another engine are not current."""
+        self.create_image()
+
+        with override_settings(THUMBNAIL_ENGINE="vips"):
+            output = self.rethumbnail("--dry-run")
+
+        self.assertIn("1 rendered", output)
+
+    def test_force_renders_current_images(self):
+        """Test --force renders current images again."""
+        self.create_image()
+
+        with patch("core.backends.SyncBackend.submit") as patched_submit:
+            self.rethumbnail("--force")
+
+        patched_submit.assert_called_once()
+
+    def test_resume_from_checkpoint(self):
+        """Test a run resumes after the last image of its checkpoint."""
+        images = [self.create_image(color=color) for color in ("red", "green")]
+        self.user.tier = "Premium"
+        self.user.save()
+        with open(self.checkpoint, "w") as file:
+            json.dump(
+                {
+                    "filters": {"users": [], "tiers": [], "force": False},
+                    "last_id": images[0].id,
+                },
+                file,
+            )
+
+        output = self.rethumbnail("--chunk-size=1")
+
+        self.assertIn("1 images checked", output)
+        self.assertEqual(images[0].renditions.count(), 1)
+        self.assertEqual(images[1].renditions.count(), 2)
+        with open(self.checkpoint) as file:
+            self.assertEqual(json.load(file)["last_id"], images[1].id)
+
+    def test_checkpoint_of_other_filters_rejected(self):
+        """Test a checkpoint of a run with other filters is not resumed."""
+        self.create_image()
+        self.rethumbnail("--tier=Basic")
+
+        with self.assertRaises(CommandError):
+            self.rethumbnail("--tier=Premium")
+        self.rethumbnail("--tier=Premium", "--restart")
+
+    def test_filter_by_tier(self):
+        """Test only images of users of the given tiers are rendered."""
+        other_user = get_user_model().objects.create(
+            email="other@example.com", tier="Basic"
+        )
+        self.create_image()
+        self.create_image(user=other_user, color="blue")
+        get_user_model().objects.update(tier="Premium")
+        other_user.custom_tier = CustomTier.objects.create(
+            name="Custom", thumbnail_sizes="300"
+        )
+        other_user.save()
+
+        output = self.rethumbnail("--tier=Premium")
+
+        self.assertIn("1 images checked, 1 rendered", output)
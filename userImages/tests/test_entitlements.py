@@ -0,0 +1,56 @@
+"""
+Test for cached tier entitlements.
+"""
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase
+
+from core.models import CustomTier
+from userImages.entitlements import get_entitlements, local_cache
+
+
+class EntitlementsTests(TestCase):
+    """Test tier entitlements."""
+
+    def setUp(self):
+        cache.clear()
+        local_cache.clear()
+        self.custom_tier = CustomTier.objects.create(
+            name="Custom Tier",
+            thumbnail_sizes="300,100",
+            include_original_link=True,
+        )
+        self.user = get_user_model().objects.create(
+            email="test@example.com", custom_tier=self.custom_tier
+        )
+
+    def test_builtin_tier_needs_no_query(self):
+        """Test built in tiers are resolved from the user row alone."""
+        user = get_user_model().objects.create(email="basic@example.com")
+
+        with self.assertNumQueries(0):
+            entitlements = get_entitlements(user)
+
+        self.assertEqual(entitlements.tier, "Basic")
+        self.assertEqual(entitlements.get_thumbnail_sizes(), [200])
+
+    def test_custom_tier_cached(self):
+        """Test a custom tier is only loaded from the database once."""
+        with self.assertNumQueries(1):
+            entitlements = get_entitlements(self.user)
+        local_cache.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(get_entitlements(self.user), entitlements)
+
+        self.assertEqual(entitlements.tier, "Custom")
+        self.assertEqual(entitlements.get_thumbnail_sizes(), [100, 300])
+        self.assertTrue(entitlements.include_original_link)
+
+    def test_custom_tier_save_invalidates(self):
+        """Test saving a custom tier drops its cached entitlements."""
+        get_entitlements(self.user)
+
+        self.custom_tier.thumbnail_sizes = "50"
+        self.custom_tier.save()
+
+        self.assertEqual(get_entitlements(self.user).get_thumbnail_sizes(), [50])
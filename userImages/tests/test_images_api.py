@@ -1,24 +1,39 @@
 """
 Test for images APIs.
 """
+import hashlib
+import os
 import shutil
 import tempfile
+import zipfile
+from datetime import datetime, timedelta
 from io import BytesIO
+from unittest.mock import patch
 
+from asgiref.sync import sync_to_async
 from django.contrib.auth import get_user_model
+from django.core import signing
+from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import TestCase, override_settings
+from django.test import RequestFactory, TestCase, override_settings
 from django.urls import reverse
 from PIL import Image as PILImage
 from rest_framework import status
 from rest_framework.test import APIClient
 
-from core.models import CustomTier, Image
-from userImages import serializers
+from core import encoders
+from core.models import CustomTier, Image, Rendition
+from core.storage import MediaStorage, sharded_name
+from core.tasks import render_thumbnails
+from userImages import links, serializers, views
+from userImages.sprites import Sprite
 
 MEDIA_ROOT = tempfile.mkdtemp()
+RENDITION_CACHE_DIR = tempfile.mkdtemp()
 
 IMAGES_URL = reverse("image-list")
+BULK_IMAGES_URL = reverse("image-bulk-upload")
+SPRITE_URL = reverse("image-sprite")
 
 
 def detail_url(image_id):
@@ -26,14 +41,24 @@ def detail_url(image_id):
     return reverse("image-detail", args=[image_id])
 
 
-def temporary_image():
+def temporary_image(color="black"):
     """Create and returns a temporary image."""
     bts = BytesIO()
-    img = PILImage.new("RGB", (100, 100))
+    img = PILImage.new("RGB", (100, 100), color)
     img.save(bts, "png")
     return SimpleUploadedFile("test.png", bts.getvalue())
 
 
+def thumb_url(image_id, height):
+    """Create and return an on demand thumbnail URL."""
+    return reverse("image-thumb", args=[image_id, height])
+
+
+def renditions_url(image_id):
+    """Create and return an image renditions status URL."""
+    return reverse("image-renditions", args=[image_id])
+
+
 def create_user(**params):
     """Create and return a new user."""
     return get_user_model().objects.create(**params)
@@ -61,11 +86,18 @@ class PublicImageAPITests(TestCase):
         self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
 
 
-@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+@override_settings(
+    MEDIA_ROOT=MEDIA_ROOT,
+    THUMBNAIL_BACKEND="sync",
+    RENDITION_CACHE_DIR=RENDITION_CACHE_DIR,
+)
 class PrivateImageAPITests(TestCase):
     """Test authenticated API requests."""
 
     def setUp(self):
+        # Upload rate limit buckets are kept in the cache
+        cache.clear()
+        links.verified_tokens.clear()
         self.client = APIClient()
         self.user = create_user(email="test@example.com", password="test123!")
         self.client.force_authenticate(self.user)
@@ -74,6 +106,7 @@ class PrivateImageAPITests(TestCase):
     def tearDownClass(self):
         """Remove all test files after tests are finished."""
         shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        shutil.rmtree(RENDITION_CACHE_DIR, ignore_errors=True)
         super().tearDownClass()
 
     def test_retrieve_images(self):
@@ -91,7 +124,7 @@ class PrivateImageAPITests(TestCase):
         # Update the file field URLs in the serializer data
         for data in serializer.data:
             data["file"] = domain_url + data["file"]
-        self.assertEqual(res.data, serializer.data)
+        self.assertEqual(res.data["results"], serializer.data)
 
     def test_image_list_limited_to_user(self):
         """Test list of images is limited to authenticated user."""
@@ -109,7 +142,32 @@ class PrivateImageAPITests(TestCase):
         for data in serializer.data:
             data["file"] = domain_url + data["file"]
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(res.data, serializer.data)
+        self.assertEqual(res.data["results"], serializer.data)
+
+    def test_image_list_cursor_pagination(self):
+        """Test the image list is paginated with a cursor, newest first."""
+        images = [create_image(user=self.user) for _ in range(3)]
+
+        res = self.client.get(IMAGES_URL, {"page_size": 2})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res.data["results"]), 2)
+        self.assertIsNotNone(res.data["next"])
+        res = self.client.get(res.data["next"])
+        self.assertEqual(len(res.data["results"]), 1)
+        self.assertIsNone(res.data["next"])
+        self.assertEqual(
+            res.data["results"][0]["file"], "http://testserver" + images[0].file.url
+        )
+
+    def test_image_list_sparse_fields(self):
+        """Test only the fields listed in the fields parameter are returned."""
+        create_image(user=self.user)
+
+        res = self.client.get(IMAGES_URL, {"fields": "file,thumbnail_200px"})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(res.data["results"][0]), {"file", "thumbnail_200px"})
 
     def test_create_image(self):
         """Test creating an image."""
@@ -121,6 +179,177 @@ class PrivateImageAPITests(TestCase):
         image = Image.objects.first()
         self.assertEqual(image.user, self.user)
 
+    @override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=0)
+    def test_upload_dimensions_read_from_header(self):
+        """Test dimensions come from the header read while streaming the upload."""
+        with patch("django.forms.ImageField.to_python") as patched_to_python:
+            res = self.client.post(IMAGES_URL, {"file": temporary_image()})
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        patched_to_python.assert_not_called()
+        self.assertEqual((res.data["width"], res.data["height"]), (100, 100))
+        image = Image.objects.get(user=self.user)
+        self.assertEqual((image.width, image.height), (100, 100))
+
+    @override_settings(IMAGE_UPLOAD_MAX_PIXELS=100 * 99)
+    def test_upload_over_pixel_limit_rejected(self):
+        """Test images with too many pixels are rejected from their header."""
+        res = self.client.post(IMAGES_URL, {"file": temporary_image()})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Image.objects.exists())
+
+    @override_settings(IMAGE_UPLOAD_MAX_BYTES=100)
+    def test_upload_over_byte_limit_rejected(self):
+        """Test images larger than the byte limit are rejected."""
+        res = self.client.post(IMAGES_URL, {"file": temporary_image()})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Image.objects.exists())
+
+    def test_upload_is_stored_by_content_hash(self):
+        """Test the original is named after the SHA-256 of its content, sharded."""
+        self.user.tier = "Premium"
+        self.user.save()
+        upload = temporary_image("red")
+        content_hash = hashlib.sha256(upload.read()).hexdigest()
+        upload.seek(0)
+
+        res = self.client.post(IMAGES_URL, {"file": upload})
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        image = Image.objects.get(user=self.user)
+        self.assertEqual(image.content_hash, content_hash)
+        shard = f"images/{content_hash[:2]}/{content_hash[2:4]}"
+        self.assertEqual(image.file.name, f"{shard}/{content_hash}.png")
+        tag = encoders.cache_tag(encoders.thumbnail_encoder("Premium"))
+        self.assertEqual(
+            image.thumbnail_200px.name,
+            f"{shard}/{content_hash}_thumbnail_200px_{tag}.jpg",
+        )
+
+    def test_duplicate_upload_reuses_files(self):
+        """Test re-uploading the same content reuses original and thumbnails."""
+        self.user.tier = "Premium"
+        self.user.save()
+        self.client.post(IMAGES_URL, {"file": temporary_image("blue")})
+
+        with patch("core.backends.SyncBackend.submit") as patched_submit:
+            res = self.client.post(IMAGES_URL, {"file": temporary_image("blue")})
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        patched_submit.assert_not_called()
+        first, second = Image.objects.filter(user=self.user).order_by("id")
+        self.assertEqual(first.file.name, second.file.name)
+        self.assertEqual(first.thumbnail_400px.name, second.thumbnail_400px.name)
+
+    def test_upload_of_unused_stored_original_writes_it_again(self):
+        """Test an original no image uses anymore is not reused as it is."""
+        self.client.post(IMAGES_URL, {"file": temporary_image("olive")})
+        name = Image.objects.get(user=self.user).original
+        # The image is deleted, its file is left until the deletion commits
+        Image.objects.all().delete()
+        path = MediaStorage().path(name)
+        os.utime(path, (0, 0))
+
+        res = self.client.post(IMAGES_URL, {"file": temporary_image("olive")})
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Image.objects.get(user=self.user).original, name)
+        self.assertGreater(os.path.getmtime(path), 0)
+
+    def test_duplicate_upload_of_other_tier_renders_own_thumbnails(self):
+        """Test tiers with different encoders do not share thumbnails."""
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(IMAGES_URL, {"file": temporary_image("teal")})
+        self.user.tier = "Enterprise"
+        self.user.save()
+
+        with patch("core.backends.SyncBackend.submit") as patched_submit:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(IMAGES_URL, {"file": temporary_image("teal")})
+
+        patched_submit.assert_called_once()
+        basic, enterprise = Image.objects.filter(user=self.user).order_by("id")
+        self.assertNotEqual(basic.thumbnail_200px.name, enterprise.thumbnail_200px.name)
+
+    def test_update_file_keeps_shared_original(self):
+        """Test replacing the file of an image leaves images sharing it intact."""
+        self.user.tier = "Premium"
+        self.user.save()
+        other_user = create_user(email="other@example.com", password="test123!")
+        red = temporary_image("red")
+        other_image = create_image(
+            other_user,
+            file=red,
+            content_hash=hashlib.sha256(red.read()).hexdigest(),
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(IMAGES_URL, {"file": temporary_image("red")})
+        image = Image.objects.get(user=self.user)
+        upload = temporary_image("green")
+        content_hash = hashlib.sha256(upload.read()).hexdigest()
+        upload.seek(0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            res = self.client.patch(
+                detail_url(image.id), {"file": upload}, format="multipart"
+            )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        image.refresh_from_db()
+        self.assertEqual(image.content_hash, content_hash)
+        self.assertTrue(image.original.endswith(f"{content_hash}.png"))
+        self.assertTrue(
+            all(
+                rendition.file.name.startswith(image.original[:-4])
+                for rendition in image.renditions.all()
+            )
+        )
+        other_image.refresh_from_db()
+        with other_image.file.open("rb") as file, PILImage.open(file) as img:
+            self.assertEqual(img.getpixel((0, 0)), (255, 0, 0))
+
+    def test_custom_tier_multiple_sizes(self):
+        """Test every size of a custom tier is rendered in one job."""
+        custom_tier = CustomTier.objects.create(
+            name="Custom Tier",
+            thumbnail_sizes="60,30",
+            include_original_link=True,
+        )
+        self.user.custom_tier = custom_tier
+        self.user.save()
+
+        with patch(
+            "core.backends.render_thumbnails", wraps=render_thumbnails
+        ) as patched_render:
+            with self.captureOnCommitCallbacks(execute=True):
+                res = self.client.post(IMAGES_URL, {"file": temporary_image("yellow")})
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        patched_render.assert_called_once()
+        self.assertEqual(
+            [rendition["height"] for rendition in res.data["renditions"]], [30, 60]
+        )
+        image = Image.objects.get(user=self.user)
+        for rendition in image.renditions.all():
+            with PILImage.open(rendition.file.path) as thumbnail:
+                self.assertEqual(thumbnail.height, rendition.height)
+
+    def test_image_list_prefetches_renditions(self):
+        """Test listing images loads renditions with a single extra query."""
+        self.user.tier = "Premium"
+        self.user.save()
+        for color in ("red", "green", "blue"):
+            self.client.post(IMAGES_URL, {"file": temporary_image(color)})
+
+        with self.assertNumQueries(2):
+            res = self.client.get(IMAGES_URL)
+
+        self.assertEqual(len(res.data["results"]), 3)
+        for data in res.data["results"]:
+            self.assertEqual(len(data["renditions"]), 2)
+
     def test_access_other_users_image_error(self):
         """Test trying to access another user image gives error."""
         new_user = create_user(email="test123@example.com", password="testpassa123")
@@ -132,6 +361,34 @@ class PrivateImageAPITests(TestCase):
         self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
         self.assertTrue(Image.objects.filter(id=image.id).exists())
 
+    @override_settings(UPLOAD_RATE_LIMITS={"Basic": (2, 1)})
+    def test_upload_rate_limited_per_tier(self):
+        """Test uploads over the tier's token bucket are throttled."""
+        for _ in range(2):
+            res = self.client.post(IMAGES_URL, {"file": temporary_image()})
+            self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
+        res = self.client.post(IMAGES_URL, {"file": temporary_image()})
+
+        self.assertEqual(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn("Retry-After", res)
+
+    @override_settings(UPLOAD_RATE_LIMITS={"Basic": (2, 1)})
+    def test_bulk_upload_counts_every_image(self):
+        """Test each image of a bulk upload takes one upload from the bucket."""
+        payload = {
+            "files": [temporary_image(color) for color in ("red", "blue", "green")]
+        }
+
+        res = self.client.post(BULK_IMAGES_URL, payload)
+
+        self.assertEqual(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertFalse(Image.objects.exists())
+        # The throttled request gave its upload back
+        for _ in range(2):
+            res = self.client.post(IMAGES_URL, {"file": temporary_image()})
+            self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
     def test_thumbnail_basic_is_created(self):
         """Test that thumbnail is created for basic user and original file link is not included."""
         self.user.tier = "Basic"
@@ -190,3 +447,487 @@ class PrivateImageAPITests(TestCase):
         self.assertEqual(res.status_code, status.HTTP_201_CREATED)
         self.assertEqual(res.data["file"], None)
         self.assertTrue(res.data["custom_thumbnail"] != None)
+
+    def test_bulk_upload_files(self):
+        """Test uploading many images in one multipart request."""
+        self.user.tier = "Premium"
+        self.user.save()
+        payload = {"files": [temporary_image() for _ in range(3)]}
+
+        with self.captureOnCommitCallbacks(execute=True):
+            res = self.client.post(BULK_IMAGES_URL, payload)
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(res.data), 3)
+        self.assertEqual(Image.objects.filter(user=self.user).count(), 3)
+        for image in Image.objects.filter(user=self.user):
+            self.assertTrue(
+                os.path.isfile(os.path.join(MEDIA_ROOT, image.thumbnail_400px.name))
+            )
+
+    def test_bulk_upload_archive(self):
+        """Test uploading a zip archive of images."""
+        archive = BytesIO()
+        with zipfile.ZipFile(archive, "w") as zip_file:
+            for index in range(2):
+                zip_file.writestr(f"image{index}.png", temporary_image().read())
+        payload = {"archive": SimpleUploadedFile("images.zip", archive.getvalue())}
+
+        res = self.client.post(BULK_IMAGES_URL, payload)
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Image.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(res.data[0]["file"], None)
+
+    def test_bulk_upload_invalid_archive_member(self):
+        """Test an archive with a non image file is rejected."""
+        archive = BytesIO()
+        with zipfile.ZipFile(archive, "w") as zip_file:
+            zip_file.writestr("image.png", temporary_image().read())
+            zip_file.writestr("notes.txt", b"not an image")
+        payload = {"archive": SimpleUploadedFile("images.zip", archive.getvalue())}
+
+        res = self.client.post(BULK_IMAGES_URL, payload)
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Image.objects.exists())
+
+    @override_settings(IMAGE_UPLOAD_MAX_BYTES=1024)
+    def test_bulk_upload_archive_rejects_large_member_unread(self):
+        """Test an archive member over the byte limit is never decompressed."""
+        archive = BytesIO()
+        with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as zip_file:
+            zip_file.writestr("image.png", bytes(1024 * 1024))
+        payload = {"archive": SimpleUploadedFile("images.zip", archive.getvalue())}
+
+        with patch.object(zipfile.ZipFile, "open") as zip_open:
+            res = self.client.post(BULK_IMAGES_URL, payload)
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        zip_open.assert_not_called()
+
+    @override_settings(BULK_UPLOAD_MAX_ARCHIVE_BYTES=1024)
+    def test_bulk_upload_archive_total_size_limit(self):
+        """Test an archive over the total uncompressed size is rejected."""
+        archive = BytesIO()
+        with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as zip_file:
+            for index in range(2):
+                zip_file.writestr(f"image{index}.png", bytes(1000))
+        payload = {"archive": SimpleUploadedFile("images.zip", archive.getvalue())}
+
+        res = self.client.post(BULK_IMAGES_URL, payload)
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Image.objects.exists())
+
+    def create_expiring_link(self):
+        """Upload an image as Enterprise user and return its expiring link."""
+        self.user.tier = "Enterprise"
+        self.user.save()
+        payload = {"file": temporary_image(), "expiration_time": 3000}
+        res = self.client.post(IMAGES_URL, payload)
+        return res.data["expiration_image"]
+
+    def test_expiring_link_streams_file(self):
+        """Test the expiring link streams the original with its MIME type."""
+        link = self.create_expiring_link()
+        image = Image.objects.get(user=self.user)
+
+        res = self.client.get(link)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertTrue(res.streaming)
+        self.assertEqual(res["Content-Type"], "image/png")
+        self.assertEqual(int(res["Content-Length"]), image.file.size)
+        self.assertEqual(res["Accept-Ranges"], "bytes")
+        with image.file.open("rb") as file:
+            self.assertEqual(b"".join(res.streaming_content), file.read())
+
+    async def test_expiring_link_streams_asynchronously(self):
+        """Test the expiring link streams from an async iterator under ASGI."""
+        link = await sync_to_async(self.create_expiring_link)()
+        image = await Image.objects.aget(user=self.user)
+
+        res = await self.async_client.get(link)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertTrue(res.is_async)
+        self.assertEqual(int(res["Content-Length"]), image.file.size)
+        content = b"".join([chunk async for chunk in res.streaming_content])
+        with image.file.open("rb") as file:
+            self.assertEqual(content, file.read())
+
+    def test_expiring_link_range_request(self):
+        """Test a byte range of the file is returned for Range requests."""
+        link = self.create_expiring_link()
+        image = Image.objects.get(user=self.user)
+
+        res = self.client.get(link, HTTP_RANGE="bytes=10-19")
+
+        self.assertEqual(res.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(res["Content-Length"], "10")
+        self.assertEqual(res["Content-Range"], f"bytes 10-19/{image.file.size}")
+        with image.file.open("rb") as file:
+            self.assertEqual(b"".join(res.streaming_content), file.read()[10:20])
+
+    def test_expiring_link_unsatisfiable_range(self):
+        """Test a range past the end of the file is rejected."""
+        link = self.create_expiring_link()
+
+        res = self.client.get(link, HTTP_RANGE="bytes=100000-")
+
+        self.assertEqual(
+            res.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE
+        )
+
+    @override_settings(SENDFILE_BACKEND="nginx", SENDFILE_URL="/protected/")
+    def test_expiring_link_sendfile(self):
+        """Test delivery is handed to the front proxy when configured."""
+        link = self.create_expiring_link()
+        image = Image.objects.get(user=self.user)
+
+        res = self.client.get(link)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res["X-Accel-Redirect"], "/protected/" + image.file.name)
+        self.assertEqual(res.content, b"")
+
+    def test_expiring_link_cache_headers(self):
+        """Test validators and a max-age bounded by the link lifetime are set."""
+        link = self.create_expiring_link()
+
+        res = self.client.get(link)
+
+        self.assertTrue(res["ETag"].startswith('"'))
+        self.assertIn("Last-Modified", res)
+        self.assertIn("private", res["Cache-Control"])
+        max_age = int(res["Cache-Control"].split("max-age=")[1].split(",")[0])
+        self.assertLessEqual(max_age, 3000)
+        self.assertGreater(max_age, 2900)
+
+    @override_settings(SENDFILE_BACKEND="nginx")
+    def test_expiring_link_etag_without_reading_file(self):
+        """Test the ETag of a content addressed file is not read from it."""
+        link = self.create_expiring_link()
+
+        with patch.object(MediaStorage, "open") as storage_open:
+            res = self.client.get(link)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertTrue(res["ETag"].startswith('"'))
+        storage_open.assert_not_called()
+
+    def test_expiring_link_not_modified(self):
+        """Test a matching If-None-Match gets a 304 without content."""
+        link = self.create_expiring_link()
+        etag = self.client.get(link)["ETag"]
+
+        res = self.client.get(link, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(res["ETag"], etag)
+        self.assertEqual(res.content, b"")
+
+    def test_legacy_link_to_sharded_file(self):
+        """Test links signed with a flat name find the file in its shard."""
+        storage = MediaStorage()
+        storage.save(sharded_name("images/photo.png"), temporary_image())
+        expiration_time = datetime.utcnow() + timedelta(seconds=300)
+        signed_data = signing.dumps(
+            ("images/photo.png", expiration_time.strftime("%Y-%m-%dT%H:%M:%S.%fZ"))
+        )
+
+        res = self.client.get(reverse("expiring-image", args=[signed_data]))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res["Content-Type"], "image/png")
+
+    def test_serve_media_is_immutable(self):
+        """Test media files are served as immutable with validators."""
+        image = create_image(user=self.user)
+        request = RequestFactory().get("/media/" + image.file.name)
+
+        res = views.serve_media(request, image.file.name)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertIn("immutable", res["Cache-Control"])
+        self.assertIn("ETag", res)
+        request = RequestFactory().get(
+            "/media/" + image.file.name, HTTP_IF_MODIFIED_SINCE=res["Last-Modified"]
+        )
+        res = views.serve_media(request, image.file.name)
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_metrics_exposed(self):
+        """Test upload latency and bytes per tier are exposed for Prometheus."""
+        self.client.post(IMAGES_URL, {"file": temporary_image("navy")})
+
+        res = self.client.get(reverse("metrics"))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertIn(
+            'image_upload_seconds_count{endpoint="create",tier="Basic"}',
+            res.content.decode(),
+        )
+        self.assertIn('image_upload_bytes_total{tier="Basic"}', res.content.decode())
+
+    @override_settings(METRICS_TOKEN="secret")
+    def test_metrics_token_required(self):
+        """Test the metrics require the bearer token when one is configured."""
+        res = self.client.get(reverse("metrics"))
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        res = self.client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_renditions_ready_after_upload(self):
+        """Test the renditions of an uploaded image report they are ready."""
+        self.user.tier = "Premium"
+        self.user.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(IMAGES_URL, {"file": temporary_image("orange")})
+        image = Image.objects.get(user=self.user)
+
+        res = self.client.get(renditions_url(image.id))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data["status"], "ready")
+        self.assertEqual([r["height"] for r in res.data["renditions"]], [200, 400])
+        for rendition in res.data["renditions"]:
+            self.assertEqual(rendition["status"], "ready")
+            self.assertIsNotNone(rendition["finished_at"])
+
+    def test_thumbnail_jobs_submitted_on_commit(self):
+        """Test thumbnail jobs only start once the upload is committed."""
+        with patch("core.backends.render_thumbnails") as patched_render:
+            with self.captureOnCommitCallbacks() as callbacks:
+                self.client.post(IMAGES_URL, {"file": temporary_image("olive")})
+
+            patched_render.assert_not_called()
+            self.assertEqual(len(callbacks), 1)
+            callbacks[0]()
+
+        patched_render.assert_called_once()
+
+    def test_renditions_pending_without_wait(self):
+        """Test pending renditions are reported at once without a wait."""
+        image = create_image(user=self.user)
+        Rendition.objects.create(image=image, height=200, file="images/pending.jpg")
+
+        res = self.client.get(renditions_url(image.id))
+
+        self.assertEqual(res.data["status"], "pending")
+        self.assertEqual(res["Retry-After"], "1")
+
+    def test_renditions_wait_until_ready(self):
+        """Test a wait holds the response until the pending renditions finish."""
+        image = create_image(user=self.user)
+        rendition = Rendition.objects.create(
+            image=image, height=200, file="images/pending.jpg"
+        )
+
+        async def finish_rendition(seconds):
+            await Rendition.objects.filter(pk=rendition.pk).aupdate(
+                status=Rendition.Status.READY
+            )
+
+        with patch("userImages.views.asyncio.sleep", side_effect=finish_rendition):
+            res = self.client.get(renditions_url(image.id), {"wait": 10})
+
+        self.assertEqual(res.data["status"], "ready")
+        self.assertNotIn("Retry-After", res)
+
+    @override_settings(RENDITION_MAX_WAIT=0.2, RENDITION_POLL_INTERVAL=0.05)
+    async def test_renditions_wait_in_event_loop(self):
+        """Test the asynchronous wait ends with the renditions still pending."""
+        image = await sync_to_async(create_image)(user=self.user)
+        await Rendition.objects.acreate(
+            image=image, height=200, file="images/pending.jpg"
+        )
+        request = RequestFactory().get(renditions_url(image.id), {"wait": 10})
+        request._force_auth_user = self.user
+
+        response = await views.RenditionStatusView.as_view()(request, pk=image.id)
+
+        self.assertEqual(response.data["status"], "pending")
+        self.assertEqual(response["Retry-After"], "1")
+
+    def test_renditions_other_users_image(self):
+        """Test the renditions of another user's image are not found."""
+        other_user = create_user(email="other@example.com", password="test123!")
+        image = create_image(user=other_user)
+
+        res = self.client.get(renditions_url(image.id), {"wait": 10})
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_renditions_failed(self):
+        """Test a failed rendition fails the image and reports the error."""
+        image = create_image(user=self.user)
+        Rendition.objects.create(
+            image=image,
+            height=200,
+            file="images/failed.jpg",
+            status=Rendition.Status.FAILED,
+            error="cannot identify image file",
+        )
+
+        res = self.client.get(renditions_url(image.id), {"wait": 10})
+
+        self.assertEqual(res.data["status"], "failed")
+        self.assertEqual(
+            res.data["renditions"][0]["error"], "cannot identify image file"
+        )
+
+    def upload_gallery(self, colors):
+        """Upload an image of every color and return them, newest first."""
+        for color in colors:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(IMAGES_URL, {"file": temporary_image(color)})
+        return list(Image.objects.filter(user=self.user).order_by("-id"))
+
+    def test_sprite_map(self):
+        """Test the map places every image of the page in the sprite."""
+        images = self.upload_gallery(["red", "green", "blue"])
+
+        res = self.client.get(SPRITE_URL, {"page_size": 2})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [tile["id"] for tile in res.data["tiles"]], [images[0].id, images[1].id]
+        )
+        self.assertIsNotNone(res.data["next"])
+        first, second = res.data["tiles"]
+        # Thumbnails never upscale the 100px originals
+        self.assertEqual((first["width"], first["height"]), (100, 100))
+        self.assertGreaterEqual(second["x"], first["x"] + first["width"])
+        self.assertIn("format=image", res.data["sprite"])
+
+    @override_settings(SPRITE_MAX_WIDTH=150)
+    def test_sprite_rows_wrap(self):
+        """Test thumbnails wider than the sprite's row go to the next row."""
+        self.upload_gallery(["silver", "gold"])
+
+        res = self.client.get(SPRITE_URL)
+
+        first, second = res.data["tiles"]
+        self.assertEqual(second["x"], first["x"])
+        self.assertGreaterEqual(second["y"], first["y"] + first["height"])
+        self.assertLessEqual(res.data["width"], 150)
+
+    def test_sprite_image(self):
+        """Test the sprite holds the thumbnail of every image in its box."""
+        self.upload_gallery(["red", "blue"])
+        sprite_map = self.client.get(SPRITE_URL).data
+
+        res = self.client.get(sprite_map["sprite"])
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res["Content-Type"], "image/jpeg")
+        self.assertIn("max-age", res["Cache-Control"])
+        sprite = PILImage.open(BytesIO(res.content)).convert("RGB")
+        self.assertEqual(sprite.size, (sprite_map["width"], sprite_map["height"]))
+        for tile, color in zip(sprite_map["tiles"], [(0, 0, 255), (255, 0, 0)]):
+            center = sprite.getpixel(
+                (tile["x"] + tile["width"] // 2, tile["y"] + tile["height"] // 2)
+            )
+            for channel, expected in zip(center, color):
+                self.assertAlmostEqual(channel, expected, delta=10)
+
+    def test_sprite_cached_until_page_changes(self):
+        """Test the sprite is only rendered again once the page changes."""
+        self.upload_gallery(["orchid"])
+
+        with patch(
+            "userImages.views.Sprite.render", autospec=True, side_effect=Sprite.render
+        ) as patched_render:
+            first = self.client.get(SPRITE_URL, {"format": "image"})
+            again = self.client.get(SPRITE_URL, {"format": "image"})
+            self.upload_gallery(["teal"])
+            changed = self.client.get(SPRITE_URL, {"format": "image"})
+
+        self.assertEqual(patched_render.call_count, 2)
+        self.assertEqual(first["ETag"], again["ETag"])
+        self.assertNotEqual(first["ETag"], changed["ETag"])
+        # The unversioned URL changes content along with the page
+        self.assertIn("no-cache", first["Cache-Control"])
+
+    def test_sprite_height_not_available(self):
+        """Test sprites are only made of the tier's thumbnail heights."""
+        res = self.client.get(SPRITE_URL, {"height": 123})
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(THUMBNAIL_EAGER_RENDITIONS=False)
+    def test_thumbnail_rendered_on_demand(self):
+        """Test thumbnails are rendered on request when not rendered eagerly."""
+        self.user.tier = "Basic"
+        self.user.save()
+        res = self.client.post(IMAGES_URL, {"file": temporary_image("green")})
+        self.assertEqual(res.data["thumbnail_200px"], None)
+        image = Image.objects.get(user=self.user)
+
+        res = self.client.get(thumb_url(image.id, 200))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res["Content-Type"], "image/jpeg")
+        # Thumbnails never upscale the 100px original
+        self.assertEqual(PILImage.open(BytesIO(res.content)).size, (100, 100))
+        self.assertIn("no-cache", res["Cache-Control"])
+        res = self.client.get(thumb_url(image.id, 200), HTTP_IF_NONE_MATCH=res["ETag"])
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_thumbnail_revalidated_after_update(self):
+        """Test a thumbnail cached before the image was replaced is not reused."""
+        self.user.tier = "Premium"
+        self.user.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(IMAGES_URL, {"file": temporary_image("red")})
+        image = Image.objects.get(user=self.user)
+        etag = self.client.get(thumb_url(image.id, 200))["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(
+                detail_url(image.id),
+                {"file": temporary_image("green")},
+                format="multipart",
+            )
+
+        res = self.client.get(thumb_url(image.id, 200), HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertIn("no-cache", res["Cache-Control"])
+        thumbnail = PILImage.open(BytesIO(res.content)).convert("RGB")
+        self.assertGreater(thumbnail.getpixel((0, 0))[1], 100)
+
+    def test_thumbnail_format_negotiated_from_accept(self):
+        """Test the smallest format listed in the Accept header is returned."""
+        self.user.tier = "Premium"
+        self.user.save()
+        image = create_image(user=self.user)
+        image.original = image.file.name
+        image.save(update_fields=["original"])
+
+        res = self.client.get(
+            thumb_url(image.id, 200), HTTP_ACCEPT="image/webp,image/*;q=0.8"
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res["Content-Type"], "image/webp")
+        self.assertIn("Accept", res["Vary"])
+        self.assertEqual(PILImage.open(BytesIO(res.content)).format, "WEBP")
+        webp_etag = res["ETag"]
+
+        res = self.client.get(thumb_url(image.id, 200), HTTP_ACCEPT="*/*")
+
+        self.assertEqual(res["Content-Type"], "image/jpeg")
+        self.assertNotEqual(res["ETag"], webp_etag)
+
+    def test_thumbnail_size_limited_to_tier(self):
+        """Test sizes outside of the user's tier are not rendered."""
+        self.user.tier = "Basic"
+        self.user.save()
+        image = create_image(user=self.user)
+
+        res = self.client.get(thumb_url(image.id, 400), HTTP_ACCEPT="image/jpeg")
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
@@ -0,0 +1,95 @@
+"""
+Test for expiring link tokens.
+"""
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.test import TestCase
+from django.utils import timezone
+
+from core.models import Image
+from userImages import links
+
+
+class ExpiringLinkTests(TestCase):
+    """Test expiring link tokens."""
+
+    def setUp(self):
+        links.verified_tokens.clear()
+        user = get_user_model().objects.create(email="test@example.com")
+        self.image = Image.objects.create(
+            user=user, file="images/test.png", original="images/test.png"
+        )
+
+    def link(self, seconds=300):
+        return links.generate_expiring_link(
+            self.image.pk, timezone.now() + timedelta(seconds=seconds)
+        )
+
+    def test_token_is_compact_and_url_safe(self):
+        """Test tokens are short and only use URL safe characters."""
+        token = self.link()
+
+        self.assertEqual(len(token), 32)
+        self.assertRegex(token, r"^[A-Za-z0-9_-]+$")
+
+    def test_resolve_token(self):
+        """Test a valid token resolves to the original and its expiry."""
+        name, expires = links.resolve_expiring_link(self.link())
+
+        self.assertEqual(name, "images/test.png")
+        self.assertAlmostEqual(expires, timezone.now().timestamp() + 300, delta=2)
+
+    def test_verified_tokens_cached(self):
+        """Test a hot link is verified only once."""
+        token = self.link()
+        links.resolve_expiring_link(token)
+
+        with patch("userImages.links.token_mac") as mac:
+            self.assertEqual(links.resolve_expiring_link(token)[0], "images/test.png")
+        mac.assert_not_called()
+
+    def test_verified_token_of_changed_image(self):
+        """Test a hot link follows the image when it is replaced or deleted."""
+        token = self.link()
+        links.resolve_expiring_link(token)
+
+        Image.objects.filter(pk=self.image.pk).update(original="images/new.png")
+        self.assertEqual(links.resolve_expiring_link(token)[0], "images/new.png")
+        self.image.delete()
+        with self.assertRaises(links.InvalidLink):
+            links.resolve_expiring_link(token)
+
+    def test_expired_token_rejected_before_hmac(self):
+        """Test expired tokens are rejected without computing the HMAC."""
+        token = self.link(seconds=-10)
+
+        with patch("userImages.links.token_mac") as mac:
+            with self.assertRaises(links.ExpiredLink):
+                links.resolve_expiring_link(token)
+        mac.assert_not_called()
+
+    def test_tampered_token_rejected(self):
+        """Test tokens pointing to another image or malformed are rejected."""
+        token = self.link()
+        tampered = links.base64.urlsafe_b64encode(
+            links.TOKEN_PAYLOAD.pack(self.image.pk + 1, 2**32 - 1)
+            + links.base64.urlsafe_b64decode(token + "==")[-links.TOKEN_MAC_BYTES :]
+        ).decode()
+
+        for bad_token in (tampered, token[:-2], "not-a-token"):
+            with self.assertRaises(links.InvalidLink):
+                links.resolve_expiring_link(bad_token)
+
+    def test_legacy_link_accepted(self):
+        """Test links signed before compact tokens still resolve."""
+        expiration_time = datetime.utcnow() + timedelta(seconds=300)
+        signed_data = signing.dumps(
+            ("images/test.png", expiration_time.strftime("%Y-%m-%dT%H:%M:%S.%fZ"))
+        )
+
+        name, _ = links.resolve_expiring_link(signed_data)
+
+        self.assertEqual(name, "images/test.png")
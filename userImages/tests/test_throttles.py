@@ -0,0 +1,85 @@
+"""
+Test for the upload rate limit.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import skipUnless
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.test import TestCase, override_settings
+
+from userImages.throttles import UploadRateThrottle
+
+try:
+    import fakeredis
+    import lupa  # noqa: F401
+except ImportError:
+    fakeredis = None
+
+
+class UploadRateThrottleTests(TestCase):
+    """Test the upload token buckets."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create(email="test@example.com")
+
+    def consume_concurrently(self, attempts):
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            return list(
+                executor.map(
+                    lambda _: UploadRateThrottle().consume(self.user, 1),
+                    range(attempts),
+                )
+            )
+
+    @override_settings(UPLOAD_RATE_LIMITS={"Basic": (5, 1)})
+    def test_concurrent_uploads_take_distinct_tokens(self):
+        """Test concurrent uploads of one user never share a token."""
+        cache_set = LocMemCache.set
+
+        def slow_set(*args, **kwargs):
+            # Leave time for other threads to read the bucket before it is set
+            time.sleep(0.01)
+            return cache_set(*args, **kwargs)
+
+        with patch.object(LocMemCache, "set", slow_set):
+            self.assertEqual(self.consume_concurrently(20).count(True), 5)
+
+    @override_settings(UPLOAD_RATE_LIMITS={"Basic": (2, 1)})
+    def test_refund_gives_tokens_back(self):
+        """Test refunded uploads can be taken again, up to the capacity."""
+        throttle = UploadRateThrottle()
+        self.assertTrue(throttle.consume(self.user, 2))
+        self.assertFalse(throttle.consume(self.user, 1))
+
+        throttle.refund(self.user, 5)
+
+        self.assertTrue(throttle.consume(self.user, 2))
+        self.assertFalse(throttle.consume(self.user, 1))
+
+    @skipUnless(fakeredis, "Requires fakeredis with Lua support.")
+    @override_settings(UPLOAD_RATE_LIMITS={"Basic": (5, 1)})
+    def test_redis_bucket_updated_atomically(self):
+        """Test buckets kept in Redis are taken from by a script."""
+        server = fakeredis.FakeServer()
+        redis_caches = {
+            "default": {
+                "BACKEND": "django.core.cache.backends.redis.RedisCache",
+                "LOCATION": "redis://localhost:6379/0",
+                "OPTIONS": {
+                    "connection_class": fakeredis.FakeConnection,
+                    "server": server,
+                },
+            }
+        }
+        with override_settings(CACHES=redis_caches):
+            self.addCleanup(caches["default"].close)
+
+            self.assertEqual(self.consume_concurrently(20).count(True), 5)
+            throttle = UploadRateThrottle()
+            self.assertFalse(throttle.consume(self.user, 1))
+            self.assertGreater(throttle.wait(), 0)
@@ -0,0 +1,110 @@
+"""
+Rate limiting of image uploads.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.redis import RedisCache
+from rest_framework.throttling import BaseThrottle
+
+from .entitlements import get_tier
+
+# Refill the bucket, a hash of the available tokens and the time they were
+# counted, and take the tokens if it holds enough, in one atomic step.
+# Returns the tokens available before taking, as a string since Redis
+# truncates numbers returned by scripts.
+TAKE_TOKENS_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local refill_per_second = tonumber(ARGV[2])
+local tokens = tonumber(ARGV[3])
+local now = tonumber(ARGV[4])
+local bucket = redis.call("HMGET", KEYS[1], "available", "updated")
+local available = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+available = math.min(
+    capacity, available + math.max(now - updated, 0) * refill_per_second
+)
+if available >= tokens then
+    redis.call(
+        "HSET", KEYS[1],
+        "available", tostring(math.min(capacity, available - tokens)),
+        "updated", tostring(now)
+    )
+    redis.call("EXPIRE", KEYS[1], ARGV[5])
+end
+return tostring(available)
+"""
+
+# Buckets in other caches are updated under this lock, which makes the
+# update atomic for the local memory cache of a process.
+bucket_lock = threading.Lock()
+
+
+class UploadRateThrottle(BaseThrottle):
+    """
+    Token bucket of images a user may upload, sized by tier.
+
+    ``UPLOAD_RATE_LIMITS`` maps a tier to the bucket capacity, the burst of
+    images accepted at once, and the images per minute refilling it. Buckets
+    are kept in the default cache, shared by all processes when it is Redis,
+    where they are updated atomically by a script so concurrent uploads of
+    one user cannot take the same tokens.
+    """
+
+    def __init__(self):
+        self.wait_seconds = None
+
+    def allow_request(self, request, view):
+        return self.consume(request.user, 1)
+
+    @staticmethod
+    def bucket_key(user):
+        return f"upload-bucket:{user.pk}"
+
+    def consume(self, user, tokens):
+        """Take ``tokens`` uploads from the user's bucket if it holds enough."""
+        capacity, per_minute = settings.UPLOAD_RATE_LIMITS[get_tier(user)]
+        refill_per_second = per_minute / 60
+        available = self.take(user, tokens, capacity, refill_per_second)
+        if available < tokens:
+            self.wait_seconds = (
+                (tokens - available) / refill_per_second if tokens <= capacity else None
+            )
+            return False
+        return True
+
+    def refund(self, user, tokens):
+        """Give back ``tokens`` uploads taken from the user's bucket."""
+        self.consume(user, -tokens)
+
+    def take(self, user, tokens, capacity, refill_per_second):
+        """
+        Take the tokens from the bucket if it holds enough.
+
+        Returns the tokens the refilled bucket held before taking.
+        """
+        cache = caches["default"]
+        key = self.bucket_key(user)
+        now = time.time()
+        # Unused buckets expire once they would be full again
+        timeout = int(capacity / refill_per_second) + 1
+        if isinstance(cache, RedisCache):
+            key = cache.make_and_validate_key(key)
+            client = cache._cache.get_client(key, write=True)
+            available = client.register_script(TAKE_TOKENS_SCRIPT)(
+                keys=[key], args=[capacity, refill_per_second, tokens, now, timeout]
+            )
+            return float(available)
+        with bucket_lock:
+            available, updated = cache.get(key, (capacity, now))
+            available = min(capacity, available + (now - updated) * refill_per_second)
+            if available >= tokens:
+                cache.set(
+                    key, (min(capacity, available - tokens), now), timeout=timeout
+                )
+        return available
+
+    def wait(self):
+        return self.wait_seconds
@@ -0,0 +1,145 @@
+"""
+Upload handlers hashing and checking files while they are received.
+"""
+import hashlib
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.uploadhandler import (
+    MemoryFileUploadHandler,
+    TemporaryFileUploadHandler,
+)
+from django.http.multipartparser import MultiPartParserError
+from PIL import Image
+
+
+class ImageUploadError(MultiPartParserError):
+    """The upload was rejected from its image header."""
+
+
+def too_many_pixels(image_size):
+    width, height = image_size
+    return width * height > settings.IMAGE_UPLOAD_MAX_PIXELS
+
+
+class HashingUploadHandlerMixin:
+    """
+    Compute the SHA-256 of the uploaded file chunk by chunk.
+
+    The hex digest is set as ``content_hash`` on the uploaded file, so the
+    content never has to be read a second time to deduplicate it.
+    """
+
+    def new_file(self, *args, **kwargs):
+        self.digest = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        data = super().receive_data_chunk(raw_data, start)
+        if data is None:
+            # This handler consumed the chunk
+            self.digest.update(raw_data)
+        return data
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None:
+            file.content_hash = self.digest.hexdigest()
+        return file
+
+
+class HashingMemoryFileUploadHandler(
+    HashingUploadHandlerMixin, MemoryFileUploadHandler
+):
+    """Keep small uploads in memory and hash them."""
+
+
+class HashingTemporaryFileUploadHandler(
+    HashingUploadHandlerMixin, TemporaryFileUploadHandler
+):
+    """Stream large uploads to a temporary file and hash them."""
+
+
+class ImageHeaderUploadHandlerMixin:
+    """
+    Read the image header from the first chunks of the uploaded file.
+
+    Once Pillow identifies the image, its format and ``(width, height)`` are
+    set as ``image_format`` and ``image_size`` on the uploaded file, and
+    images over ``IMAGE_UPLOAD_MAX_PIXELS`` or ``IMAGE_UPLOAD_MAX_BYTES`` are
+    rejected before the rest of the body is parsed. Under WSGI that is before
+    it is received, under ASGI Django has already received the body, bounded
+    by ``core.asgi.RequestBodyLimitMiddleware``. Files not identified in
+    their first ``IMAGE_HEADER_MAX_BYTES``, such as zip archives, are left to
+    the serializers to validate.
+    """
+
+    def new_file(self, *args, **kwargs):
+        self.header = bytearray()
+        self.image_format = None
+        self.image_size = None
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        data = super().receive_data_chunk(raw_data, start)
+        if data is None:
+            # This handler consumed the chunk
+            if self.header is not None:
+                self.read_header(raw_data)
+            if (
+                self.image_size is not None
+                and start + len(raw_data) > settings.IMAGE_UPLOAD_MAX_BYTES
+            ):
+                raise ImageUploadError(
+                    f"Image {self.file_name!r} is larger than "
+                    f"{settings.IMAGE_UPLOAD_MAX_BYTES} bytes."
+                )
+        return data
+
+    def read_header(self, raw_data):
+        self.header += raw_data
+        try:
+            # Opening only parses the header, pixel data is not decoded
+            with Image.open(BytesIO(self.header)) as img:
+                image_format, image_size = img.format, img.size
+        except Image.DecompressionBombError:
+            self.reject_pixels()
+        except Exception:
+            if len(self.header) >= settings.IMAGE_HEADER_MAX_BYTES:
+                self.header = None
+            return
+        self.header = None
+        if too_many_pixels(image_size):
+            self.reject_pixels()
+        self.image_format = image_format
+        self.image_size = image_size
+
+    def reject_pixels(self):
+        raise ImageUploadError(
+            f"Image {self.file_name!r} has more than "
+            f"{settings.IMAGE_UPLOAD_MAX_PIXELS} pixels."
+        )
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None:
+            file.image_format = self.image_format
+            file.image_size = self.image_size
+        return file
+
+
+class ImageMemoryFileUploadHandler(
+    ImageHeaderUploadHandlerMixin, HashingMemoryFileUploadHandler
+):
+    """Keep small uploads in memory, hash them and check their header."""
+
+
+class ImageTemporaryFileUploadHandler(
+    ImageHeaderUploadHandlerMixin, HashingTemporaryFileUploadHandler
+):
+    """
+    Stream large uploads to disk, hash them and check their header.
+
+    With ``FILE_UPLOAD_TEMP_DIR`` on the same filesystem as MEDIA_ROOT, the
+    storage moves the received file into place instead of copying it.
+    """
@@ -1,8 +1,161 @@
-from django.core import signing
+import hashlib
+import os
+import posixpath
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import unquote, urlparse
 
+from django.conf import settings
+from django.core.exceptions import SuspiciousOperation
+from django.core.files.storage import default_storage
+from django.db.models import Q
 
-def generate_expiring_link(original_url, expiration_time):
-    expiration_time_str = expiration_time.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
-    signed_data = signing.dumps((original_url, expiration_time_str))
-    # Append the signed token to the URL as a query parameter
-    return signed_data
+from core import encoders
+from core.models import Image
+from core.storage import file_content_hash, sharded_name
+
+
+def media_name_from_url(url):
+    """
+    Return the storage name of a file from its MEDIA_URL based URL.
+
+    Expiring links sign the storage name, older ones the local media URL.
+    """
+    parsed = urlparse(url)
+    if not parsed.scheme and not parsed.path.startswith("/"):
+        return url
+    path = parsed.path
+    if path.startswith(settings.MEDIA_URL):
+        path = path[len(settings.MEDIA_URL) :]
+    return unquote(path).lstrip("/")
+
+
+def stored_file_exists(name):
+    """Return whether a file, not a directory, is stored under the name."""
+    try:
+        path = default_storage.path(name)
+    except NotImplementedError:
+        # Object storages have no directories
+        return default_storage.exists(name)
+    except SuspiciousOperation:
+        # The name points outside of the storage
+        return False
+    return os.path.isfile(path)
+
+
+def linked_file_name(name):
+    """
+    Return the stored name of the file an expiring link names, or None.
+
+    Links signed before ``shard_media`` moved the files name them directly
+    in images/, they are looked up in their shard directory too.
+    """
+    if stored_file_exists(name):
+        return name
+    if posixpath.dirname(name) == "images" and stored_file_exists(sharded_name(name)):
+        return sharded_name(name)
+    return None
+
+
+def deduplicate_upload(file):
+    """
+    Return the content hash of the file and what to store in the file field.
+
+    If an original with the same content is already stored its name is
+    returned instead of the file, so the content is not written again.
+
+    Call it in the transaction saving the image. The images using the
+    original are locked until it commits, so they cannot be deleted with
+    the file meanwhile. A file no image uses anymore is written again, so
+    its deletion and the media garbage collection leave it alone.
+    """
+    content_hash = file_content_hash(file)
+    name = Image.file.field.generate_filename(
+        Image(content_hash=content_hash), file.name
+    )
+    users = Image.objects.select_for_update().filter(Q(original=name) | Q(file=name))
+    if list(users.values_list("pk", flat=True)) and default_storage.exists(name):
+        return content_hash, name
+    return content_hash, file
+
+
+def accepted_media_types(header):
+    """Return the media types of an Accept header that are not refused."""
+    accepted = set()
+    for item in header.split(","):
+        media_type, *params = item.split(";")
+        quality = 1.0
+        for param in params:
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            accepted.add(media_type.strip().lower())
+    return accepted
+
+
+def negotiate_encoder(accept, fallback):
+    """
+    Return the encoder of the smallest format the client explicitly accepts.
+
+    Only formats listed by name in the Accept header are considered, since
+    wildcards are also sent by clients unable to decode newer formats.
+    ``fallback``, a JPEG encoder every client can read, is used otherwise.
+    """
+    accepted = accepted_media_types(accept)
+    for encoder in settings.THUMBNAIL_NEGOTIATED_ENCODERS:
+        if encoders.media_type(encoder) in accepted and encoders.is_available(
+            encoder["format"]
+        ):
+            return encoder
+    return fallback
+
+
+def rendition_cache_key(instance, height, encoder):
+    """Return the rendition cache key of a thumbnail of the image."""
+    source_key = (
+        instance.content_hash
+        or hashlib.sha256(
+            (instance.original or instance.file.name).encode()
+        ).hexdigest()
+    )
+    return (
+        f"{source_key}-{height}-{encoders.cache_tag(encoder)}"
+        f".{encoders.extension(encoder)}"
+    )
+
+
+class LocalCache:
+    """Least recently used entries of this process, each valid for a timeout."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, timeout):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + timeout, value)
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
@@ -1,23 +1,60 @@
-import os
+import asyncio
+import time
 
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from django.core import signing
-from django.http import HttpResponse
+from django.db import connection, transaction
+from django.http import Http404, HttpResponse, JsonResponse
 from django.utils import timezone
-from rest_framework import viewsets
+from django.utils.cache import (
+    get_conditional_response,
+    patch_cache_control,
+    patch_vary_headers,
+)
+from django.utils.crypto import constant_time_compare
+from django.utils.http import quote_etag
+from django.views import View
+from rest_framework import status, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
-from rest_framework.views import APIView
+from rest_framework.utils.urls import replace_query_param
 
-from core.models import Image
+from core import encoders, metrics
+from core.backends import get_thumbnail_backend
+from core.cleanup import delete_unreferenced_files, image_file_names
+from core.models import Image, Rendition
+from core.rendition_cache import get_rendition_cache
+from core.tasks import render_thumbnail_content
 
+from .entitlements import get_entitlements, get_thumbnail_sizes, get_tier
 from .image_processors import (
     BasicImageProcessor,
     CustomImageProcessor,
     EnterpriseImageProcessor,
     PremiumImageProcessor,
 )
-from .serializers import ImageSerializer
+from .links import InvalidLink, resolve_expiring_link
+from .pagination import ImageCursorPagination, SpritePagination
+from .renderers import ImageRenderer
+from .responses import media_file_response
+from .serializers import (
+    BulkImageUploadSerializer,
+    ImageSerializer,
+    RenditionSerializer,
+)
+from .sprites import Sprite
+from .throttles import UploadRateThrottle
+from .utils import (
+    deduplicate_upload,
+    linked_file_name,
+    media_name_from_url,
+    negotiate_encoder,
+    rendition_cache_key,
+    stored_file_exists,
+)
 
 
 class ImageUploadView(viewsets.ModelViewSet):
@@ -27,66 +64,491 @@ class ImageUploadView(viewsets.ModelViewSet):
 
     permission_classes = [IsAuthenticated]
     serializer_class = ImageSerializer
+    pagination_class = ImageCursorPagination
     queryset = Image.objects.all()
 
+    def get_fields(self):
+        """
+        Return the fields requested with the ``fields`` query parameter.
+
+        Returns None when all fields should be serialized.
+        """
+        if self.request is None or self.action not in ("list", "retrieve"):
+            return None
+        fields = self.request.query_params.get("fields")
+        if not fields:
+            return None
+        return [
+            field for field in fields.split(",") if field in ImageSerializer.Meta.fields
+        ]
+
     def get_queryset(self):
         """
         Filters the queryset based on the user.
         If the user is not logged in, it returns a response with an error message.
         """
-        return self.queryset.filter(user=self.request.user).order_by("-id")
+        queryset = self.queryset.filter(user=self.request.user).order_by("-id")
+        if self.action in ("list", "retrieve"):
+            # Only load the columns the response is going to serialize
+            fields = set(self.get_fields() or ImageSerializer.Meta.fields)
+            if "renditions" in fields:
+                fields.remove("renditions")
+                queryset = queryset.prefetch_related("renditions")
+            queryset = queryset.only("id", "user_id", *fields)
+        return queryset
 
-    def perform_create(self, serializer):
+    def get_throttles(self):
+        """Limit the rate of uploads per user, by tier."""
+        if self.action in ("create", "bulk_upload"):
+            return [UploadRateThrottle()]
+        return super().get_throttles()
+
+    def initial(self, request, *args, **kwargs):
+        self.started = time.perf_counter()
+        super().initial(request, *args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        """Record the latency of successful uploads, by tier."""
+        if self.action in ("create", "bulk_upload") and response.status_code == 201:
+            metrics.UPLOAD_SECONDS.labels(get_tier(request.user), self.action).observe(
+                time.perf_counter() - self.started
+            )
+        return super().finalize_response(request, response, *args, **kwargs)
+
+    def count_upload(self, upload):
+        tier = get_tier(self.request.user)
+        metrics.UPLOAD_IMAGES.labels(tier).inc()
+        metrics.UPLOAD_BYTES.labels(tier).inc(upload.size)
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.setdefault("fields", self.get_fields())
+        return super().get_serializer(*args, **kwargs)
+
+    def process_image(self, instance):
+        """
+        Run the image through the processor of the user's tier.
+
+        Returns the processor, holding the thumbnail jobs still to be submitted.
+        """
         user = self.request.user
-        instance = serializer.save(user=user)
         user_tier = user.tier
-        custom_user_tier = user.custom_tier
-        if custom_user_tier is not None:
-            CustomImageProcessor().process_image(
-                instance, custom_user_tier, self.request
-            )
+        entitlements = get_entitlements(user)
+        instance.original = instance.file.name
+        if entitlements.tier == CustomImageProcessor.tier:
+            processor = CustomImageProcessor()
+            processor.process_image(instance, entitlements, self.request)
         else:
             if user_tier == "Basic":
-                BasicImageProcessor().process_image(instance)
+                processor = BasicImageProcessor()
+                processor.process_image(instance)
                 # Remove URL for main file
                 instance.file = ""
             elif user_tier == "Premium":
-                PremiumImageProcessor().process_image(instance)
+                processor = PremiumImageProcessor()
+                processor.process_image(instance)
             elif user_tier == "Enterprise":
-                EnterpriseImageProcessor().process_image(instance, self.request)
+                processor = EnterpriseImageProcessor()
+                processor.process_image(instance, self.request)
+        return processor
+
+    def perform_create(self, serializer):
+        upload = serializer.validated_data["file"]
+        self.count_upload(upload)
+        width, height = upload.image_size
+        with transaction.atomic():
+            content_hash, file = deduplicate_upload(upload)
+            instance = serializer.save(
+                user=self.request.user,
+                file=file,
+                content_hash=content_hash,
+                width=width,
+                height=height,
+            )
+            processor = self.process_image(instance)
+            instance.save()
+            Rendition.objects.bulk_create(processor.renditions)
+            processor.submit_jobs()
+
+    def perform_update(self, serializer):
+        """
+        Save the image, processing a replaced original like a new upload.
 
-        instance.save()
+        Stored files are named by their content, so the new original is
+        deduplicated and stored under its own hash rather than written over
+        the old one, which other images may share. The renditions are planned
+        again for the new content and the old files deleted on commit once
+        no image uses them anymore.
+        """
+        upload = serializer.validated_data.get("file")
+        if upload is None:
+            serializer.save()
+            return
+        self.count_upload(upload)
+        width, height = upload.image_size
+        old_names = image_file_names(serializer.instance)
+        since = timezone.now()
+        with transaction.atomic():
+            content_hash, file = deduplicate_upload(upload)
+            instance = serializer.save(
+                file=file, content_hash=content_hash, width=width, height=height
+            )
+            instance.renditions.all().delete()
+            processor = self.process_image(instance)
+            instance.save()
+            Rendition.objects.bulk_create(processor.renditions)
+            processor.submit_jobs()
+            transaction.on_commit(lambda: delete_unreferenced_files(old_names, since))
 
+    def bulk_create_images(self, uploads, expiration_time):
+        """
+        Insert the images of the uploads and submit their thumbnail jobs.
 
-class ExpiringImageView(APIView):
-    """View for handling expiring image upload."""
+        Rows are inserted and updated in bulk and all thumbnail jobs are
+        submitted at once, on commit.
+        """
+        images = []
+        with transaction.atomic():
+            for upload in uploads:
+                self.count_upload(upload)
+                content_hash, file = deduplicate_upload(upload)
+                width, height = upload.image_size
+                images.append(
+                    Image(
+                        user=self.request.user,
+                        file=file,
+                        content_hash=content_hash,
+                        width=width,
+                        height=height,
+                        expiration_time=expiration_time,
+                    )
+                )
+            images = Image.objects.bulk_create(images)
 
-    def get(self, request, signed_data):
-        """Get the image from the signed data."""
+            jobs = []
+            renditions = []
+            for instance in images:
+                processor = self.process_image(instance)
+                jobs.extend(processor.jobs)
+                renditions.extend(processor.renditions)
+            Image.objects.bulk_update(
+                images,
+                [
+                    "file",
+                    "original",
+                    "thumbnail_200px",
+                    "thumbnail_400px",
+                    "custom_thumbnail",
+                    "expiration_image",
+                ],
+            )
+            Rendition.objects.bulk_create(renditions)
+            get_thumbnail_backend().submit_on_commit(jobs)
+        return images
+
+    @action(detail=False, methods=["post"], url_path="bulk")
+    def bulk_upload(self, request):
+        """
+        Upload many images in one request.
+
+        Accepts repeated ``files`` parts and/or a zip ``archive``. Every
+        image counts against the upload rate limit.
+        """
+        serializer = BulkImageUploadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        # The throttle already took one upload when the request came in
+        throttle = UploadRateThrottle()
+        if not throttle.consume(
+            request.user, len(serializer.validated_data["files"]) - 1
+        ):
+            # None of the images is accepted, not even the first
+            throttle.refund(request.user, 1)
+            self.throttled(request, throttle.wait())
+
+        uploads = serializer.validated_data["files"]
         try:
-            # Verify the signed data and extract the URL and expiration time
-            url, expiration_time_str = signing.loads(signed_data)
-            expiration_time = timezone.datetime.strptime(
-                expiration_time_str, "%Y-%m-%dT%H:%M:%S.%fZ"
+            images = self.bulk_create_images(
+                uploads, serializer.validated_data.get("expiration_time")
             )
+        finally:
+            # Django only closes the files of the request, not the temporary
+            # files of the images extracted from an archive
+            for upload in uploads:
+                upload.close()
 
-            # Ensure that timezone.now() is in the same timezone as expiration_time
-            now = timezone.now()
-            now = now.replace(tzinfo=expiration_time.tzinfo)
+        data = self.get_serializer(images, many=True).data
+        return Response(data, status=status.HTTP_201_CREATED)
 
-            if now > expiration_time:
-                return Response({"message": "Link has expired."}, status=404)
+    def renditions(self, request, pk=None):
+        """
+        Return the status of the image's thumbnails.
 
-            # Remove any leading '/' from the URL and join it with MEDIA_ROOT
-            full_path = os.path.join(settings.MEDIA_ROOT, url).lstrip("/")
+        The overall ``status`` is failed when any thumbnail failed, pending
+        while any is still being rendered and ready otherwise. Served through
+        ``RenditionStatusView``, which holds the response for the ``wait``.
+        """
+        instance = self.get_object()
+        rendition_wait(request)
+        renditions = list(instance.renditions.order_by("height"))
+        response = Response(rendition_status_data(renditions))
+        if response.data["status"] == Rendition.Status.PENDING:
+            response["Retry-After"] = "1"
+        return response
 
-            if not os.path.isfile(full_path):
-                return Response({"message": "File not found."}, status=404)
+    @action(
+        detail=True,
+        methods=["get"],
+        url_path=r"thumb/(?P<height>\d+)",
+        renderer_classes=[JSONRenderer, ImageRenderer],
+    )
+    def thumb(self, request, pk=None, height=None):
+        """
+        Return a thumbnail of the image, rendering it on first request.
 
-            with open(full_path, "rb") as image_file:
-                response = HttpResponse(image_file, content_type="image/png")
+        Only the heights of the user's tier are available. The thumbnail is
+        encoded in the smallest format the Accept header lists, falling back
+        to the tier's JPEG encoder. Rendered thumbnails are kept in the bounded
+        rendition cache.
+        """
+        height = int(height)
+        if height not in get_thumbnail_sizes(request.user):
+            raise Http404("Thumbnail size not available.")
+        instance = self.get_object()
+        if not instance.original:
+            raise Http404("Original image not available.")
 
+        encoder = negotiate_encoder(
+            request.META.get("HTTP_ACCEPT", ""),
+            encoders.thumbnail_encoder(get_tier(request.user)),
+        )
+        key = rendition_cache_key(instance, height, encoder)
+        etag = quote_etag(key)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            content = get_rendition_cache().get_or_render(
+                key,
+                lambda: render_thumbnail_content(instance.original, height, encoder),
+            )
+            response = HttpResponse(content, content_type=encoders.media_type(encoder))
+        response["ETag"] = etag
+        patch_vary_headers(response, ["Accept"])
+        # The URL keeps its name when the image or its tier's encoder change,
+        # clients revalidate it with the ETag
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    @action(
+        detail=False,
+        methods=["get"],
+        renderer_classes=[JSONRenderer, ImageRenderer],
+    )
+    def sprite(self, request):
+        """
+        Return the thumbnails of a page of the image list in one sprite.
+
+        The page is chosen with the ``cursor`` and ``page_size`` of the list,
+        up to ``SPRITE_MAX_IMAGES`` images, and the thumbnail ``height``
+        defaults to the smallest of the tier. JSON responses hold the
+        coordinate map of the page's images and the versioned URL of the
+        sprite. Image responses are the sprite, encoded like on demand
+        thumbnails and kept in the rendition cache under its version, so it
+        is rendered again only once the page's images change.
+        """
+        sizes = get_thumbnail_sizes(request.user)
+        try:
+            height = int(request.query_params.get("height", min(sizes)))
+        except ValueError:
+            raise ValidationError({"height": "A thumbnail height is required."})
+        if height not in sizes:
+            raise Http404("Thumbnail size not available.")
+
+        paginator = SpritePagination()
+        images = paginator.paginate_queryset(
+            self.get_queryset().only(
+                "id", "user_id", "file", "original", "content_hash", "width", "height"
+            ),
+            request,
+            view=self,
+        )
+        renditions = {
+            rendition.image_id: rendition
+            for rendition in Rendition.objects.filter(
+                image__in=images, height=height, status=Rendition.Status.READY
+            )
+        }
+        tier_encoder = encoders.thumbnail_encoder(get_tier(request.user))
+        sprite = Sprite(images, height, renditions, tier_encoder)
+
+        if request.accepted_renderer.format == ImageRenderer.format:
+            if not sprite.images:
+                raise Http404("No images on this page.")
+            encoder = negotiate_encoder(
+                request.META.get("HTTP_ACCEPT", ""), tier_encoder
+            )
+            key = sprite.cache_key(encoder)
+            etag = quote_etag(key)
+            response = get_conditional_response(request, etag=etag)
+            if response is None:
+                content = get_rendition_cache().get_or_render(
+                    key, lambda: sprite.render(encoder)
+                )
+                response = HttpResponse(
+                    content, content_type=encoders.media_type(encoder)
+                )
+            response["ETag"] = etag
+            patch_vary_headers(response, ["Accept"])
+            if request.query_params.get("version") == sprite.version:
+                # The map links this version, its content never changes
+                patch_cache_control(
+                    response, private=True, max_age=settings.MEDIA_CACHE_MAX_AGE
+                )
+            else:
+                patch_cache_control(response, private=True, no_cache=True)
+            return response
+
+        sprite_url = None
+        if sprite.images:
+            sprite_url = replace_query_param(
+                replace_query_param(request.build_absolute_uri(), "format", "image"),
+                "version",
+                sprite.version,
+            )
+        return Response(
+            {
+                "next": paginator.get_next_link(),
+                "previous": paginator.get_previous_link(),
+                "sprite": sprite_url,
+                "width": sprite.size[0],
+                "height": sprite.size[1],
+                "tiles": sprite.tiles(),
+            }
+        )
+
+
+def rendition_wait(request):
+    """Return the seconds the ``wait`` of the request holds the response."""
+    try:
+        wait = float(request.GET.get("wait", 0))
+    except ValueError:
+        raise ValidationError({"wait": "A number of seconds is required."})
+    return min(max(wait, 0), settings.RENDITION_MAX_WAIT)
+
+
+def rendition_status_data(renditions):
+    """Return the overall status of an image's thumbnails, and theirs."""
+    statuses = {rendition.status for rendition in renditions}
+    if Rendition.Status.FAILED in statuses:
+        overall = Rendition.Status.FAILED
+    elif Rendition.Status.PENDING in statuses:
+        overall = Rendition.Status.PENDING
+    else:
+        overall = Rendition.Status.READY
+    return {
+        "status": overall,
+        "renditions": RenditionSerializer(renditions, many=True).data,
+    }
+
+
+def poll_renditions(image_id):
+    """Return the status of the image's thumbnails, closing the connection."""
+    try:
+        return rendition_status_data(
+            list(Rendition.objects.filter(image_id=image_id).order_by("height"))
+        )
+    finally:
+        close_connection()
+
+
+def close_connection():
+    # Outside of a transaction, so waiting clients hold no connection between
+    # their polls
+    if not connection.in_atomic_block:
+        connection.close()
+
+
+class RenditionStatusView(View):
+    """
+    View holding the status of an image's thumbnails for a ``wait``.
+
+    The image viewset authenticates the request and reads the status in the
+    thread pool. While thumbnails are pending and the wait of up to
+    ``RENDITION_MAX_WAIT`` seconds lasts, the view sleeps in the event loop
+    and reads the status again every ``RENDITION_POLL_INTERVAL`` seconds,
+    closing the database connection in between, so waiting clients hold
+    neither a thread nor a connection.
+    """
+
+    status_view = staticmethod(ImageUploadView.as_view({"get": "renditions"}))
+
+    async def get(self, request, pk):
+        response = await sync_to_async(self.status_view)(request, pk=pk)
+        await sync_to_async(close_connection)()
+        if (
+            response.status_code != 200
+            or response.data["status"] != Rendition.Status.PENDING
+        ):
             return response
 
-        except signing.BadSignature:
-            raise Response({"message": "Invalid or expired link."})
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + rendition_wait(request)
+        data = response.data
+        while data["status"] == Rendition.Status.PENDING and loop.time() < deadline:
+            await asyncio.sleep(settings.RENDITION_POLL_INTERVAL)
+            data = await sync_to_async(poll_renditions)(pk)
+
+        response.data = data
+        if data["status"] != Rendition.Status.PENDING:
+            del response["Retry-After"]
+        return response
+
+
+class ExpiringImageView(View):
+    """
+    View for handling expiring image links.
+
+    The view is asynchronous: under ASGI the storage is queried in the thread
+    pool and the file streamed from the event loop, so slow clients do not
+    hold a thread for the whole download.
+    """
+
+    async def get(self, request, signed_data):
+        """Get the image from the signed data."""
+        try:
+            name, expires = await sync_to_async(resolve_expiring_link)(signed_data)
+        except InvalidLink as e:
+            return JsonResponse({"message": str(e)}, status=404)
+        remaining_seconds = int(expires - time.time())
+
+        name = await sync_to_async(linked_file_name)(media_name_from_url(name))
+        if name is None:
+            return JsonResponse({"message": "File not found."}, status=404)
+
+        # Caches may keep the file no longer than the link stays valid
+        return await sync_to_async(media_file_response)(
+            request, name, min(remaining_seconds, settings.MEDIA_CACHE_MAX_AGE)
+        )
+
+
+def metrics_view(request):
+    """
+    Expose the Prometheus metrics of the pipeline.
+
+    With ``METRICS_TOKEN`` set, scrapers must send it as a bearer token.
+    """
+    if settings.METRICS_TOKEN and not constant_time_compare(
+        request.META.get("HTTP_AUTHORIZATION", ""), f"Bearer {settings.METRICS_TOKEN}"
+    ):
+        return HttpResponse(status=401)
+    content, content_type = metrics.exposition()
+    return HttpResponse(content, content_type=content_type)
+
+
+def serve_media(request, path):
+    """
+    Serve uploaded images and thumbnails in development.
+
+    Stored files are never overwritten in place, so they are sent as public
+    and immutable with a long max-age.
+    """
+    if not stored_file_exists(path):
+        raise Http404("File not found.")
+    return media_file_response(request, path, settings.MEDIA_CACHE_MAX_AGE, public=True)